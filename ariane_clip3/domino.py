@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
+import threading
 from ariane_clip3 import driver_factory
 
 __author__ = 'mffrench'
@@ -39,13 +40,33 @@ class DominoActivator(object):
         self.publisher = None
 
 class DominoReceptor(object):
+    """
+    The receptors created with the same driver arguments share one driver : their topics are multiplexed on the driver
+    subscriber. The shared driver is stopped with its last receptor.
+    """
+    drivers_registry = {}
+    drivers_registry_lock = threading.Lock()
+
     def __init__(self, driver_args, receptor_args):
         LOGGER.debug("DominoReceptor.__init__")
-        self.driver = driver_factory.DriverFactory.make(driver_args)
-        self.driver.start()
-        self.subscriber = self.driver.make_subscriber(my_args=receptor_args)
+        self.driver_key = str(sorted(driver_args.items()))
+        self.receptor_args = receptor_args
+        with DominoReceptor.drivers_registry_lock:
+            if self.driver_key not in DominoReceptor.drivers_registry:
+                driver = driver_factory.DriverFactory.make(dict(driver_args))
+                driver.start()
+                DominoReceptor.drivers_registry[self.driver_key] = [driver, 0]
+            DominoReceptor.drivers_registry[self.driver_key][1] += 1
+            self.driver = DominoReceptor.drivers_registry[self.driver_key][0]
+            self.subscriber = self.driver.make_subscriber(my_args=receptor_args)
 
     def stop(self):
         LOGGER.debug("DominoReceptor.stop")
-        self.driver.stop()
+        with DominoReceptor.drivers_registry_lock:
+            DominoReceptor.drivers_registry[self.driver_key][1] -= 1
+            if DominoReceptor.drivers_registry[self.driver_key][1] == 0:
+                DominoReceptor.drivers_registry.pop(self.driver_key)
+                self.driver.stop()
+            else:
+                self.subscriber.unsubscribe(self.receptor_args).get()
         self.subscriber = None
@@ -17,6 +17,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import json
 import logging
+import threading
+import time
+import zlib
 
 __author__ = 'mffrench'
 
@@ -39,6 +42,9 @@ class DriverTools(object):
     MSG_RETRY_COUNT = "MSG_RETRY_COUNT"
     MSG_TRACE = "MSG_TRACE"
 
+    MSG_CONTENT_ENCODING = "MSG_CONTENT_ENCODING"
+    MSG_ACCEPT_ENCODING = "MSG_ACCEPT_ENCODING"
+
     MSG_SPLIT_COUNT = "MSG_SPLIT_COUNT"
     MSG_SPLIT_MID = "MSG_SPLIT_MID"
     MSG_SPLIT_OID = "MSG_SPLIT_OID"
@@ -255,3 +261,119 @@ class DriverResponse(object):
         """
         LOGGER.debug("DriverResponse.get")
         return self
+
+
+class DriverCompression(object):
+    """
+    opt-in compression of the message bodies : bodies bigger than threshold bytes are deflated (zlib) and the message
+    is flagged with the deflate content encoding. A peer which can't decompress (like the Ariane server) can't read a
+    compressed body : bodies sent to a queue are compressed only once the peer consuming it has advertised deflate
+    with the MSG_ACCEPT_ENCODING property of its replies. Compression ratio and CPU time are reported per queue.
+    :param threshold: the min body size (bytes) to compress. Default 0 : compression disabled
+    """
+
+    CONTENT_ENCODING_DEFLATE = "deflate"
+    COMPRESSION_LEVEL = 6
+    DECOMPRESSED_ENCODINGS = [CONTENT_ENCODING_DEFLATE, "gzip"]
+
+    def __init__(self, threshold=0):
+        self.threshold = threshold
+        # the queues whose peer advertised it can decompress deflate bodies
+        self.accepting_queues = set()
+        # queue -> {compressed, compressed_bytes_in, compressed_bytes_out, compress_time, decompressed,
+        # decompressed_bytes_in, decompressed_bytes_out, decompress_time}
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    def _queue_stats(self, queue):
+        if queue not in self.stats:
+            self.stats[queue] = {
+                'compressed': 0,
+                'compressed_bytes_in': 0,
+                'compressed_bytes_out': 0,
+                'compress_time': 0,
+                'decompressed': 0,
+                'decompressed_bytes_in': 0,
+                'decompressed_bytes_out': 0,
+                'decompress_time': 0
+            }
+        return self.stats[queue]
+
+    def on_accept_encoding(self, queue, accept_encoding):
+        """
+        record the content encodings the peer consuming queue advertised in a reply
+        :param queue: the queue the request was sent to
+        :param accept_encoding: the reply MSG_ACCEPT_ENCODING property value like "deflate, gzip". None if the reply
+        does not advertise it : what is known about the peer is kept
+        """
+        if accept_encoding is None:
+            return
+        accepted = DriverCompression.CONTENT_ENCODING_DEFLATE in [encoding.strip() for encoding in
+                                                                  str(accept_encoding).split(',')]
+        with self.stats_lock:
+            if accepted:
+                self.accepting_queues.add(queue)
+            else:
+                self.accepting_queues.discard(queue)
+
+    def compress(self, queue, body):
+        """
+        compress the body if compression is enabled, the peer consuming queue can decompress it and the body is bigger
+        than threshold
+        :param queue: the queue the body is sent to
+        :param body: the body (bytes)
+        :return: (body, content encoding). The content encoding is None if the body is not compressed
+        """
+        if self.threshold <= 0 or body.__len__() < self.threshold or queue not in self.accepting_queues:
+            return body, None
+        start_time = time.thread_time()
+        compressed_body = zlib.compress(body, DriverCompression.COMPRESSION_LEVEL)
+        compress_time = time.thread_time() - start_time
+        if compressed_body.__len__() >= body.__len__():
+            # not compressible : sent as is
+            return body, None
+        with self.stats_lock:
+            stats = self._queue_stats(queue)
+            stats['compressed'] += 1
+            stats['compressed_bytes_in'] += body.__len__()
+            stats['compressed_bytes_out'] += compressed_body.__len__()
+            stats['compress_time'] += compress_time
+        return compressed_body, DriverCompression.CONTENT_ENCODING_DEFLATE
+
+    def decompress(self, queue, body, content_encoding):
+        """
+        decompress the body according to its content encoding
+        :param queue: the queue the body is received from
+        :param body: the body (bytes like)
+        :param content_encoding: the message content encoding. The body is returned as is if it is not deflate or gzip
+        :return: the decompressed body (bytes)
+        """
+        if content_encoding not in DriverCompression.DECOMPRESSED_ENCODINGS:
+            return body
+        start_time = time.thread_time()
+        # zlib or gzip header auto detection
+        decompressed_body = zlib.decompress(body, 32 + zlib.MAX_WBITS)
+        decompress_time = time.thread_time() - start_time
+        with self.stats_lock:
+            stats = self._queue_stats(queue)
+            stats['decompressed'] += 1
+            stats['decompressed_bytes_in'] += body.__len__()
+            stats['decompressed_bytes_out'] += decompressed_body.__len__()
+            stats['decompress_time'] += decompress_time
+        return decompressed_body
+
+    def get_stats(self):
+        """
+        get the compression statistics per queue (CPU times in sec)
+        :return: dict like {queue: {compressed, compressed_bytes_in, compressed_bytes_out, compression_ratio,
+        compress_time, decompressed, decompressed_bytes_in, decompressed_bytes_out, decompression_ratio,
+        decompress_time}}
+        """
+        with self.stats_lock:
+            stats = {queue: dict(queue_stats) for queue, queue_stats in self.stats.items()}
+        for queue_stats in stats.values():
+            queue_stats['compression_ratio'] = queue_stats['compressed_bytes_in'] / \
+                queue_stats['compressed_bytes_out'] if queue_stats['compressed_bytes_out'] else 0
+            queue_stats['decompression_ratio'] = queue_stats['decompressed_bytes_out'] / \
+                queue_stats['decompressed_bytes_in'] if queue_stats['decompressed_bytes_in'] else 0
+        return stats
@@ -18,7 +18,9 @@
 import logging
 from ariane_clip3 import exceptions
 from ariane_clip3.rabbitmq import driver as rabbitmqd
+from ariane_clip3.rabbitmq import aio_driver as rabbitmqaiod
 from ariane_clip3.rest import driver as restd
+from ariane_clip3.rest import aio_driver as restaiod
 from ariane_clip3.zeromq import driver as zeromqd
 from ariane_clip3.natsd import driver as natsd
 
@@ -29,7 +31,9 @@ LOGGER = logging.getLogger(__name__)
 class DriverFactory(object):
 
     DRIVER_RBMQ = "RBMQ"
+    DRIVER_RBMQ_AIO = "RBMQ_AIO"
     DRIVER_REST = "REST"
+    DRIVER_REST_AIO = "REST_AIO"
     DRIVER_Z0MQ = "Z0MQ"
     DRIVER_NATS = "NATS"
 
@@ -43,8 +47,12 @@ class DriverFactory(object):
 
         if my_args['type'] is DriverFactory.DRIVER_RBMQ:
             return rabbitmqd.Driver(my_args)
+        elif my_args['type'] is DriverFactory.DRIVER_RBMQ_AIO:
+            return rabbitmqaiod.Driver(my_args)
         elif my_args['type'] is DriverFactory.DRIVER_REST:
             return restd.Driver(my_args)
+        elif my_args['type'] is DriverFactory.DRIVER_REST_AIO:
+            return restaiod.Driver(my_args)
         elif my_args['type'] is DriverFactory.DRIVER_Z0MQ:
             return zeromqd.Driver(my_args)
         elif my_args['type'] is DriverFactory.DRIVER_NATS:
@@ -54,8 +54,8 @@ class MappingService(object):
         :return:
         """
         LOGGER.debug("MappingService.__init__")
-        MappingService.driver_type = mapping_driver['type']
         self.driver = driver_factory.DriverFactory.make(mapping_driver)
+        MappingService.driver_type = MappingService.service_driver_type(self.driver)
         self.driver.start()
         if MappingService.driver_type != DriverFactory.DRIVER_REST:
             args = {'request_q': 'ARIANE_MAPPING_SERVICE_Q'}
@@ -70,9 +70,20 @@ class MappingService(object):
         self.link_service = LinkService(self.driver)
         self.transport_service = TransportService(self.driver)
 
+    @staticmethod
+    def service_driver_type(mapping_driver):
+        """
+        :param mapping_driver: the mapping driver
+        :return: the driver type the mapping services build their calls for : the REST one for the asyncio REST
+        driver which takes the same call arguments
+        """
+        if mapping_driver.type == DriverFactory.DRIVER_REST_AIO:
+            return DriverFactory.DRIVER_REST
+        return mapping_driver.type
+
     def stop(self):
         LOGGER.debug("MappingService.stop")
-        if MappingService.driver_type != DriverFactory.DRIVER_REST:
+        if self.driver.type != DriverFactory.DRIVER_REST:
             self.driver.stop()
         self.session_service = None
         self.cluster_service = None
@@ -95,7 +106,7 @@ class SessionService(object):
         :return:
         """
         LOGGER.debug("SessionService.__init__")
-        MappingService.driver_type = mapping_driver.type
+        MappingService.driver_type = MappingService.service_driver_type(mapping_driver)
         if MappingService.driver_type != DriverFactory.DRIVER_REST:
             args = {'request_q': 'ARIANE_MAPPING_SESSION_SERVICE_Q'}
             SessionService.requester = mapping_driver.make_requester(args)
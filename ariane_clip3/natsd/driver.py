@@ -18,24 +18,28 @@
 import asyncio
 from asyncio.base_events import BaseEventLoop
 import base64
+import collections
 import copy
 import json
+import mmap
+import queue
 import socket
+import tempfile
 import timeit
 import traceback
 import uuid
 import logging
 import threading
+from urllib.parse import urlparse
 
 from nats.aio.client import Client
 from nats.aio.utils import new_inbox
 from nats.aio.errors import ErrNoServers
-import time
 import pykka
 import sys
 
 from ariane_clip3 import exceptions
-from ariane_clip3.driver_common import DriverTools, DriverResponse
+from ariane_clip3.driver_common import DriverTools, DriverResponse, DriverCompression
 from ariane_clip3.exceptions import ArianeMessagingTimeoutError, ArianeError
 
 LOGGER = logging.getLogger(__name__)
@@ -43,16 +47,464 @@ LOGGER = logging.getLogger(__name__)
 __author__ = 'mffrench'
 
 
-class Requester(pykka.ThreadingActor):
+class Connection(object):
     """
-    NATS requester implementation
-    :param my_args: dict like {connection, request_q}
+    NATS connection : one NATS client running on its own asyncio event loop thread, or on the caller event loop if
+    provided. A connection is shared by several requesters and services which are just subscriptions on top of it.
+    The connection is opened on the first available server of the servers list (or host:port) and the NATS client
+    reconnects by itself to the next one when it is lost, restoring subscriptions. The servers order depends on the
+    server_selection mode :
+    - ordered (default) : the servers list order,
+    - random : a random order,
+    - latency : the fastest server first according to a TCP connect probe made on each (re)start.
+    :param connection_args: dict like {user, password, host|servers[, port, client_properties, server_selection,
+    connect_timeout, reconnect_time_wait, max_reconnect_attempts, ping_interval, max_outstanding_pings]}
+    :param name: the connection name as seen by the NATS server
+    :param loop: the caller asyncio event loop. Default None : the connection runs its own event loop thread
+    """
+
+    SERVER_SELECTION_ORDERED = "ordered"
+    SERVER_SELECTION_RANDOM = "random"
+    SERVER_SELECTION_LATENCY = "latency"
+
+    def __init__(self, connection_args=None, name=None, loop=None):
+        """
+        NATS connection constructor
+        :param connection_args: dict like {user, password, host|servers[, port, client_properties, server_selection,
+        connect_timeout, reconnect_time_wait, max_reconnect_attempts, ping_interval, max_outstanding_pings]}
+        :param name: the connection name as seen by the NATS server
+        :param loop: the caller asyncio event loop. Default None : the connection runs its own event loop thread
+        :return: self
+        """
+        LOGGER.debug("natsd.Connection.__init__")
+        Driver.validate_driver_conf(connection_args)
+        self.servers = []
+        for server in connection_args['servers']:
+            if "://" not in server:
+                if ":" not in server:
+                    server += ":" + str(connection_args['port'])
+                server = "nats://" + connection_args['user'] + ":" + connection_args['password'] + "@" + server
+            self.servers.append(server)
+        self.server_selection = connection_args['server_selection']
+        self.options = {
+            "connect_timeout": connection_args['connect_timeout'],
+            "reconnect_time_wait": connection_args['reconnect_time_wait'],
+            "max_reconnect_attempts": connection_args['max_reconnect_attempts'],
+            "ping_interval": connection_args['ping_interval'],
+            "max_outstanding_pings": connection_args['max_outstanding_pings'],
+            "allow_reconnect": True,
+            "dont_randomize": self.server_selection != Connection.SERVER_SELECTION_RANDOM
+        }
+        self.stats = {
+            'disconnects': 0,
+            'reconnects': 0,
+            'last_disconnect_time': None,
+            'last_reconnect_duration': None
+        }
+        if name is None:
+            name = connection_args['client_properties']['ariane.app'] + "@" + socket.gethostname()
+        self.name = name
+        self.loop = loop
+        # with a caller event loop the connection must be started and stopped with start_async and stop_async
+        self.external_loop = loop is not None
+        self.nc = None
+        self.thread = None
+        self.is_started = False
+        self.max_payload = 0
+        # subscription key -> {subject, cb, ssid}. Kept to subscribe again on restart.
+        self.subscriptions = {}
+        self.subscriptions_count = 0
+        self.lock = threading.Lock()
+        # set while the NATS client is connected : requests are buffered by requesters while it is not
+        self.available = threading.Event()
+        self.available_waiters = []
+        self.available_listeners = []
+
+    def run_event_loop(self):
+        LOGGER.debug("natsd.Connection.run_event_loop")
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run_coroutine(self, coroutine, timeout=None):
+        """
+        run a coroutine on the connection event loop and wait its result (to be called from outside the loop)
+        :param coroutine: the coroutine to run
+        :param timeout: max time to wait the result (sec). Default None : no timeout
+        :return: the coroutine result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    async def start_async(self):
+        """
+        connect to NATS server from the caller event loop
+        :return: self
+        """
+        LOGGER.debug("natsd.Connection.start_async")
+        if not self.is_started:
+            await self.connect()
+        return self
+
+    async def stop_async(self):
+        """
+        close the NATS connection from the caller event loop
+        :return: self
+        """
+        LOGGER.debug("natsd.Connection.stop_async")
+        if self.is_started:
+            self.is_started = False
+            self.available.clear()
+            try:
+                await self.nc.close()
+            except Exception as e:
+                LOGGER.warn("natsd.Connection.stop_async - exception on close : " + traceback.format_exc())
+            self.subscriptions.clear()
+        return self
+
+    async def _probe_server_latency(self, server):
+        """
+        measure the TCP connect time to a NATS server
+        :param server: the server URL
+        :return: the connect time (sec) or None if the server is not reachable
+        """
+        uri = urlparse(server)
+        start_time = timeit.default_timer()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(uri.hostname, uri.port),
+                                                    self.options['connect_timeout'])
+        except Exception as e:
+            LOGGER.warn("natsd.Connection._probe_server_latency - " + uri.hostname + ":" + str(uri.port) +
+                        " is not reachable : " + str(e))
+            return None
+        latency = timeit.default_timer() - start_time
+        writer.close()
+        return latency
+
+    async def _select_servers(self):
+        """
+        :return: the servers list in the order they should be tried
+        """
+        if self.server_selection != Connection.SERVER_SELECTION_LATENCY or self.servers.__len__() < 2:
+            return self.servers
+        latencies = await asyncio.gather(*[self._probe_server_latency(server) for server in self.servers])
+        # unreachable servers last
+        ranked_servers = sorted(zip(latencies, range(0, self.servers.__len__())),
+                                key=lambda ranked: (ranked[0] is None, ranked[0] or 0, ranked[1]))
+        return [self.servers[ranked[1]] for ranked in ranked_servers]
+
+    def _set_available(self):
+        # on the connection event loop
+        self.available.set()
+        for waiter in self.available_waiters:
+            if not waiter.done():
+                waiter.set_result(True)
+        self.available_waiters.clear()
+        for listener in list(self.available_listeners):
+            try:
+                listener()
+            except Exception as e:
+                LOGGER.warn("natsd.Connection._set_available - exception on listener : " + traceback.format_exc())
+
+    def is_available(self):
+        """
+        :return: True if the NATS client is connected and ready to publish
+        """
+        return self.available.is_set()
+
+    def wait_available(self, timeout=None):
+        """
+        wait the NATS client is connected (not to be called from the connection event loop)
+        :param timeout: max time to wait (sec). Default None : no timeout
+        :return: True if the NATS client is connected, False on timeout
+        """
+        return self.available.wait(timeout)
+
+    async def wait_available_async(self, timeout=None):
+        """
+        wait the NATS client is connected from the connection event loop
+        :param timeout: max time to wait (sec). Default None : no timeout
+        :return: True if the NATS client is connected, False on timeout
+        """
+        if self.available.is_set():
+            return True
+        waiter = self.loop.create_future()
+        self.available_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if waiter in self.available_waiters:
+                self.available_waiters.remove(waiter)
+
+    def add_available_listener(self, listener):
+        """
+        add a listener called on the connection event loop each time the NATS client is (re)connected
+        :param listener: function without argument
+        :return:
+        """
+        self.available_listeners.append(listener)
+
+    def remove_available_listener(self, listener):
+        """
+        remove a listener added with add_available_listener
+        :param listener: the listener to remove
+        :return:
+        """
+        if listener in self.available_listeners:
+            self.available_listeners.remove(listener)
+
+    async def _on_disconnected(self):
+        self.available.clear()
+        self.stats['disconnects'] += 1
+        self.stats['last_disconnect_time'] = timeit.default_timer()
+        LOGGER.warn("natsd.Connection._on_disconnected - " + self.name + " disconnected")
+
+    async def _on_reconnected(self):
+        self.stats['reconnects'] += 1
+        if self.stats['last_disconnect_time'] is not None:
+            self.stats['last_reconnect_duration'] = timeit.default_timer() - self.stats['last_disconnect_time']
+        self.max_payload = self.nc._max_payload
+        LOGGER.warn("natsd.Connection._on_reconnected - " + self.name + " reconnected to " +
+                    str(self.nc.connected_url.hostname) + ":" + str(self.nc.connected_url.port) + " in " +
+                    str(self.stats['last_reconnect_duration']) + " sec")
+        self._set_available()
+
+    async def _on_error(self, e):
+        LOGGER.warn("natsd.Connection._on_error - " + self.name + " : " + str(e))
+
+    async def _on_closed(self):
+        LOGGER.debug("natsd.Connection._on_closed - " + self.name + " closed")
+
+    def is_closed(self):
+        """
+        :return: True if the NATS client is closed (stopped or no more reconnect attempts)
+        """
+        return self.nc is None or self.nc.is_closed
+
+    def is_reconnecting(self):
+        """
+        :return: True if the NATS client is reconnecting
+        """
+        return self.nc is not None and self.nc.is_reconnecting
+
+    def get_stats(self):
+        """
+        get the connection statistics
+        :return: dict like {connected_server, is_reconnecting, disconnects, reconnects, last_disconnect_time,
+        last_reconnect_duration}
+        """
+        stats = dict(self.stats)
+        stats['is_reconnecting'] = self.is_reconnecting()
+        if self.nc is not None and self.nc.connected_url is not None:
+            stats['connected_server'] = self.nc.connected_url.hostname + ":" + str(self.nc.connected_url.port)
+        else:
+            stats['connected_server'] = None
+        return stats
+
+    async def connect(self):
+        LOGGER.debug("natsd.Connection.connect")
+        self.nc = Client()
+        options = dict(self.options)
+        options.update({
+            "servers": await self._select_servers(),
+            "name": self.name,
+            "io_loop": self.loop,
+            "disconnected_cb": self._on_disconnected,
+            "reconnected_cb": self._on_reconnected,
+            "error_cb": self._on_error,
+            "closed_cb": self._on_closed
+        })
+        await self.nc.connect(**options)
+        self.max_payload = self.nc._max_payload
+        for subscription in self.subscriptions.values():
+            subscription['ssid'] = await self.nc.subscribe(subscription['subject'], cb=subscription['cb'])
+        self.is_started = True
+        self._set_available()
+
+    def start(self):
+        """
+        start the event loop thread (if the connection has no caller event loop) and connect to NATS server. Not to
+        be called from the connection event loop : use start_async there.
+        :return: self
+        """
+        LOGGER.debug("natsd.Connection.start")
+        with self.lock:
+            if self.is_started:
+                return self
+            if not self.external_loop:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.run_event_loop, name=self.name + " thread")
+                self.thread.start()
+            try:
+                self.run_coroutine(self.connect())
+            except ErrNoServers as e:
+                LOGGER.error("natsd.Connection.start - unable to connect to " + self.name + " : " + str(e))
+                if not self.external_loop:
+                    self._stop_event_loop()
+                raise e
+        return self
+
+    def _stop_event_loop(self):
+        try:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=120)
+            if self.thread.is_alive():
+                LOGGER.error("natsd.Connection.stop - unable to stop aio loop after 120 sec")
+            else:
+                self.loop.close()
+        except Exception as e:
+            LOGGER.warn("natsd.Connection.stop - exception on aio clean : "
+                        + traceback.format_exc())
+
+    def stop(self):
+        """
+        close the NATS connection and stop the event loop thread
+        :return: self
+        """
+        LOGGER.debug("natsd.Connection.stop")
+        with self.lock:
+            if not self.is_started:
+                return self
+            self.is_started = False
+            self.available.clear()
+            try:
+                self.run_coroutine(self.nc.close(), timeout=10)
+            except Exception as e:
+                LOGGER.warn("natsd.Connection.stop - exception on close : " + traceback.format_exc())
+            if not self.external_loop:
+                self._stop_event_loop()
+            self.subscriptions.clear()
+        return self
+
+    def restart(self):
+        """
+        close and open again the NATS connection. Current subscriptions are restored.
+        :return: self
+        """
+        LOGGER.debug("natsd.Connection.restart - restart begin !")
+        with self.lock:
+            self.is_started = False
+            self.available.clear()
+            try:
+                self.run_coroutine(self.nc.close(), timeout=10)
+            except Exception as e:
+                LOGGER.warn("natsd.Connection.restart - exception on close : " + traceback.format_exc())
+            self.run_coroutine(self.connect())
+        LOGGER.debug("natsd.Connection.restart - restart end !")
+        return self
+
+    def subscribe(self, subject, cb):
+        """
+        subscribe to subject. Callback is called on the connection event loop thread.
+        :param subject: the subject to subscribe
+        :param cb: the callback treating the received messages
+        :return: the subscription key to unsubscribe
+        """
+        LOGGER.debug("natsd.Connection.subscribe - " + subject)
+        with self.lock:
+            return self.run_coroutine(self.subscribe_async(subject, cb))
+
+    async def subscribe_async(self, subject, cb):
+        """
+        subscribe to subject from the connection event loop.
+        :param subject: the subject to subscribe
+        :param cb: the callback treating the received messages
+        :return: the subscription key to unsubscribe
+        """
+        self.subscriptions_count += 1
+        key = self.subscriptions_count
+        ssid = await self.nc.subscribe(subject, cb=cb)
+        self.subscriptions[key] = {'subject': subject, 'cb': cb, 'ssid': ssid}
+        return key
+
+    def unsubscribe(self, key):
+        """
+        unsubscribe
+        :param key: the subscription key returned by subscribe
+        :return:
+        """
+        LOGGER.debug("natsd.Connection.unsubscribe - " + str(key))
+        with self.lock:
+            self.run_coroutine(self.unsubscribe_async(key))
+
+    async def unsubscribe_async(self, key):
+        """
+        unsubscribe from the connection event loop
+        :param key: the subscription key returned by subscribe
+        :return:
+        """
+        subscription = self.subscriptions.pop(key, None)
+        if subscription is not None and self.is_started:
+            await self.nc.unsubscribe(subscription['ssid'])
+
+    def publish(self, subject, payload, reply=None):
+        """
+        publish payload on subject
+        :param subject: the subject to publish on
+        :param payload: the message bytes
+        :param reply: the reply subject if any
+        :return:
+        """
+        self.run_coroutine(self.publish_async(subject, payload, reply))
+
+    async def publish_async(self, subject, payload, reply=None):
+        """
+        publish payload on subject from the connection event loop
+        :param subject: the subject to publish on
+        :param payload: the message bytes
+        :param reply: the reply subject if any
+        :return:
+        """
+        if reply is None:
+            await self.nc.publish(subject, payload)
+        else:
+            await self.nc.publish_request(subject, reply, payload)
+
+    def flush(self, timeout):
+        """
+        flush the pending messages to the NATS server
+        :param timeout: flush timeout (sec)
+        :return:
+        """
+        self.run_coroutine(self.nc.flush(timeout))
+
+    async def flush_async(self, timeout):
+        """
+        flush the pending messages to the NATS server from the connection event loop
+        :param timeout: flush timeout (sec)
+        :return:
+        """
+        await self.nc.flush(timeout)
+
+
+class Requester(object):
+    """
+    NATS requester implementation. Thread safe : many threads can have requests in flight on the same requester,
+    replies being routed to the waiting caller thanks to their correlation ID.
+    While the connection is lost (NATS client reconnecting or connection restart) up to reconnect_buffer_size
+    requests are held : calls waiting a reply wait for the connection, fire and forget calls are buffered and
+    published as soon as the connection is back. A request held more than its buffer_timeout call argument (default
+    reconnect_buffer_timeout sec) is given up.
+    Fire and forget requesters can linger : requests are then published by batches of up to batch_size requests,
+    or of the requests made in linger_ms ms, with one flush per batch instead of one per request.
+    With compression_threshold the requests tell the service it may compress its reply with the MSG_ACCEPT_ENCODING
+    property. Once the service has advertised it can decompress requests with the MSG_ACCEPT_ENCODING property of its
+    replies, the requests bodies bigger than compression_threshold bytes are deflated before their base64 encoding
+    and flagged with the MSG_CONTENT_ENCODING property : services which don't advertise it (like the Ariane server)
+    keep receiving plain requests. Compressed responses are decompressed whatever the requester
+    compression_threshold.
+    :param my_args: dict like {connection, request_q[, fire_and_forget, linger_ms, batch_size,
+    compression_threshold]}
     """
 
     def __init__(self, my_args=None, connection_args=None):
         """
         NATS requester constructor
-        :param my_args: dict like {connection, request_q}
+        :param my_args: dict like {request_q[, connection, fire_and_forget, linger_ms, batch_size,
+        compression_threshold]}. If no connection is provided the requester will open its own. linger_ms and
+        batch_size are used by fire and forget requesters only (default linger_ms 0 : no linger, default batch_size
+        100). compression_threshold default is the connection_args one (default 0 : no compression).
         :param connection_args: dict like {user, password, host[, port, client_properties]}
         :return: self
         """
@@ -65,6 +517,19 @@ class Requester(pykka.ThreadingActor):
             self.fire_and_forget = False
         else:
             self.fire_and_forget = True
+        if not self.fire_and_forget or 'linger_ms' not in my_args or my_args['linger_ms'] is None or \
+                not my_args['linger_ms']:
+            self.linger_ms = 0
+        else:
+            self.linger_ms = float(my_args['linger_ms'])
+        if 'batch_size' not in my_args or my_args['batch_size'] is None or not my_args['batch_size']:
+            self.batch_size = 100
+        else:
+            self.batch_size = int(my_args['batch_size'])
+        if 'compression_threshold' not in my_args or my_args['compression_threshold'] is None:
+            compression_threshold = None
+        else:
+            compression_threshold = int(my_args['compression_threshold'])
         if 'rpc_timeout' not in connection_args or connection_args['rpc_timeout'] is None or \
                 not connection_args['rpc_timeout']:
             # default timeout = no timeout
@@ -88,210 +553,447 @@ class Requester(pykka.ThreadingActor):
 
         Driver.validate_driver_conf(connection_args)
 
-        super(Requester, self).__init__()
         self.connection_args = copy.deepcopy(connection_args)
-        self.servers = [
-            "nats://" + connection_args['user'] + ":" + connection_args['password'] + "@" +
-            connection_args['host']+":"+str(connection_args['port'])
-        ]
-        self.name = self.connection_args['client_properties']['ariane.app'] + "@" + socket.gethostname() + \
-            " - requestor on " + my_args['request_q']
-        self.loop = None
-        self.options = None
-        self.service = None
-        self.nc = Client()
+        if 'connection' in my_args and my_args['connection'] is not None:
+            self.connection = my_args['connection']
+            self.own_connection = False
+        else:
+            self.connection = Connection(self.connection_args,
+                                         self.connection_args['client_properties']['ariane.app'] + "@" +
+                                         socket.gethostname() + " - requestor on " + my_args['request_q'])
+            self.own_connection = True
         self.requestQ = my_args['request_q']
         self.responseQ = None
         self.responseQS = None
-        self.response = None
-        self.split_responses = None
-        self.split_responses_mid = None
+        self.compression = DriverCompression(compression_threshold if compression_threshold is not None else
+                                             self.connection_args['compression_threshold'])
+        # split MID -> {corr_id, parts, received, bytes, last_update[, spill_file, spill_bytes]} of the split
+        # responses being reassembled
+        self.split_responses = {}
+        self.split_responses_bytes = 0
+        self.split_responses_max_bytes = self.connection_args['split_responses_max_bytes']
+        self.split_responses_timeout = self.connection_args['split_responses_timeout']
+        self.split_responses_spill_threshold = self.connection_args['split_responses_spill_threshold']
+        self.split_responses_spill_dir = self.connection_args['split_responses_spill_dir']
+        # TimerHandle of the stale split responses sweep, armed on the connection event loop while split responses are
+        # being reassembled : a split response whose parts stop coming is evicted even if no other part is received
+        self.split_responses_sweeper = None
+        self.split_responses_stats = {
+            'completed': 0,
+            'spilled': 0,
+            'spilled_bytes': 0,
+            'evicted_on_timeout': 0,
+            'evicted_on_budget': 0,
+            'evicted_bytes': 0
+        }
         self.is_started = False
         self.trace = False
         self.max_payload = 0
+        # correlation ID -> {event, response} of the requests waiting for their reply
+        self.pending_calls = {}
+        self.pending_calls_lock = threading.Lock()
+        self.rpc_retry_timeout_err_count_lock = threading.Lock()
+        # requests held while the connection is not available
+        self.reconnect_buffer_size = self.connection_args['reconnect_buffer_size']
+        self.reconnect_buffer_timeout = self.connection_args['reconnect_buffer_timeout']
+        # [(request_q, msgb, deadline), ...] of the fire and forget requests to publish when the connection is back
+        self.outbound_buffer = collections.deque()
+        self.outbound_waiting_calls = 0
+        self.outbound_buffer_lock = threading.Lock()
+        self.outbound_buffer_stats = {
+            'buffered': 0,
+            'sent_after_reconnect': 0,
+            'expired': 0,
+            'rejected': 0
+        }
+        # [(request_q, msgb), ...] of the lingering fire and forget requests
+        self.linger_batch = []
+        self.linger_lock = threading.Lock()
+        # the linger timer of the current batch
+        self.linger_timer = None
+        # the last batch publish task : batches are published in order
+        self.linger_task = None
+        self.publish_stats = {
+            'published': 0,
+            'batches': 0,
+            'batch_size_max': 0,
+            'first_publish_time': None,
+            'last_publish_time': None
+        }
+        self.publish_stats_lock = threading.Lock()
 
         if not self.fire_and_forget:
             self.responseQ = new_inbox()
-            self.response = None
-            self.corr_id = None
-
-    def connect(self):
-        LOGGER.debug("natsd.Requester.connect")
-        try:
-            yield from self.nc.connect(**self.options)
-            if not self.fire_and_forget:
-                self.responseQS = yield from self.nc.subscribe(self.responseQ, cb=self.on_response)
-            self.max_payload = self.nc._max_payload
-            self.is_started = True
-        except ErrNoServers as e:
-            print(e)
-            return
-
-    def run_event_loop(self):
-        LOGGER.debug("natsd.Requester.run_event_loop")
-        self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
-        self.options = {
-            "servers": self.servers,
-            "name": self.name,
-            # "disconnected_cb": self.disconnected_cb,
-            # "reconnected_cb": self.reconnected_cb,
-            # "error_cb": self.error_cb,
-            # "closed_cb": self.closed_cb,
-            "io_loop": self.loop,
-        }
-        self.loop.create_task(self.connect())
-        self.loop.run_forever()
 
-    def on_start(self):
+    def start(self):
         """
         start requester
+        :return: self
         """
-        LOGGER.debug("natsd.Requester.on_start")
-        self.service = threading.Thread(target=self.run_event_loop, name=self.requestQ + " requestor thread")
-        self.service.start()
-        while not self.is_started:
-            time.sleep(0.01)
+        LOGGER.debug("natsd.Requester.start")
+        if self.is_started:
+            return self
+        self.connection.start()
+        if not self.fire_and_forget:
+            self.responseQS = self.connection.subscribe(self.responseQ, self.on_response)
+        self.max_payload = self.connection.max_payload
+        self.connection.add_available_listener(self._on_connection_available)
+        self.is_started = True
+        return self
 
-    def on_stop(self):
+    def stop(self):
         """
         stop requester
+        :return: self
         """
-        LOGGER.debug("natsd.Requester.on_stop")
+        LOGGER.debug("natsd.Requester.stop")
+        if self.linger_ms > 0 and self.is_started:
+            try:
+                self.connection.run_coroutine(self._flush_linger_batch(), timeout=10)
+            except Exception as e:
+                LOGGER.warn("natsd.Requester.stop - exception on linger batch flush : " + traceback.format_exc())
         self.is_started = False
+        self.connection.remove_available_listener(self._on_connection_available)
         try:
-            LOGGER.debug("natsd.Requester.on_stop - unsubscribe from " + str(self.responseQS))
-            next(self.nc.unsubscribe(self.responseQS))
-        except StopIteration as e:
-            pass
-        try:
-            LOGGER.debug("natsd.Requester.on_stop - close nats connection")
-            next(self.nc.close())
-        except StopIteration as e:
-            pass
-        LOGGER.debug("natsd.Requester.on_stop - nc is closed: " + str(self.nc.is_closed))
+            if self.responseQS is not None:
+                LOGGER.debug("natsd.Requester.stop - unsubscribe from " + str(self.responseQS))
+                self.connection.unsubscribe(self.responseQS)
+                self.responseQS = None
+        except Exception as e:
+            LOGGER.warn("natsd.Requester.stop - exception on unsubscribe : " + traceback.format_exc())
+        if self.own_connection:
+            LOGGER.debug("natsd.Requester.stop - close nats connection")
+            self.connection.stop()
+        return self
+
+    async def start_async(self):
+        """
+        start requester from the connection event loop
+        :return: self
+        """
+        LOGGER.debug("natsd.Requester.start_async")
+        if self.is_started:
+            return self
+        await self.connection.start_async()
+        if not self.fire_and_forget:
+            self.responseQS = await self.connection.subscribe_async(self.responseQ, self.on_response)
+        self.max_payload = self.connection.max_payload
+        self.connection.add_available_listener(self._on_connection_available)
+        self.is_started = True
+        return self
+
+    async def stop_async(self):
+        """
+        stop requester from the connection event loop
+        :return: self
+        """
+        LOGGER.debug("natsd.Requester.stop_async")
+        if self.linger_ms > 0 and self.is_started:
+            await self._flush_linger_batch()
+        self.is_started = False
+        self.connection.remove_available_listener(self._on_connection_available)
         try:
-            LOGGER.debug("natsd.Requester.on_stop - cancelling aio tasks loop")
-            loop_to_stop = self.loop
-            for task in asyncio.Task.all_tasks(loop_to_stop):
-                LOGGER.debug("natsd.Requester.on_stop - cancelling task " + str(task))
-                task.cancel()
-            LOGGER.debug("natsd.Requester.on_stop - stopping aio loop stop")
-            loop_to_stop.stop()
-            count = 0
-            while loop_to_stop.is_running():
-                count += 1
-                if count % 10 == 0:
-                    LOGGER.debug("natsd.Requester.on_stop - waiting aio loop to be stopped (" +
-                                 str(asyncio.Task.all_tasks(loop_to_stop).__len__()) + " tasks left; " +
-                                 "current task: " + str(asyncio.Task.current_task(loop_to_stop)) + ")")
-                    for task in asyncio.Task.all_tasks(loop_to_stop):
-                        LOGGER.debug("natsd.Requester.on_stop - cancelling task " + str(task))
-                        task.cancel()
-                time.sleep(1)
-                if count == 120:
-                    LOGGER.error("natsd.Requester.on_stop - unable to stop aio loop after 120 sec (" +
-                                 str(asyncio.Task.all_tasks(loop_to_stop).__len__()) + " tasks left; " +
-                                 "current task: " + str(asyncio.Task.current_task(loop_to_stop)) + ")")
+            if self.responseQS is not None:
+                await self.connection.unsubscribe_async(self.responseQS)
+                self.responseQS = None
+        except Exception as e:
+            LOGGER.warn("natsd.Requester.stop_async - exception on unsubscribe : " + traceback.format_exc())
+        if self.own_connection:
+            await self.connection.stop_async()
+        return self
+
+    def _get_buffer_deadline(self, my_args):
+        if 'buffer_timeout' in my_args and my_args['buffer_timeout'] is not None:
+            return timeit.default_timer() + my_args['buffer_timeout']
+        return timeit.default_timer() + self.reconnect_buffer_timeout
+
+    def _hold_request(self):
+        # count a request held by the requester while the connection is not available
+        with self.outbound_buffer_lock:
+            if self.outbound_buffer.__len__() + self.outbound_waiting_calls >= self.reconnect_buffer_size:
+                self.outbound_buffer_stats['rejected'] += 1
+                raise ArianeError('natsd.Requester.call',
+                                  'NATS connection not available and reconnect buffer is full !')
+            self.outbound_waiting_calls += 1
+            self.outbound_buffer_stats['buffered'] += 1
+
+    def _release_request(self, sent):
+        with self.outbound_buffer_lock:
+            self.outbound_waiting_calls -= 1
+            if sent:
+                self.outbound_buffer_stats['sent_after_reconnect'] += 1
+            else:
+                self.outbound_buffer_stats['expired'] += 1
+
+    def _wait_connection(self, my_args):
+        """
+        wait the connection is available if it is not
+        :param my_args: the call arguments
+        :return: Raise ArianeMessagingTimeoutError if the connection is not back before the request deadline
+        """
+        if self.connection.is_available():
+            return
+        deadline = self._get_buffer_deadline(my_args)
+        self._hold_request()
+        available = self.connection.wait_available(max(deadline - timeit.default_timer(), 0))
+        self._release_request(available)
+        if not available:
+            raise ArianeMessagingTimeoutError('natsd.Requester.call',
+                                              'NATS connection not available before request deadline')
+
+    async def _wait_connection_async(self, my_args):
+        """
+        wait the connection is available if it is not, from the connection event loop
+        :param my_args: the call arguments
+        :return: Raise ArianeMessagingTimeoutError if the connection is not back before the request deadline
+        """
+        if self.connection.is_available():
+            return
+        deadline = self._get_buffer_deadline(my_args)
+        self._hold_request()
+        available = await self.connection.wait_available_async(max(deadline - timeit.default_timer(), 0))
+        self._release_request(available)
+        if not available:
+            raise ArianeMessagingTimeoutError('natsd.Requester.call_async',
+                                              'NATS connection not available before request deadline')
+
+    def _buffer_request(self, my_args, request):
+        """
+        buffer a fire and forget request if the connection is not available (or if older requests are still
+        buffered, to keep the requests order)
+        :param my_args: the call arguments
+        :param request: the request as returned by _make_request
+        :return: True if the request has been buffered
+        """
+        with self.outbound_buffer_lock:
+            if self.connection.is_available() and not self.outbound_buffer:
+                return False
+            if self.outbound_buffer.__len__() + self.outbound_waiting_calls >= self.reconnect_buffer_size:
+                self.outbound_buffer_stats['rejected'] += 1
+                raise ArianeError('natsd.Requester.call',
+                                  'NATS connection not available and reconnect buffer is full !')
+            self.outbound_buffer.append((request['request_q'], request['msgb'], self._get_buffer_deadline(my_args)))
+            self.outbound_buffer_stats['buffered'] += 1
+        if self.connection.is_available():
+            # the connection came back meanwhile
+            self.connection.loop.call_soon_threadsafe(self._on_connection_available)
+        return True
+
+    def _on_connection_available(self):
+        # on the connection event loop
+        if self.outbound_buffer:
+            asyncio.ensure_future(self._flush_outbound_buffer(), loop=self.connection.loop)
+
+    async def _flush_outbound_buffer(self):
+        """
+        publish the buffered fire and forget requests
+        """
+        published = 0
+        while self.connection.is_available():
+            with self.outbound_buffer_lock:
+                if not self.outbound_buffer:
                     break
-            if not loop_to_stop.is_running():
-                LOGGER.debug("natsd.Requester.on_stop - close aio loop")
-                loop_to_stop.close()
+                request_q, msgb, deadline = self.outbound_buffer[0]
+                if deadline < timeit.default_timer():
+                    self.outbound_buffer.popleft()
+                    self.outbound_buffer_stats['expired'] += 1
+                    continue
+            try:
+                await self.connection.publish_async(request_q, msgb)
+            except Exception as e:
+                LOGGER.warn("natsd.Requester._flush_outbound_buffer - exception on publish : " +
+                            traceback.format_exc())
+                break
+            with self.outbound_buffer_lock:
+                self.outbound_buffer.popleft()
+                self.outbound_buffer_stats['sent_after_reconnect'] += 1
+            published += 1
+        if published > 0:
+            LOGGER.debug("natsd.Requester._flush_outbound_buffer - " + str(published) + " buffered requests sent")
+            try:
+                await self.connection.flush_async(1)
+            except Exception as e:
+                LOGGER.warn("natsd.Requester._flush_outbound_buffer - exception on flush : " + traceback.format_exc())
+
+    def _flush(self):
+        try:
+            self.connection.flush(1)
         except Exception as e:
-            LOGGER.warn("natsd.Requester.on_stop - exception on aio clean : "
-                        + traceback.format_exc())
+            if self.connection.is_available():
+                raise e
+            # connection lost meanwhile : the NATS client sends its pending messages on reconnect
+            LOGGER.debug("natsd.Requester._flush - connection lost on flush : " + str(e))
+
+    async def _flush_async(self):
+        try:
+            await self.connection.flush_async(1)
+        except Exception as e:
+            if self.connection.is_available():
+                raise e
+            LOGGER.debug("natsd.Requester._flush_async - connection lost on flush : " + str(e))
+
+    def _count_published(self, count):
+        now = timeit.default_timer()
+        with self.publish_stats_lock:
+            self.publish_stats['published'] += count
+            self.publish_stats['batches'] += 1
+            if count > self.publish_stats['batch_size_max']:
+                self.publish_stats['batch_size_max'] = count
+            if self.publish_stats['first_publish_time'] is None:
+                self.publish_stats['first_publish_time'] = now
+            self.publish_stats['last_publish_time'] = now
+
+    def _linger(self, request):
+        """
+        add a fire and forget request to the linger batch. The batch is published when it is full or linger_ms ms
+        after its first request.
+        :param request: the request as returned by _make_request
+        """
+        with self.linger_lock:
+            self.linger_batch.append((request['request_q'], request['msgb']))
+            # scheduled under the lock : the event loop sees the timers arming and the batches in the same order
+            if self.linger_batch.__len__() >= self.batch_size:
+                ready_batch = self.linger_batch
+                self.linger_batch = []
+                self.connection.loop.call_soon_threadsafe(self._schedule_linger_batch, ready_batch)
+            elif self.linger_batch.__len__() == 1:
+                self.connection.loop.call_soon_threadsafe(self._arm_linger_timer)
+
+    def _arm_linger_timer(self):
+        # on the connection event loop
+        self.linger_timer = self.connection.loop.call_later(self.linger_ms / 1000, self._on_linger_timeout)
+
+    def _on_linger_timeout(self):
+        # on the connection event loop
+        self.linger_timer = None
+        with self.linger_lock:
+            ready_batch = self.linger_batch
+            self.linger_batch = []
+        if ready_batch:
+            self._schedule_linger_batch(ready_batch)
+
+    def _schedule_linger_batch(self, batch):
+        # on the connection event loop. The batch linger timer is useless once the batch is taken
+        if self.linger_timer is not None:
+            self.linger_timer.cancel()
+            self.linger_timer = None
+        self.linger_task = asyncio.ensure_future(self._publish_linger_batch(batch, self.linger_task),
+                                                 loop=self.connection.loop)
+
+    async def _publish_linger_batch(self, batch, previous_task=None):
+        """
+        publish a batch of requests and flush them once
+        :param batch: [(request_q, msgb), ...]
+        :param previous_task: the previous batch publish task to wait for
+        """
+        if previous_task is not None and not previous_task.done():
+            await asyncio.wait([previous_task])
+        try:
+            for request_q, msgb in batch:
+                await self.connection.publish_async(request_q, msgb)
+            await self._flush_async()
+        except Exception as e:
+            LOGGER.warn("natsd.Requester._publish_linger_batch - exception on publish : " + traceback.format_exc())
+            return
+        self._count_published(batch.__len__())
+        LOGGER.debug("natsd.Requester._publish_linger_batch - " + str(batch.__len__()) + " requests published")
+
+    async def _flush_linger_batch(self):
+        """
+        publish the lingering requests now, from the connection event loop
+        """
+        with self.linger_lock:
+            batch = self.linger_batch
+            self.linger_batch = []
+        if batch:
+            self._schedule_linger_batch(batch)
+        if self.linger_task is not None:
+            await asyncio.wait([self.linger_task])
+
+    def get_publish_stats(self):
+        """
+        get the fire and forget publish statistics
+        :return: dict like {published, batches, batch_size_avg, batch_size_max, publish_rate (requests/sec),
+        lingering}
+        """
+        with self.publish_stats_lock:
+            stats = dict(self.publish_stats)
+        stats['batch_size_avg'] = stats['published'] / stats['batches'] if stats['batches'] else 0
+        if stats['first_publish_time'] is not None and stats['last_publish_time'] > stats['first_publish_time']:
+            stats['publish_rate'] = stats['published'] / (stats['last_publish_time'] - stats['first_publish_time'])
+        else:
+            stats['publish_rate'] = 0
+        stats.pop('first_publish_time')
+        stats.pop('last_publish_time')
+        stats['lingering'] = self.linger_batch.__len__()
+        return stats
+
+    def get_outbound_buffer_stats(self):
+        """
+        get the statistics of the requests held while the connection was not available
+        :return: dict like {buffer_size, waiting_calls, buffered, sent_after_reconnect, expired, rejected}
+        """
+        with self.outbound_buffer_lock:
+            stats = dict(self.outbound_buffer_stats)
+            stats['buffer_size'] = self.outbound_buffer.__len__()
+            stats['waiting_calls'] = self.outbound_waiting_calls
+        return stats
 
     def _restart_on_error(self):
         LOGGER.debug("natsd.Requester._restart_on_error - restart begin !")
-        stop_thread = threading.Thread(target=self.on_stop, name=self.requestQ + " restarter.stop on error thread")
-        stop_thread.start()
-        while not self.nc.is_closed:
-            LOGGER.debug("natsd.Requester._restart_on_error - waiting nc to be closed")
-            time.sleep(1)
-        self.on_start()
-        self.rpc_retry_timeout_err_count = 0
+        try:
+            self.connection.restart()
+            self.max_payload = self.connection.max_payload
+        except Exception as e:
+            LOGGER.error("natsd.Requester._restart_on_error - restart failed : " + traceback.format_exc())
+        with self.rpc_retry_timeout_err_count_lock:
+            self.rpc_retry_timeout_err_count = 0
         LOGGER.debug("natsd.Requester._restart_on_error - restart end !")
 
+    def _on_rpc_timeout(self):
+        with self.rpc_retry_timeout_err_count_lock:
+            self.rpc_retry_timeout_err_count += 1
+            restart = self.rpc_retry_timeout_err_count >= self.rpc_retry_timeout_err_count_max
+        # the NATS client reconnects by itself : restart only if it has given up
+        if restart and self.connection.is_closed():
+            with self.rpc_retry_timeout_err_count_lock:
+                self.rpc_retry_timeout_err_count = 0
+            self._restart_after_max_timeout_err_count()
+
     def _restart_after_max_timeout_err_count(self):
         restarter = threading.Thread(target=self._restart_on_error, name=self.requestQ + " restarter on error thread")
         restarter.start()
 
-    def on_failure(self, exception_type, exception_value, traceback_):
-        LOGGER.error("natsd.Requester.on_failure - " + exception_type.__str__() + "/" + exception_value.__str__())
-        LOGGER.error("natsd.Requester.on_failure - " + traceback_.format_exc())
-        self.is_started = False
-        try:
-            next(self.nc.unsubscribe(self.responseQS))
-        except StopIteration as e:
-            pass
-        try:
-            next(self.nc.close())
-        except StopIteration as e:
-            pass
-        try:
-            loop_to_stop = self.loop
-            for task in asyncio.Task.all_tasks(loop_to_stop):
-                task.cancel()
-            loop_to_stop.stop()
-            while loop_to_stop.is_running():
-                time.sleep(1)
-            loop_to_stop.close()
-        except Exception as e:
-            LOGGER.debug("natsd.Requester.on_failure - exception on aio clean : "
-                         + traceback.format_exc())
-
     def on_response(self, msg):
         """
-        setup response if correlation id is the good one
+        setup response of the pending call matching the correlation id
         """
-        LOGGER.debug("natsd.Requester.on_response: " + str(sys.getsizeof(msg)) + " bytes received")
+        LOGGER.debug("natsd.Requester.on_response: " + str(msg.data.__len__()) + " bytes received")
         working_response = json.loads(msg.data.decode())
         working_properties = DriverTools.json2properties(working_response['properties'])
-        working_body = b''+bytes(working_response['body'], 'utf8') if 'body' in working_response else None
+        # base64 decoder takes the ascii str as is : no intermediate bytes copy
+        working_body = working_response['body'] if 'body' in working_response else None
         if DriverTools.MSG_CORRELATION_ID in working_properties:
-            if self.corr_id == working_properties[DriverTools.MSG_CORRELATION_ID]:
+            with self.pending_calls_lock:
+                pending_call = self.pending_calls.get(working_properties[DriverTools.MSG_CORRELATION_ID])
+            if pending_call is not None:
                 if DriverTools.MSG_SPLIT_COUNT in working_properties and \
                         int(working_properties[DriverTools.MSG_SPLIT_COUNT]) > 1:
-                    working_body_decoded = base64.b64decode(working_body) if working_body is not None else None
-                    if self.split_responses is None:
-                        self.split_responses = []
-                        self.split_responses_mid = working_properties[DriverTools.MSG_SPLIT_MID]
-                    if working_properties[DriverTools.MSG_SPLIT_MID] == self.split_responses_mid:
-                        response = {
-                            'properties': working_properties,
-                            'body': working_body_decoded
-                        }
-                        self.split_responses.insert(int(working_properties[DriverTools.MSG_SPLIT_OID]), response)
-
-                        if self.split_responses.__len__() == int(working_properties[DriverTools.MSG_SPLIT_COUNT]):
-                            properties = {}
-                            body = b''
-                            for num in range(0, self.split_responses.__len__()):
-                                properties.update(self.split_responses[num]['properties'])
-                                body += self.split_responses[num]['body']
-                            self.response = {
-                                'properties': properties,
-                                'body': body
-                            }
-                            self.split_responses = None
-                            self.split_responses_mid = None
-
-                    else:
-                        LOGGER.warn("natsd.Requester.on_response - discarded response : (" +
-                                    str(working_properties[DriverTools.MSG_CORRELATION_ID]) + "," +
-                                    str(working_properties[DriverTools.MSG_SPLIT_MID]) + ")")
-                        LOGGER.debug("natsd.Requester.on_response - discarded response : " + str({
-                            'properties': working_properties,
-                            'body': working_body_decoded
-                        }))
+                    working_body_decoded = base64.b64decode(working_body) if working_body is not None else b''
+                    self._on_split_response(pending_call, working_properties, working_body_decoded)
                 else:
                     working_body_decoded = base64.b64decode(working_body) if working_body is not None else \
                         bytes(json.dumps({}), 'utf8')
-                    self.response = {
+                    pending_call['response'] = {
                         'properties': working_properties,
                         'body': working_body_decoded
                     }
+                    pending_call['event'].set()
             else:
+                if DriverTools.MSG_SPLIT_MID in working_properties and \
+                        working_properties[DriverTools.MSG_SPLIT_MID] in self.split_responses:
+                    # the call is gone (timeout) : no need to keep its split response
+                    self._drop_split_response(working_properties[DriverTools.MSG_SPLIT_MID])
                 working_body_decoded = base64.b64decode(working_body) if working_body is not None else None
                 LOGGER.warn("natsd.Requester.on_response - discarded response : " +
                             str(working_properties[DriverTools.MSG_CORRELATION_ID]))
@@ -307,119 +1009,320 @@ class Requester(pykka.ThreadingActor):
                 'body': working_body_decoded
             }))
 
-    def _split_msg(self, split_mid, properties, body):
-        messages = []
-        in_progress_messages = []
-        msg_counter = 0
+    def _on_split_response(self, pending_call, working_properties, working_body_decoded):
+        """
+        store a split response part into its split group and setup the pending call response when the group is
+        complete
+        :param pending_call: the pending call waiting this response
+        :param working_properties: the part properties
+        :param working_body_decoded: the part body (bytes)
+        """
+        now = timeit.default_timer()
+        self._evict_stale_split_responses(now)
+
+        split_mid = working_properties[DriverTools.MSG_SPLIT_MID]
+        split_oid = int(working_properties[DriverTools.MSG_SPLIT_OID])
+        if split_mid not in self.split_responses:
+            # one slot per part : parts are placed by their split OID whatever their arrival order
+            self.split_responses[split_mid] = {
+                'corr_id': working_properties[DriverTools.MSG_CORRELATION_ID],
+                'pending_call': pending_call,
+                'parts': [None] * int(working_properties[DriverTools.MSG_SPLIT_COUNT]),
+                'received': 0,
+                'bytes': 0,
+                'last_update': now
+            }
+            # parts are as big as the max payload allows : the first one gives the response size estimation
+            split_count = self.split_responses[split_mid]['parts'].__len__()
+            if 0 < self.split_responses_spill_threshold < working_body_decoded.__len__() * split_count:
+                self.split_responses[split_mid]['spill_file'] = tempfile.TemporaryFile(
+                    dir=self.split_responses_spill_dir
+                )
+                self.split_responses[split_mid]['spill_bytes'] = 0
+                self.split_responses_stats['spilled'] += 1
+            self._arm_split_responses_sweeper()
+        split_group = self.split_responses[split_mid]
+        if not 0 <= split_oid < split_group['parts'].__len__() or split_group['parts'][split_oid] is not None:
+            LOGGER.warn("natsd.Requester.on_response - discarded response : (" +
+                        str(working_properties[DriverTools.MSG_CORRELATION_ID]) + "," + str(split_mid) + "," +
+                        str(split_oid) + ")")
+            return
 
-        in_progress_properties_field = copy.deepcopy(properties)
-        if DriverTools.MSG_MESSAGE_ID in in_progress_properties_field:
-            in_progress_properties_field.pop(DriverTools.MSG_MESSAGE_ID)
-        if DriverTools.MSG_CORRELATION_ID in in_progress_properties_field:
-            in_progress_properties_field.pop(DriverTools.MSG_CORRELATION_ID)
-        if DriverTools.MSG_TRACE in in_progress_properties_field:
-            in_progress_properties_field.pop(DriverTools.MSG_TRACE)
-        if DriverTools.MSG_REPLY_TO in in_progress_properties_field:
-            in_progress_properties_field.pop(DriverTools.MSG_REPLY_TO)
-
-        wip_body = body
-        wip_body_len = sys.getsizeof(wip_body)
-        consumed_body_offset = 0
+        part_size = working_body_decoded.__len__()
+        if 'spill_file' in split_group:
+            # parts are written in their arrival order : keep their file offset
+            split_group['parts'][split_oid] = {
+                'properties': working_properties,
+                'offset': split_group['spill_bytes'],
+                'length': part_size
+            }
+            split_group['spill_file'].write(working_body_decoded)
+            split_group['spill_bytes'] += part_size
+            self.split_responses_stats['spilled_bytes'] += part_size
+        else:
+            if self.split_responses_bytes + part_size > self.split_responses_max_bytes:
+                self._evict_split_responses_on_budget(split_mid, part_size)
+                if split_mid not in self.split_responses:
+                    return
+            split_group['parts'][split_oid] = {
+                'properties': working_properties,
+                'body': working_body_decoded
+            }
+            split_group['bytes'] += part_size
+            self.split_responses_bytes += part_size
+        split_group['received'] += 1
+        split_group['last_update'] = now
+
+        if split_group['received'] == split_group['parts'].__len__():
+            properties = {}
+            for part in split_group['parts']:
+                properties.update(part['properties'])
+            if 'spill_file' in split_group:
+                body = self._map_spilled_split_response(split_group)
+            else:
+                # the only copy of the body : each part is copied once into the final buffer
+                body = b''.join([part['body'] for part in split_group['parts']])
+            self._drop_split_response(split_mid)
+            self.split_responses_stats['completed'] += 1
+            pending_call['response'] = {
+                'properties': properties,
+                'body': body
+            }
+            pending_call['event'].set()
+
+    def _drop_split_response(self, split_mid):
+        split_group = self.split_responses.pop(split_mid)
+        self.split_responses_bytes -= split_group['bytes']
+        if 'spill_file' in split_group:
+            split_group['spill_file'].close()
+        return split_group
+
+    def _map_spilled_split_response(self, split_group):
+        """
+        memory map the body of a complete spilled split response
+        :param split_group: the split response group
+        :return: the body (mmap.mmap)
+        """
+        spill_file = split_group['spill_file']
+        if split_group['spill_bytes'] == 0:
+            return b''
+        offset = 0
+        for part in split_group['parts']:
+            if part['offset'] != offset:
+                break
+            offset += part['length']
+        else:
+            # parts have been received in order : the file is the body
+            spill_file.flush()
+            return mmap.mmap(spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # otherwise write the parts in order into a new file, a part at a time
+        ordered_file = tempfile.TemporaryFile(dir=self.split_responses_spill_dir)
+        try:
+            for part in split_group['parts']:
+                spill_file.seek(part['offset'])
+                ordered_file.write(spill_file.read(part['length']))
+            ordered_file.flush()
+            return mmap.mmap(ordered_file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            # the mmap keeps its own file descriptor
+            ordered_file.close()
+
+    def _decompress_response_body(self, response):
+        """
+        decompress a response body compressed by the service
+        :param response: dict like {properties, body}
+        :return: the decompressed body (bytes or mmap.mmap)
+        """
+        if DriverTools.MSG_CONTENT_ENCODING not in response['properties']:
+            return response['body']
+        body = response['body']
+        decompressed_body = self.compression.decompress(self.requestQ, body,
+                                                        response['properties'][DriverTools.MSG_CONTENT_ENCODING])
+        if decompressed_body is not body and isinstance(body, mmap.mmap):
+            body.close()
+        return decompressed_body
+
+    def get_compression_stats(self):
+        """
+        get the requests and responses bodies compression statistics
+        :return: dict like {queue: {compressed, compressed_bytes_in, compressed_bytes_out, compression_ratio,
+        compress_time, decompressed, decompressed_bytes_in, decompressed_bytes_out, decompression_ratio,
+        decompress_time}}
+        """
+        return self.compression.get_stats()
 
-        while (wip_body_len - consumed_body_offset) > 0 or in_progress_properties_field.__len__() > 0:
-            # consume properties first :
-            splitted_msg_size = 0
-            splitted_properties = {}
-            if DriverTools.MSG_MESSAGE_ID in properties:
-                splitted_properties[DriverTools.MSG_MESSAGE_ID] = properties[DriverTools.MSG_MESSAGE_ID]
-            if DriverTools.MSG_CORRELATION_ID in properties:
-                splitted_properties[DriverTools.MSG_CORRELATION_ID] = properties[DriverTools.MSG_CORRELATION_ID]
-            if DriverTools.MSG_TRACE in properties:
-                splitted_properties[DriverTools.MSG_TRACE] = properties[DriverTools.MSG_TRACE]
-            if DriverTools.MSG_REPLY_TO in properties:
-                splitted_properties[DriverTools.MSG_REPLY_TO] = properties[DriverTools.MSG_REPLY_TO]
-            splitted_properties[DriverTools.MSG_SPLIT_MID] = split_mid
-            splitted_properties[DriverTools.MSG_SPLIT_COUNT] = sys.maxsize
-            splitted_properties[DriverTools.MSG_SPLIT_OID] = msg_counter
-
-            splitted_typed_properties = None
-            for key, value in properties.items():
-                if key in in_progress_properties_field.keys():
-                    splitted_properties[key] = value
-                    tmp_splitted_typed_properties = []
-                    for skey, svalue in splitted_properties.items():
-                        tmp_splitted_typed_properties.append(DriverTools.property_params(skey, svalue))
-                    msg_data = json.dumps({
-                        'properties': tmp_splitted_typed_properties
-                    })
-                    msgb = b''+bytes(msg_data, 'utf8')
-                    tmp_splitted_msg_size = sys.getsizeof(msgb)
-                    if tmp_splitted_msg_size < self.max_payload:
-                        splitted_typed_properties = tmp_splitted_typed_properties
-                        in_progress_properties_field.pop(key)
-                    else:
-                        splitted_properties.pop(key)
+    @staticmethod
+    def _decode_response_body(body):
+        """
+        decode a response body and release it if it is memory mapped
+        :param body: the response body (bytes or mmap.mmap)
+        :return: the decoded body (str)
+        """
+        try:
+            return str(body, "UTF-8")
+        finally:
+            if isinstance(body, mmap.mmap):
+                body.close()
+
+    def _evict_split_response(self, split_mid, reason):
+        split_group = self._drop_split_response(split_mid)
+        self.split_responses_stats['evicted_on_' + reason] += 1
+        self.split_responses_stats['evicted_bytes'] += split_group['bytes']
+        LOGGER.warn("natsd.Requester.on_response - evicted split response (" + reason + ") : (" +
+                    str(split_group['corr_id']) + "," + str(split_mid) + "," + str(split_group['received']) + "/" +
+                    str(split_group['parts'].__len__()) + " parts," + str(split_group['bytes']) + " bytes)")
+        # wake up the caller waiting this response
+        split_group['pending_call']['error'] = ArianeError('natsd.Requester.call',
+                                                           'Split response evicted on ' + reason)
+        split_group['pending_call']['event'].set()
+
+    def _evict_stale_split_responses(self, now):
+        for split_mid in [split_mid for split_mid, split_group in self.split_responses.items()
+                          if now - split_group['last_update'] >= self.split_responses_timeout]:
+            self._evict_split_response(split_mid, 'timeout')
+
+    def _arm_split_responses_sweeper(self):
+        """
+        schedule the stale split responses sweep at the oldest split response timeout, if not already scheduled.
+        Called on the connection event loop thread.
+        """
+        if self.split_responses_sweeper is not None or not self.split_responses or self.connection.loop is None:
+            return
+        oldest_update = min([split_group['last_update'] for split_group in self.split_responses.values()])
+        delay = max(oldest_update + self.split_responses_timeout - timeit.default_timer(), 0)
+        self.split_responses_sweeper = self.connection.loop.call_later(delay, self._sweep_split_responses)
 
-            msg_data = json.dumps({
-                'properties': splitted_typed_properties
-            })
-            msgb = b''+bytes(msg_data, 'utf8')
-            splitted_msg_size = sys.getsizeof(msgb)
-
-            # then body
-            splitted_body = None
-            if wip_body_len > 0:
-                chunk_size = self.max_payload - splitted_msg_size
-                if chunk_size > (wip_body_len - consumed_body_offset):
-                    chunk_size = wip_body_len - consumed_body_offset
-                splitted_body = wip_body[consumed_body_offset:consumed_body_offset+chunk_size]
-                msg_data = json.dumps({
-                    'properties': splitted_typed_properties,
-                    'body': base64.b64encode(b''+bytes(splitted_body, 'utf8')).decode("utf-8")
-                })
-                msgb = b''+bytes(msg_data, 'utf8')
-                tmp_splitted_msg_size = sys.getsizeof(msgb)
-                while tmp_splitted_msg_size > self.max_payload:
-                    chunk_size -= (tmp_splitted_msg_size - self.max_payload + 1)
-                    splitted_body = wip_body[consumed_body_offset:consumed_body_offset+chunk_size]
-                    msg_data = json.dumps({
-                        'properties': splitted_typed_properties,
-                        'body': base64.b64encode(b''+bytes(splitted_body, 'utf8')).decode("utf-8")
-                    })
-                    msgb = b''+bytes(msg_data, 'utf8')
-                    tmp_splitted_msg_size = sys.getsizeof(msgb)
-                consumed_body_offset += chunk_size
-
-            # add splitted message into in_progress_messages
-            if splitted_body is not None:
-                in_progress_messages.append({
-                    'properties': splitted_properties,
-                    'body': base64.b64encode(b''+bytes(splitted_body, 'utf8')).decode("utf-8")
-                })
+    def _sweep_split_responses(self):
+        """
+        evict the stale split responses and schedule the next sweep while split responses are being reassembled
+        """
+        self.split_responses_sweeper = None
+        self._evict_stale_split_responses(timeit.default_timer())
+        self._arm_split_responses_sweeper()
+
+    def _evict_split_responses_on_budget(self, split_mid, part_size):
+        # least recently updated groups first, the group receiving the part last
+        # spilled groups don't use the memory budget
+        for evicted_mid in sorted([mid for mid, split_group in self.split_responses.items()
+                                   if mid != split_mid and split_group['bytes'] > 0],
+                                  key=lambda mid: self.split_responses[mid]['last_update']):
+            self._evict_split_response(evicted_mid, 'budget')
+            if self.split_responses_bytes + part_size <= self.split_responses_max_bytes:
+                return
+        if self.split_responses_bytes + part_size > self.split_responses_max_bytes:
+            self._evict_split_response(split_mid, 'budget')
+
+    def get_split_responses_stats(self):
+        """
+        get the split responses reassembly statistics
+        :return: dict like {in_progress, in_progress_bytes, in_progress_spilled_bytes, completed, spilled,
+        spilled_bytes, evicted_on_timeout, evicted_on_budget, evicted_bytes}
+        """
+        stats = dict(self.split_responses_stats)
+        stats['in_progress'] = self.split_responses.__len__()
+        stats['in_progress_bytes'] = self.split_responses_bytes
+        stats['in_progress_spilled_bytes'] = 0
+        for split_group in list(self.split_responses.values()):
+            if 'spill_file' in split_group:
+                stats['in_progress_spilled_bytes'] += split_group['spill_bytes']
+        return stats
+
+    # properties copied in every splitted message
+    split_msg_header_properties = [DriverTools.MSG_MESSAGE_ID, DriverTools.MSG_CORRELATION_ID, DriverTools.MSG_TRACE,
+                                   DriverTools.MSG_REPLY_TO]
+
+    def _split_msg(self, split_mid, typed_properties, body):
+        """
+        split a message too big for the NATS max payload. Every message gets the header properties plus the split
+        ones, then the remaining properties are spread over the first messages and the body fills the rest.
+        Messages are planned in one pass : each property is typed and sized once and each body chunk is encoded
+        once.
+        :param split_mid: the split messages group id
+        :param typed_properties: the message properties as computed by DriverTools.property_params
+        :param body: the message body (str, or bytes if compressed)
+        :return: the list of messages (bytes) to publish
+        """
+        header_properties = {}
+        for typed_property in typed_properties:
+            if typed_property['propertyName'] in Requester.split_msg_header_properties:
+                header_properties[typed_property['propertyName']] = typed_property['propertyValue']
+        header_properties[DriverTools.MSG_SPLIT_MID] = split_mid
+        # split count and id are not known yet : size the envelope with the biggest possible value
+        header_properties[DriverTools.MSG_SPLIT_COUNT] = sys.maxsize
+        header_properties[DriverTools.MSG_SPLIT_OID] = sys.maxsize
+        header_typed_properties = []
+        for key, value in header_properties.items():
+            header_typed_properties.append(DriverTools.property_params(key, value))
+        envelope_size = json.dumps({
+            'properties': header_typed_properties,
+            'body': ''
+        }).encode('utf8').__len__()
+        if envelope_size > self.max_payload:
+            raise exceptions.ArianeError('natsd.Requester._split_msg',
+                                         'split header properties are bigger than NATS max payload')
+
+        # plan the properties : [[typed property, ...], ...] and the envelope size of each message
+        planned_properties = [[]]
+        planned_envelope_sizes = [envelope_size]
+        for typed_property in typed_properties:
+            key = typed_property['propertyName']
+            if key in header_properties:
+                continue
+            # ', ' separator + the JSON typed property
+            typed_property_size = 2 + json.dumps(typed_property).encode('utf8').__len__()
+            if envelope_size + typed_property_size > self.max_payload:
+                raise exceptions.ArianeError('natsd.Requester._split_msg',
+                                             'property ' + key + ' is bigger than NATS max payload')
+            if planned_envelope_sizes[-1] + typed_property_size > self.max_payload:
+                planned_properties.append([])
+                planned_envelope_sizes.append(envelope_size)
+            planned_properties[-1].append(typed_property)
+            planned_envelope_sizes[-1] += typed_property_size
+
+        # then plan the body : [(start offset, end offset), ...] of each message
+        is_text = isinstance(body, str)
+        if is_text:
+            body_bytes = bytes(body, 'utf8') if body else b''
+        else:
+            body_bytes = body if body else b''
+        body_len = body_bytes.__len__()
+        planned_chunks = []
+        consumed_body_offset = 0
+        msg_counter = 0
+        while consumed_body_offset < body_len or msg_counter < planned_properties.__len__():
+            if msg_counter < planned_properties.__len__():
+                msg_envelope_size = planned_envelope_sizes[msg_counter]
             else:
-                in_progress_messages.append({
-                    'properties': splitted_properties,
-                    'body': ''
-                })
+                msg_envelope_size = envelope_size
+            # base64 encodes 3 bytes in 4 chars
+            chunk_size = (self.max_payload - msg_envelope_size) // 4 * 3
+            chunk_end = min(consumed_body_offset + chunk_size, body_len)
+            # don't cut an utf8 char
+            while is_text and consumed_body_offset < chunk_end < body_len and body_bytes[chunk_end] & 0xC0 == 0x80:
+                chunk_end -= 1
+            if chunk_end <= consumed_body_offset < body_len and msg_counter >= planned_properties.__len__():
+                # no room left for the body in a message without properties : it would never be consumed
+                raise exceptions.ArianeError('natsd.Requester._split_msg',
+                                             'NATS max payload is too small to split the body')
+            planned_chunks.append((consumed_body_offset, chunk_end))
+            consumed_body_offset = chunk_end
             msg_counter += 1
 
-        for message in in_progress_messages:
-            message['properties'][DriverTools.MSG_SPLIT_COUNT] = msg_counter
-            typed_properties = []
-            for skey, svalue in message['properties'].items():
-                typed_properties.append(DriverTools.property_params(skey, svalue))
-            if 'body' in message:
-                msg_data = json.dumps({
-                    'properties': typed_properties,
-                    'body': message['body']
-                })
-            else:
-                msg_data = json.dumps({
-                    'properties': typed_properties,
-                    'body': ''
-                })
-            msgb = b''+bytes(msg_data, 'utf8')
-            messages.append(msgb)
+        messages = []
+        header_properties[DriverTools.MSG_SPLIT_COUNT] = msg_counter
+        for msg_oid in range(0, msg_counter):
+            header_properties[DriverTools.MSG_SPLIT_OID] = msg_oid
+            msg_typed_properties = []
+            for key, value in header_properties.items():
+                msg_typed_properties.append(DriverTools.property_params(key, value))
+            if msg_oid < planned_properties.__len__():
+                msg_typed_properties.extend(planned_properties[msg_oid])
+            chunk_start, chunk_end = planned_chunks[msg_oid]
+            msg_data = json.dumps({
+                'properties': msg_typed_properties,
+                'body': base64.b64encode(body_bytes[chunk_start:chunk_end]).decode("utf-8")
+            })
+            messages.append(bytes(msg_data, 'utf8'))
 
         return messages
 
@@ -427,30 +1330,12 @@ class Requester(pykka.ThreadingActor):
         args = {'properties': {DriverTools.OPERATION_FDN: DriverTools.OP_MSG_SPLIT_FEED_INIT,
                                DriverTools.PARAM_MSG_SPLIT_MID: split_mid,
                                DriverTools.PARAM_MSG_SPLIT_FEED_DEST: msg_split_dest}}
-        fire_and_forget_changed = False
-        if self.fire_and_forget:
-            fire_and_forget_changed = True
-            self.fire_and_forget = False
-        previous_corr_id = self.corr_id
-        self.call(my_args=args)
-        self.response = None
-        self.corr_id = previous_corr_id
-        if fire_and_forget_changed:
-            self.fire_and_forget = True
+        self._call(args, fire_and_forget=False)
 
     def _end_split_msg_group(self, split_mid):
         args = {'properties': {DriverTools.OPERATION_FDN: DriverTools.OP_MSG_SPLIT_FEED_END,
                                DriverTools.PARAM_MSG_SPLIT_MID: split_mid}}
-        fire_and_forget_changed = False
-        if self.fire_and_forget:
-            fire_and_forget_changed = True
-            self.fire_and_forget = False
-        previous_corr_id = self.corr_id
-        self.call(my_args=args)
-        self.response = None
-        self.corr_id = previous_corr_id
-        if fire_and_forget_changed:
-            self.fire_and_forget = True
+        self._call(args, fire_and_forget=False)
 
     def call(self, my_args=None):
         """
@@ -458,6 +1343,16 @@ class Requester(pykka.ThreadingActor):
         :param my_args: dict like {properties, body}
         :return response
         """
+        return self._call(my_args, self.fire_and_forget)
+
+    def _make_request(self, my_args, fire_and_forget):
+        """
+        check the call arguments and build the request messages
+        :param my_args: dict like {properties, body}
+        :param fire_and_forget: True if no response is expected
+        :return: dict like {corr_id, properties, typed_properties, request_q, msgb, messages, split_mid}. split_mid is
+        set only if the messages need a split group to be initialized and ended around the call.
+        """
         if not self.is_started:
             raise ArianeError('natsd.Requester.call',
                               'Requester not started !')
@@ -470,16 +1365,15 @@ class Requester(pykka.ThreadingActor):
         if 'body' not in my_args or my_args['body'] is None:
             my_args['body'] = ''
 
-        self.response = None
-
-        if not self.fire_and_forget:
+        corr_id = None
+        if not fire_and_forget:
             if DriverTools.MSG_CORRELATION_ID not in my_args['properties']:
-                self.corr_id = str(uuid.uuid4())
+                corr_id = str(uuid.uuid4())
                 properties = my_args['properties']
-                properties[DriverTools.MSG_CORRELATION_ID] = self.corr_id
+                properties[DriverTools.MSG_CORRELATION_ID] = corr_id
             else:
                 properties = my_args['properties']
-                self.corr_id = properties[DriverTools.MSG_CORRELATION_ID]
+                corr_id = properties[DriverTools.MSG_CORRELATION_ID]
         else:
             properties = my_args['properties']
 
@@ -491,13 +1385,25 @@ class Requester(pykka.ThreadingActor):
         if self.trace:
             properties[DriverTools.MSG_TRACE] = True
 
+        body = my_args['body']
+        properties.pop(DriverTools.MSG_CONTENT_ENCODING, None)
+        if self.compression.threshold > 0 and body:
+            # the service may compress its reply too
+            properties[DriverTools.MSG_ACCEPT_ENCODING] = DriverCompression.CONTENT_ENCODING_DEFLATE
+            compressed_body, content_encoding = self.compression.compress(self.requestQ, bytes(body, 'utf8'))
+            if content_encoding is not None:
+                properties[DriverTools.MSG_CONTENT_ENCODING] = content_encoding
+                body = compressed_body
+
         typed_properties = []
         for key, value in properties.items():
             typed_properties.append(DriverTools.property_params(key, value))
 
-        body = my_args['body']
+        # the max payload may change on reconnect to another server
+        self.max_payload = self.connection.max_payload
+        split_body = body
         if body:
-            body = base64.b64encode(b''+bytes(body, 'utf8')).decode("utf-8")
+            body = base64.b64encode(body if isinstance(body, bytes) else bytes(body, 'utf8')).decode("utf-8")
 
         msg_data = json.dumps({
             'properties': typed_properties,
@@ -507,141 +1413,263 @@ class Requester(pykka.ThreadingActor):
 
         split_mid = None
         messages = []
-        if sys.getsizeof(msgb) > self.max_payload:
+        if msgb.__len__() > self.max_payload:
             split_mid = str(uuid.uuid4())
-            messages = self._split_msg(split_mid, properties, my_args['body'])
+            messages = self._split_msg(split_mid, typed_properties, split_body)
         else:
             messages.append(msgb)
 
-        if not self.fire_and_forget:
-            if split_mid is not None and ('sessionID' not in properties or properties['sessionID'] is None or
-                                          not properties['sessionID']):
-                request_q += "_" + split_mid
-                self._init_split_msg_group(split_mid, request_q)
-
-            for msgb in messages:
-                try:
-                    LOGGER.debug("natsd.Requester.call - publish splitted request " + str(typed_properties) +
-                                 " (size: " + str(sys.getsizeof(msgb)) + " bytes) on " + request_q)
-                    next(self.nc.publish_request(request_q, self.responseQ, msgb))
-                except StopIteration as e:
-                    pass
-                LOGGER.debug("natsd.Requester.call - waiting answer from " + self.responseQ)
+        if split_mid is not None and ('sessionID' not in properties or properties['sessionID'] is None or
+                                      not properties['sessionID']):
+            request_q += "_" + split_mid
         else:
-            try:
-                LOGGER.debug("natsd.Requester.call - publish request " + str(typed_properties) + " on " + request_q)
-                next(self.nc.publish(request_q, b''+bytes(msg_data, 'utf8')))
-            except StopIteration as e:
-                pass
+            split_mid = None
+
+        return {
+            'corr_id': corr_id,
+            'properties': properties,
+            'typed_properties': typed_properties,
+            'request_q': request_q,
+            'msgb': msgb,
+            'messages': messages,
+            'split_mid': split_mid
+        }
 
-        try:
-            next(self.nc.flush(1))
-        except StopIteration as e:
-            pass
+    def _on_no_response(self, my_args, request):
+        """
+        no response returned before rpc timeout : check if the call must be retried
+        :param my_args: the call arguments
+        :param request: the request as returned by _make_request
+        :return: True if the call must be retried. Raise ArianeMessagingTimeoutError else.
+        """
+        if self.rpc_retry > 0:
+            if 'retry_count' not in my_args:
+                my_args['retry_count'] = 1
+                LOGGER.debug("natsd.Requester.call - Retry (" + str(my_args['retry_count']) + ")")
+                return True
+            elif 'retry_count' in my_args and (self.rpc_retry - my_args['retry_count']) > 0:
+                LOGGER.warn("natsd.Requester.call - No response returned from request on " + request['request_q'] +
+                            " queue after " + str(self.rpc_timeout) + '*' +
+                            str(self.rpc_retry) + " sec ...")
+                self.trace = True
+                my_args['retry_count'] += 1
+                LOGGER.warn("natsd.Requester.call - Retry (" + str(my_args['retry_count']) + ")")
+                return True
+        self._on_rpc_timeout()
+        raise ArianeMessagingTimeoutError('natsd.Requester.call',
+                                          'Request timeout (' + str(self.rpc_timeout) + '*' +
+                                          str(self.rpc_retry) + ' sec) occured')
+
+    def _make_response(self, request, response, start_time):
+        """
+        build the driver response from the NATS response
+        :param request: the request as returned by _make_request
+        :param response: dict like {properties, body}
+        :param start_time: the call start time
+        :return: the driver response
+        """
+        rpc_time = timeit.default_timer()-start_time
+        LOGGER.debug('natsd.Requester.call - RPC time : ' + str(rpc_time))
+        if self.rpc_timeout > 0 and rpc_time > self.rpc_timeout*3/5:
+            LOGGER.debug('natsd.Requester.call - slow RPC time (' + str(rpc_time) + ') on request ' +
+                         str(request['typed_properties']))
+        self.trace = False
+        with self.rpc_retry_timeout_err_count_lock:
+            self.rpc_retry_timeout_err_count = 0
+        self.compression.on_accept_encoding(self.requestQ, response['properties'].get(DriverTools.MSG_ACCEPT_ENCODING))
+        rc_ = int(response['properties']['RC'])
 
-        start_time = timeit.default_timer()
-        if not self.fire_and_forget:
-            # Wait rpc_timeout sec before raising error
-            if self.rpc_timeout > 0:
-                exit_count = self.rpc_timeout * 100
+        if rc_ != 0:
+            body = Requester._decode_response_body(self._decompress_response_body(response))
+            try:
+                content = json.loads(body)
+            except ValueError:
+                content = body
+            dr = DriverResponse(
+                rc=rc_,
+                error_message=response['properties']['SERVER_ERROR_MESSAGE']
+                if 'SERVER_ERROR_MESSAGE' in response['properties'] else '',
+                response_content=content
+            )
+        else:
+            try:
+                if DriverTools.MSG_PROPERTIES in response['properties']:
+                    props = json.loads(response['properties'][DriverTools.MSG_PROPERTIES])
+                else:
+                    props = None
+            except ValueError:
+                if DriverTools.MSG_PROPERTIES in response['properties']:
+                    props = response['props'][DriverTools.MSG_PROPERTIES]
+                else:
+                    props = None
+            body = Requester._decode_response_body(self._decompress_response_body(response))
+            try:
+                content = json.loads(body)
+            except ValueError:
+                content = body
+            dr = DriverResponse(
+                rc=rc_,
+                response_properties=props,
+                response_content=content
+            )
+        return dr
+
+    def _call(self, my_args, fire_and_forget):
+        request = self._make_request(my_args, fire_and_forget)
+        request_q = request['request_q']
+
+        pending_call = None
+        if not fire_and_forget:
+            self._wait_connection(my_args)
+            if request['split_mid'] is not None:
+                self._init_split_msg_group(request['split_mid'], request_q)
+
+            # registered before publishing so that a fast reply can't be missed
+            pending_call = {'event': threading.Event(), 'response': None}
+            with self.pending_calls_lock:
+                self.pending_calls[request['corr_id']] = pending_call
+            for msgb in request['messages']:
+                LOGGER.debug("natsd.Requester.call - publish splitted request " + str(request['typed_properties']) +
+                             " (size: " + str(msgb.__len__()) + " bytes) on " + request_q)
+                self.connection.publish(request_q, msgb, reply=self.responseQ)
+                LOGGER.debug("natsd.Requester.call - waiting answer from " + self.responseQ)
+            self._flush()
+        elif not self._buffer_request(my_args, request):
+            if self.linger_ms > 0:
+                self._linger(request)
             else:
-                exit_count = 1
-            while self.response is None and exit_count > 0:
-                time.sleep(0.01)
+                LOGGER.debug("natsd.Requester.call - publish request " + str(request['typed_properties']) + " on " +
+                             request_q)
+                self.connection.publish(request_q, request['msgb'])
+                self._flush()
+                self._count_published(1)
+
+        start_time = timeit.default_timer()
+        if not fire_and_forget:
+            # Wait rpc_timeout sec before raising error (woken up by on_response as soon as the reply is there)
+            try:
                 if self.rpc_timeout > 0:
-                    exit_count -= 1
-
-            if self.response is None:
-                if self.rpc_retry > 0:
-                    if 'retry_count' not in my_args:
-                        my_args['retry_count'] = 1
-                        LOGGER.debug("natsd.Requester.call - Retry (" + str(my_args['retry_count']) + ")")
-                        return self.call(my_args)
-                    elif 'retry_count' in my_args and (self.rpc_retry - my_args['retry_count']) > 0:
-                        LOGGER.warn("natsd.Requester.call - No response returned from request on " + request_q +
-                                    " queue after " + str(self.rpc_timeout) + '*' +
-                                    str(self.rpc_retry) + " sec ...")
-                        self.trace = True
-                        my_args['retry_count'] += 1
-                        LOGGER.warn("natsd.Requester.call - Retry (" + str(my_args['retry_count']) + ")")
-                        return self.call(my_args)
-                    else:
-                        self.rpc_retry_timeout_err_count += 1
-                        if self.rpc_retry_timeout_err_count >= self.rpc_retry_timeout_err_count_max:
-                            self._restart_after_max_timeout_err_count()
-                        raise ArianeMessagingTimeoutError('natsd.Requester.call',
-                                                          'Request timeout (' + str(self.rpc_timeout) + '*' +
-                                                          str(self.rpc_retry) + ' sec) occured')
+                    pending_call['event'].wait(self.rpc_timeout)
                 else:
-                    self.rpc_retry_timeout_err_count += 1
-                    if self.rpc_retry_timeout_err_count >= self.rpc_retry_timeout_err_count_max:
-                        self._restart_after_max_timeout_err_count()
-                    raise ArianeMessagingTimeoutError('natsd.Requester.call',
-                                                      'Request timeout (' + str(self.rpc_timeout) + '*' +
-                                                      str(self.rpc_retry) + ' sec) occured')
-
-            rpc_time = timeit.default_timer()-start_time
-            LOGGER.debug('natsd.Requester.call - RPC time : ' + str(rpc_time))
-            if self.rpc_timeout > 0 and rpc_time > self.rpc_timeout*3/5:
-                LOGGER.debug('natsd.Requester.call - slow RPC time (' + str(rpc_time) + ') on request ' +
-                             str(typed_properties))
-            self.trace = False
-            self.rpc_retry_timeout_err_count = 0
-            rc_ = int(self.response['properties']['RC'])
-
-            if rc_ != 0:
-                try:
-                    content = json.loads(self.response['body'].decode("UTF-8"))
-                except ValueError:
-                    content = self.response['body'].decode("UTF-8")
-                dr = DriverResponse(
-                    rc=rc_,
-                    error_message=self.response['properties']['SERVER_ERROR_MESSAGE']
-                    if 'SERVER_ERROR_MESSAGE' in self.response['properties'] else '',
-                    response_content=content
-                )
+                    pending_call['event'].wait()
+            finally:
+                with self.pending_calls_lock:
+                    self.pending_calls.pop(request['corr_id'], None)
+            if 'error' in pending_call:
+                raise pending_call['error']
+            response = pending_call['response']
+
+            if response is None:
+                self._on_no_response(my_args, request)
+                return self._call(my_args, fire_and_forget)
+
+            dr = self._make_response(request, response, start_time)
+            if request['split_mid'] is not None:
+                self._end_split_msg_group(request['split_mid'])
+
+            return dr
+
+    async def _init_split_msg_group_async(self, split_mid, msg_split_dest):
+        args = {'properties': {DriverTools.OPERATION_FDN: DriverTools.OP_MSG_SPLIT_FEED_INIT,
+                               DriverTools.PARAM_MSG_SPLIT_MID: split_mid,
+                               DriverTools.PARAM_MSG_SPLIT_FEED_DEST: msg_split_dest}}
+        await self._call_async(args, fire_and_forget=False)
+
+    async def _end_split_msg_group_async(self, split_mid):
+        args = {'properties': {DriverTools.OPERATION_FDN: DriverTools.OP_MSG_SPLIT_FEED_END,
+                               DriverTools.PARAM_MSG_SPLIT_MID: split_mid}}
+        await self._call_async(args, fire_and_forget=False)
+
+    async def call_async(self, my_args=None):
+        """
+        setup the request and call the remote service from the connection event loop. Await the answer.
+        :param my_args: dict like {properties, body}
+        :return response
+        """
+        return await self._call_async(my_args, self.fire_and_forget)
+
+    async def _call_async(self, my_args, fire_and_forget):
+        request = self._make_request(my_args, fire_and_forget)
+        request_q = request['request_q']
+
+        pending_call = None
+        if not fire_and_forget:
+            await self._wait_connection_async(my_args)
+            if request['split_mid'] is not None:
+                await self._init_split_msg_group_async(request['split_mid'], request_q)
+
+            # on_response runs on this event loop too : an asyncio event is enough to wake this call up
+            pending_call = {'event': asyncio.Event(), 'response': None}
+            with self.pending_calls_lock:
+                self.pending_calls[request['corr_id']] = pending_call
+            for msgb in request['messages']:
+                LOGGER.debug("natsd.Requester.call_async - publish splitted request " +
+                             str(request['typed_properties']) + " (size: " + str(msgb.__len__()) + " bytes) on " +
+                             request_q)
+                await self.connection.publish_async(request_q, msgb, reply=self.responseQ)
+            await self._flush_async()
+        elif not self._buffer_request(my_args, request):
+            if self.linger_ms > 0:
+                self._linger(request)
             else:
-                try:
-                    if DriverTools.MSG_PROPERTIES in self.response['properties']:
-                        props = json.loads(self.response['properties'][DriverTools.MSG_PROPERTIES])
-                    else:
-                        props = None
-                except ValueError:
-                    if DriverTools.MSG_PROPERTIES in self.response['properties']:
-                        props = self.response['props'][DriverTools.MSG_PROPERTIES]
-                    else:
-                        props = None
-                try:
-                    content = json.loads(self.response['body'].decode("UTF-8"))
-                except ValueError:
-                    content = self.response['body'].decode("UTF-8")
-                dr = DriverResponse(
-                    rc=rc_,
-                    response_properties=props,
-                    response_content=content
-                )
+                LOGGER.debug("natsd.Requester.call_async - publish request " + str(request['typed_properties']) +
+                             " on " + request_q)
+                await self.connection.publish_async(request_q, request['msgb'])
+                await self._flush_async()
+                self._count_published(1)
 
-            if split_mid is not None and ('sessionID' not in properties or properties['sessionID'] is None or
-                                              not properties['sessionID']):
-                self._end_split_msg_group(split_mid)
-                request_q = request_q.split("_" + split_mid)[0]
+        start_time = timeit.default_timer()
+        if not fire_and_forget:
+            try:
+                if self.rpc_timeout > 0:
+                    await asyncio.wait_for(pending_call['event'].wait(), self.rpc_timeout)
+                else:
+                    await pending_call['event'].wait()
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self.pending_calls_lock:
+                    self.pending_calls.pop(request['corr_id'], None)
+            if 'error' in pending_call:
+                raise pending_call['error']
+            response = pending_call['response']
 
-            return dr
+            if response is None:
+                self._on_no_response(my_args, request)
+                return await self._call_async(my_args, fire_and_forget)
 
+            dr = self._make_response(request, response, start_time)
+            if request['split_mid'] is not None:
+                await self._end_split_msg_group_async(request['split_mid'])
 
+            return dr
 
 
 class Service(pykka.ThreadingActor):
     """
-    NATS service implementation.
-    :param my_args: dict like {connection, service_q, treatment_callback[, service_name]}
+    NATS service implementation. Requests are decoded on the connection event loop thread and then treated by the
+    treatment callback according to the dispatch mode :
+    - inline (default) : on the connection event loop thread,
+    - pool : on a pool of dispatch_pool_size threads sharing a dispatch_queue_size bounded queue,
+    - serial : on a pool of dispatch_pool_size threads, each with its own dispatch_queue_size bounded queue. Requests
+      with the same dispatch_key property value are always treated by the same thread, in their arrival order.
+    The connection event loop thread, shared by all the connection services, never waits for the dispatch queue :
+    when it is full the request is rejected with a MSG_RET_SERVER_ERR error reply (or dropped if it has no reply
+    subject) so that a slow service can't stall the other ones.
+    :param my_args: dict like {connection, service_q, treatment_callback[, service_name, dispatch_mode,
+    dispatch_pool_size, dispatch_queue_size, dispatch_key]}
     :param connection_args: dict like {user, password, host[, port, client_properties]}
     """
 
+    DISPATCH_INLINE = "inline"
+    DISPATCH_POOL = "pool"
+    DISPATCH_SERIAL = "serial"
+
     def __init__(self, my_args=None, connection_args=None):
         """
         NATS service constructor
-        :param my_args: dict like {connection, service_q, treatment_callback[, service_name]}
+        :param my_args: dict like {connection, service_q, treatment_callback[, service_name, dispatch_mode,
+        dispatch_pool_size, dispatch_queue_size, dispatch_key]}
         :param connection_args: dict like {user, password, host[, port, client_properties]}
         :return: self
         """
@@ -656,27 +1684,195 @@ class Service(pykka.ThreadingActor):
             LOGGER.warn("natsd.Service.__init__ - service_name is not defined ! Use default : " +
                         self.__class__.__name__)
             my_args['service_name'] = self.__class__.__name__
+        if 'dispatch_mode' not in my_args or my_args['dispatch_mode'] is None or not my_args['dispatch_mode']:
+            my_args['dispatch_mode'] = Service.DISPATCH_INLINE
+        elif my_args['dispatch_mode'] not in [Service.DISPATCH_INLINE, Service.DISPATCH_POOL,
+                                              Service.DISPATCH_SERIAL]:
+            raise exceptions.ArianeConfError("dispatch_mode")
+        if 'dispatch_pool_size' not in my_args or my_args['dispatch_pool_size'] is None or \
+                not my_args['dispatch_pool_size']:
+            my_args['dispatch_pool_size'] = 4
+        if 'dispatch_queue_size' not in my_args or my_args['dispatch_queue_size'] is None or \
+                not my_args['dispatch_queue_size']:
+            my_args['dispatch_queue_size'] = 1000
+        if my_args['dispatch_mode'] == Service.DISPATCH_SERIAL and \
+                ('dispatch_key' not in my_args or my_args['dispatch_key'] is None or not my_args['dispatch_key']):
+            raise exceptions.ArianeConfError("dispatch_key")
 
         Driver.validate_driver_conf(connection_args)
 
         super(Service, self).__init__()
         self.connection_args = copy.deepcopy(connection_args)
-        self.servers = [
-            "nats://" + connection_args['user'] + ":" + connection_args['password'] + "@" +
-            connection_args['host']+":"+str(connection_args['port'])
-        ]
-        self.name = self.connection_args['client_properties']['ariane.app'] + "@" + socket.gethostname() + \
-            " - service on " + my_args['service_q']
-        self.loop = None
-        self.options = None
-        self.nc = Client()
+        if 'connection' in my_args and my_args['connection'] is not None:
+            self.connection = my_args['connection']
+            self.own_connection = False
+        else:
+            self.connection = Connection(self.connection_args,
+                                         self.connection_args['client_properties']['ariane.app'] + "@" +
+                                         socket.gethostname() + " - service on " + my_args['service_q'])
+            self.own_connection = True
         self.serviceQ = my_args['service_q']
         self.serviceQS = None
         self.service_name = my_args['service_name']
-        self.service = None
         self.cb = my_args['treatment_callback']
         self.is_started = False
 
+        self.dispatch_mode = my_args['dispatch_mode']
+        self.dispatch_pool_size = int(my_args['dispatch_pool_size'])
+        self.dispatch_queue_size = int(my_args['dispatch_queue_size'])
+        self.dispatch_key = my_args['dispatch_key'] if 'dispatch_key' in my_args else None
+        self.dispatch_queues = []
+        self.dispatch_threads = []
+        self.dispatch_stats = {
+            'treated': 0,
+            'failed': 0,
+            'rejected': 0,
+            'queue_depth_max': 0,
+            'queue_time_total': 0,
+            'queue_time_max': 0,
+            'treatment_time_total': 0,
+            'treatment_time_max': 0
+        }
+        self.dispatch_stats_lock = threading.Lock()
+        # requests bodies are decompressed before their treatment
+        self.compression = DriverCompression()
+
+    def _treat(self, working_properties, working_body_decoded, received_time):
+        start_time = timeit.default_timer()
+        failed = False
+        try:
+            self.cb(working_properties, working_body_decoded)
+        except Exception as e:
+            failed = True
+            LOGGER.warn("natsd.Service._treat - Exception raised while treating msg {" + str(working_properties) +
+                        "} : " + traceback.format_exc())
+        end_time = timeit.default_timer()
+        with self.dispatch_stats_lock:
+            self.dispatch_stats['treated'] += 1
+            if failed:
+                self.dispatch_stats['failed'] += 1
+            queue_time = start_time - received_time
+            self.dispatch_stats['queue_time_total'] += queue_time
+            if queue_time > self.dispatch_stats['queue_time_max']:
+                self.dispatch_stats['queue_time_max'] = queue_time
+            treatment_time = end_time - start_time
+            self.dispatch_stats['treatment_time_total'] += treatment_time
+            if treatment_time > self.dispatch_stats['treatment_time_max']:
+                self.dispatch_stats['treatment_time_max'] = treatment_time
+
+    def _run_dispatch_worker(self, dispatch_queue):
+        LOGGER.debug("natsd.Service._run_dispatch_worker - start")
+        while True:
+            request = dispatch_queue.get()
+            if request is None:
+                break
+            self._treat(*request)
+        LOGGER.debug("natsd.Service._run_dispatch_worker - stop")
+
+    def _start_dispatch_workers(self):
+        if self.dispatch_mode == Service.DISPATCH_INLINE:
+            return
+        if self.dispatch_mode == Service.DISPATCH_POOL:
+            self.dispatch_queues = [queue.Queue(self.dispatch_queue_size)]
+        else:
+            self.dispatch_queues = [queue.Queue(self.dispatch_queue_size) for i in range(0, self.dispatch_pool_size)]
+        for i in range(0, self.dispatch_pool_size):
+            dispatch_queue = self.dispatch_queues[i % self.dispatch_queues.__len__()]
+            dispatch_thread = threading.Thread(target=self._run_dispatch_worker, args=(dispatch_queue,),
+                                               name=self.service_name + " dispatch thread " + str(i))
+            dispatch_thread.start()
+            self.dispatch_threads.append(dispatch_thread)
+
+    def _stop_dispatch_workers(self):
+        for i in range(0, self.dispatch_threads.__len__()):
+            self.dispatch_queues[i % self.dispatch_queues.__len__()].put(None)
+        for dispatch_thread in self.dispatch_threads:
+            dispatch_thread.join()
+        self.dispatch_threads = []
+        self.dispatch_queues = []
+
+    def _dispatch(self, working_properties, working_body_decoded):
+        """
+        treat the request inline or queue it for the dispatch workers without waiting for room in the dispatch queue
+        :return: False if the request has been rejected as the dispatch queue is full
+        """
+        received_time = timeit.default_timer()
+        if self.dispatch_mode == Service.DISPATCH_INLINE:
+            self._treat(working_properties, working_body_decoded, received_time)
+            return True
+        if self.dispatch_mode == Service.DISPATCH_POOL:
+            dispatch_queue = self.dispatch_queues[0]
+        else:
+            key = working_properties[self.dispatch_key] if self.dispatch_key in working_properties else None
+            dispatch_queue = self.dispatch_queues[hash(str(key)) % self.dispatch_queues.__len__()]
+        try:
+            dispatch_queue.put_nowait((working_properties, working_body_decoded, received_time))
+        except queue.Full:
+            with self.dispatch_stats_lock:
+                self.dispatch_stats['rejected'] += 1
+            return False
+        queue_depth = self.get_dispatch_queue_depth()
+        with self.dispatch_stats_lock:
+            if queue_depth > self.dispatch_stats['queue_depth_max']:
+                self.dispatch_stats['queue_depth_max'] = queue_depth
+        return True
+
+    def _reject(self, msg, working_properties):
+        """
+        answer the request with an error reply as the dispatch queue is full. Requests without reply subject are
+        dropped.
+        :param msg: the received NATS message
+        :param working_properties: the request properties
+        """
+        LOGGER.warn("natsd.Service._reject - " + self.serviceQ + " dispatch queue is full : request " +
+                    str(working_properties.get(DriverTools.MSG_CORRELATION_ID)) + " rejected")
+        if not msg.reply:
+            return
+        properties = {
+            DriverTools.MSG_RC: DriverTools.MSG_RET_SERVER_ERR,
+            DriverTools.MSG_ERR: self.serviceQ + " dispatch queue is full"
+        }
+        if DriverTools.MSG_CORRELATION_ID in working_properties:
+            properties[DriverTools.MSG_CORRELATION_ID] = working_properties[DriverTools.MSG_CORRELATION_ID]
+        msg_data = json.dumps({
+            'properties': [DriverTools.property_params(key, value) for key, value in properties.items()],
+            'body': None
+        })
+        # published later on the connection event loop : on_request must not wait
+        asyncio.run_coroutine_threadsafe(self.connection.publish_async(msg.reply, bytes(msg_data, 'utf8')),
+                                         self.connection.loop)
+
+    def get_dispatch_queue_depth(self):
+        """
+        :return: the count of requests waiting to be treated
+        """
+        queue_depth = 0
+        for dispatch_queue in self.dispatch_queues:
+            queue_depth += dispatch_queue.qsize()
+        return queue_depth
+
+    def get_dispatch_stats(self):
+        """
+        get the requests dispatch statistics (times in sec)
+        :return: dict like {dispatch_mode, queue_depth, queue_depth_max, treated, failed, rejected, queue_time_total,
+        queue_time_max, queue_time_avg, treatment_time_total, treatment_time_max, treatment_time_avg}
+        """
+        with self.dispatch_stats_lock:
+            stats = dict(self.dispatch_stats)
+        stats['dispatch_mode'] = self.dispatch_mode
+        stats['queue_depth'] = self.get_dispatch_queue_depth()
+        stats['queue_time_avg'] = stats['queue_time_total'] / stats['treated'] if stats['treated'] else 0
+        stats['treatment_time_avg'] = stats['treatment_time_total'] / stats['treated'] if stats['treated'] else 0
+        return stats
+
+    def get_compression_stats(self):
+        """
+        get the requests bodies decompression statistics
+        :return: dict like {queue: {decompressed, decompressed_bytes_in, decompressed_bytes_out, decompression_ratio,
+        decompress_time, ...}}
+        """
+        return self.compression.get_stats()
+
     def on_request(self, msg):
         """
         message consumed treatment through provided callback and basic ack
@@ -685,108 +1881,86 @@ class Service(pykka.ThreadingActor):
         try:
             working_response = json.loads(msg.data.decode())
             working_properties = DriverTools.json2properties(working_response['properties'])
-            working_body = b''+bytes(working_response['body'], 'utf8') if 'body' in working_response else None
+            working_body = working_response['body'] if 'body' in working_response else None
             working_body_decoded = base64.b64decode(working_body) if working_body is not None else \
                 bytes(json.dumps({}), 'utf8')
-            self.cb(working_properties, working_body_decoded)
+            if DriverTools.MSG_CONTENT_ENCODING in working_properties:
+                working_body_decoded = self.compression.decompress(
+                    self.serviceQ, working_body_decoded, working_properties.pop(DriverTools.MSG_CONTENT_ENCODING)
+                )
+            if not self._dispatch(working_properties, working_body_decoded):
+                self._reject(msg, working_properties)
         except Exception as e:
             LOGGER.warn("natsd.Service.on_request - Exception raised while treating msg {"+str(msg)+","+str(msg)+"}")
         LOGGER.debug("natsd.Service.on_request - request " + str(msg) + " treated")
 
-    def connect(self):
-        LOGGER.debug("natsd.Service.connect")
-        try:
-            yield from self.nc.connect(**self.options)
-            self.serviceQS = yield from self.nc.subscribe(self.serviceQ, cb=self.on_request)
-            self.is_started = True
-        except ErrNoServers as e:
-            print(e)
-            return
-
-    def run_event_loop(self):
-        LOGGER.debug("natsd.Service.run_event_loop")
-        self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
-        self.options = {
-            "servers": self.servers,
-            "name": self.name,
-            # "disconnected_cb": self.disconnected_cb,
-            # "reconnected_cb": self.reconnected_cb,
-            # "error_cb": self.error_cb,
-            # "closed_cb": self.closed_cb,
-            "io_loop": self.loop,
-        }
-        self.loop.create_task(self.connect())
-        self.loop.run_forever()
-
     def on_start(self):
         """
         start the service
         """
         LOGGER.debug("natsd.Service.on_start")
-        self.service = threading.Thread(target=self.run_event_loop, name=self.serviceQ + " service thread")
-        self.service.start()
-        while not self.is_started:
-            time.sleep(0.01)
+        self._start_dispatch_workers()
+        self.connection.start()
+        self.serviceQS = self.connection.subscribe(self.serviceQ, self.on_request)
+        self.is_started = True
+
+    def _clean(self):
+        self.is_started = False
+        try:
+            if self.serviceQS is not None:
+                self.connection.unsubscribe(self.serviceQS)
+                self.serviceQS = None
+        except Exception as e:
+            LOGGER.debug("natsd.Service._clean - Exception on unsubscribe : " + traceback.format_exc())
+        # requests already dispatched are treated before workers stop
+        self._stop_dispatch_workers()
+        if self.own_connection:
+            self.connection.stop()
 
     def on_stop(self):
         """
         stop the service
         """
         LOGGER.debug("natsd.Service.on_stop")
-        self.is_started = False
-        try:
-            next(self.nc.unsubscribe(self.serviceQS))
-        except StopIteration as e:
-            pass
-        try:
-            next(self.nc.close())
-        except StopIteration as e:
-            pass
-        try:
-            for task in asyncio.Task.all_tasks(self.loop):
-                task.cancel()
-            self.loop.stop()
-            while self.loop.is_running():
-                time.sleep(1)
-            self.loop.close()
-        except Exception as e:
-            LOGGER.debug("natsd.Service.on_stop - Exception aio clean up : "
-                         + traceback.format_exc())
+        self._clean()
 
     def on_failure(self, exception_type, exception_value, traceback_):
-        LOGGER.error("natsd.Requester.on_failure - " + exception_type.__str__() + "/" + exception_value.__str__())
-        LOGGER.error("natsd.Requester.on_failure - " + traceback_.format_exc())
-        self.is_started = False
-        try:
-            next(self.nc.unsubscribe(self.serviceQS))
-        except StopIteration as e:
-            pass
-        try:
-            next(self.nc.close())
-        except StopIteration as e:
-            pass
-        try:
-            for task in asyncio.Task.all_tasks(self.loop):
-                task.cancel()
-            self.loop.stop()
-            while self.loop.is_running():
-                time.sleep(1)
-            self.loop.close()
-        except Exception as e:
-            LOGGER.debug("natsd.Service.on_failure - Exception aio clean up : "
-                         + traceback.format_exc())
+        LOGGER.error("natsd.Service.on_failure - " + exception_type.__str__() + "/" + exception_value.__str__())
+        LOGGER.error("natsd.Service.on_failure - " + traceback_.format_exc())
+        self._clean()
+
 
 class Driver(object):
     """
-    NATS driver class.
-    :param my_args: dict like {user, password, host[, port, client_properties]}. Default = None
+    NATS driver class. The driver owns the NATS connections : requesters are spread over a pool of
+    connection_pool_size connections (default 1) and services share one dedicated connection, so that a treatment
+    callback running on the service connection loop can call requesters without blocking their replies.
+    If an aio_loop is provided the requesters connections run on this caller asyncio event loop : requesters are then
+    made with make_requester_async and called with call_async from this loop (services keep their own loop thread).
+    :param my_args: dict like {user, password, host[, port, client_properties, connection_pool_size,
+    compression_threshold, aio_loop]}.
+    Default = None
     """
 
     @staticmethod
     def validate_driver_conf(my_args=None):
         LOGGER.debug("natsd.Driver.validate_driver_conf")
         default_port = 5672
+        # failover : fast failure detection and immediate reconnect to the next server. A server is tried again
+        # after reconnect_time_wait sec, with no attempts limit (-1)
+        default_connect_timeout = 2
+        default_reconnect_time_wait = 1
+        default_max_reconnect_attempts = -1
+        default_ping_interval = 5
+        default_max_outstanding_pings = 2
+        # memory budget (bytes) and inactivity timeout (sec) of the split responses being reassembled
+        default_split_responses_max_bytes = 536870912
+        default_split_responses_timeout = 60
+        # split responses bigger than this (bytes) are reassembled in a temporary file
+        default_split_responses_spill_threshold = 67108864
+        # requests held (count) and for how long (sec) while the connection is not available
+        default_reconnect_buffer_size = 1000
+        default_reconnect_buffer_timeout = 30
         default_client_properties = {
             'product': 'Ariane',
             'information': 'Ariane - Injector',
@@ -803,26 +1977,93 @@ class Driver(object):
             raise exceptions.ArianeConfError("user")
         if 'password' not in my_args or my_args['password'] is None or not my_args['password']:
             raise exceptions.ArianeConfError("password")
-        if 'host' not in my_args or my_args['host'] is None or not my_args['host']:
-            raise exceptions.ArianeConfError("host")
         if 'port' not in my_args or my_args['port'] is None or not my_args['port']:
             my_args['port'] = default_port
             LOGGER.info("natsd.Driver.validate_driver_conf - port is not defined. Use default : " + str(default_port))
         else:
             my_args['port'] = int(my_args['port'])
+        if 'servers' not in my_args or my_args['servers'] is None or not my_args['servers']:
+            if 'host' not in my_args or my_args['host'] is None or not my_args['host']:
+                raise exceptions.ArianeConfError("host")
+            my_args['servers'] = [my_args['host'] + ":" + str(my_args['port'])]
+        elif isinstance(my_args['servers'], str):
+            # comma separated servers list
+            my_args['servers'] = [server.strip() for server in my_args['servers'].split(',') if server.strip()]
+        if 'server_selection' not in my_args or my_args['server_selection'] is None or \
+                not my_args['server_selection']:
+            my_args['server_selection'] = Connection.SERVER_SELECTION_ORDERED
+        elif my_args['server_selection'] not in [Connection.SERVER_SELECTION_ORDERED,
+                                                 Connection.SERVER_SELECTION_RANDOM,
+                                                 Connection.SERVER_SELECTION_LATENCY]:
+            raise exceptions.ArianeConfError("server_selection")
+        for reconnect_arg, default_value, arg_type in [('connect_timeout', default_connect_timeout, float),
+                                                       ('reconnect_time_wait', default_reconnect_time_wait, float),
+                                                       ('max_reconnect_attempts', default_max_reconnect_attempts,
+                                                        int),
+                                                       ('ping_interval', default_ping_interval, float),
+                                                       ('max_outstanding_pings', default_max_outstanding_pings,
+                                                        int)]:
+            if reconnect_arg not in my_args or my_args[reconnect_arg] is None or not my_args[reconnect_arg]:
+                my_args[reconnect_arg] = default_value
+            else:
+                my_args[reconnect_arg] = arg_type(my_args[reconnect_arg])
         if 'client_properties' not in my_args or my_args['client_properties'] is None:
             my_args['client_properties'] = default_client_properties
             LOGGER.info("natsd.Driver.validate_driver_conf - client properties are not defined. Use default " +
                         str(default_client_properties))
+        if 'connection_pool_size' not in my_args or my_args['connection_pool_size'] is None or \
+                not my_args['connection_pool_size']:
+            my_args['connection_pool_size'] = 1
+        else:
+            my_args['connection_pool_size'] = int(my_args['connection_pool_size'])
+        if 'split_responses_max_bytes' not in my_args or my_args['split_responses_max_bytes'] is None or \
+                not my_args['split_responses_max_bytes']:
+            my_args['split_responses_max_bytes'] = default_split_responses_max_bytes
+        else:
+            my_args['split_responses_max_bytes'] = int(my_args['split_responses_max_bytes'])
+        if 'split_responses_timeout' not in my_args or my_args['split_responses_timeout'] is None or \
+                not my_args['split_responses_timeout']:
+            my_args['split_responses_timeout'] = default_split_responses_timeout
+        else:
+            my_args['split_responses_timeout'] = float(my_args['split_responses_timeout'])
+        if 'split_responses_spill_threshold' not in my_args or my_args['split_responses_spill_threshold'] is None:
+            my_args['split_responses_spill_threshold'] = default_split_responses_spill_threshold
+        else:
+            # 0 : never spill on disk
+            my_args['split_responses_spill_threshold'] = int(my_args['split_responses_spill_threshold'])
+        if 'split_responses_spill_dir' not in my_args or my_args['split_responses_spill_dir'] is None or \
+                not my_args['split_responses_spill_dir']:
+            # system temporary directory
+            my_args['split_responses_spill_dir'] = None
+        if 'reconnect_buffer_size' not in my_args or my_args['reconnect_buffer_size'] is None or \
+                not my_args['reconnect_buffer_size']:
+            my_args['reconnect_buffer_size'] = default_reconnect_buffer_size
+        else:
+            my_args['reconnect_buffer_size'] = int(my_args['reconnect_buffer_size'])
+        if 'reconnect_buffer_timeout' not in my_args or my_args['reconnect_buffer_timeout'] is None or \
+                not my_args['reconnect_buffer_timeout']:
+            my_args['reconnect_buffer_timeout'] = default_reconnect_buffer_timeout
+        else:
+            my_args['reconnect_buffer_timeout'] = float(my_args['reconnect_buffer_timeout'])
+        if 'compression_threshold' not in my_args or my_args['compression_threshold'] is None or \
+                not my_args['compression_threshold']:
+            # no compression
+            my_args['compression_threshold'] = 0
+        else:
+            my_args['compression_threshold'] = int(my_args['compression_threshold'])
 
     def __init__(self, my_args=None):
         """
         NATS driver constructor
-        :param my_args: dict like {user, password, host[, port, client_properties]}. Default = None
+        :param my_args: dict like {user, password, host[, port, client_properties, connection_pool_size,
+        compression_threshold, aio_loop]}.
+        Default = None
         :return: self
         """
         LOGGER.debug("natsd.Driver.__init__")
         self.type = my_args['type']
+        # the event loop is not part of the connection arguments which are copied by requesters and services
+        self.aio_loop = my_args.pop('aio_loop', None)
         self.configuration_OK = False
         try:
             Driver.validate_driver_conf(my_args)
@@ -833,6 +2074,31 @@ class Driver(object):
         self.connection_args = my_args
         self.services_registry = []
         self.requester_registry = []
+        self.connection_pool = []
+        self.connection_pool_index = 0
+        self.service_connection = None
+        self.connection_lock = threading.Lock()
+
+    def _get_requester_connection(self):
+        with self.connection_lock:
+            if self.connection_pool.__len__() < self.connection_args['connection_pool_size']:
+                connection = Connection(self.connection_args,
+                                        self.connection_args['client_properties']['ariane.app'] + "@" +
+                                        socket.gethostname() + " - requestors connection " +
+                                        str(self.connection_pool.__len__()), loop=self.aio_loop)
+                self.connection_pool.append(connection)
+            else:
+                connection = self.connection_pool[self.connection_pool_index]
+                self.connection_pool_index = (self.connection_pool_index + 1) % self.connection_pool.__len__()
+        return connection
+
+    def _get_service_connection(self):
+        with self.connection_lock:
+            if self.service_connection is None:
+                self.service_connection = Connection(self.connection_args,
+                                                     self.connection_args['client_properties']['ariane.app'] + "@" +
+                                                     socket.gethostname() + " - services connection")
+        return self.service_connection
 
     def start(self):
         """
@@ -856,12 +2122,47 @@ class Driver(object):
                 service.stop()
         self.services_registry.clear()
 
+        with self.connection_lock:
+            for connection in self.connection_pool:
+                connection.stop()
+            self.connection_pool.clear()
+            self.connection_pool_index = 0
+            if self.service_connection is not None:
+                self.service_connection.stop()
+                self.service_connection = None
+
+        return self
+
+    async def stop_async(self):
+        """
+        Stop services and requestors and then connection from the driver aio_loop.
+        :return: self
+        """
+        LOGGER.debug("natsd.Driver.stop_async")
+        for requester in self.requester_registry:
+            await requester.stop_async()
+        self.requester_registry.clear()
+
+        for service in self.services_registry:
+            if service.is_started:
+                service.stop()
+        self.services_registry.clear()
+
+        for connection in self.connection_pool:
+            await connection.stop_async()
+        self.connection_pool.clear()
+        self.connection_pool_index = 0
+        if self.service_connection is not None:
+            self.service_connection.stop()
+            self.service_connection = None
+
         return self
 
     def make_service(self, my_args=None):
         """
         make a new service instance and handle it from driver
-        :param my_args: dict like {service_q, treatment_callback [, service_name] }. Default : None
+        :param my_args: dict like {service_q, treatment_callback [, service_name, dispatch_mode, dispatch_pool_size,
+        dispatch_queue_size, dispatch_key] }. Default : None
         :return: created service proxy
         """
         LOGGER.debug("natsd.Driver.make_service")
@@ -869,6 +2170,7 @@ class Driver(object):
             raise exceptions.ArianeConfError('service factory arguments')
         if not self.configuration_OK or self.connection_args is None:
             raise exceptions.ArianeConfError('NATS connection arguments')
+        my_args['connection'] = self._get_service_connection()
         service = Service.start(my_args, self.connection_args).proxy()
         self.services_registry.append(service)
         return service
@@ -876,15 +2178,34 @@ class Driver(object):
     def make_requester(self, my_args=None):
         """
         make a new requester instance and handle it from driver
-        :param my_args: dict like {request_q}. Default : None
-        :return: created requester proxy
+        :param my_args: dict like {request_q[, fire_and_forget]}. Default : None
+        :return: created requester
         """
         LOGGER.debug("natsd.Driver.make_requester")
         if my_args is None:
             raise exceptions.ArianeConfError('requester factory arguments')
         if not self.configuration_OK or self.connection_args is None:
             raise exceptions.ArianeConfError('NATS connection arguments')
-        requester = Requester.start(my_args, self.connection_args).proxy()
+        my_args['connection'] = self._get_requester_connection()
+        requester = Requester(my_args, self.connection_args).start()
+        self.requester_registry.append(requester)
+        return requester
+
+    async def make_requester_async(self, my_args=None):
+        """
+        make a new requester instance started from the driver aio_loop and handle it from driver
+        :param my_args: dict like {request_q[, fire_and_forget]}. Default : None
+        :return: created requester
+        """
+        LOGGER.debug("natsd.Driver.make_requester_async")
+        if my_args is None:
+            raise exceptions.ArianeConfError('requester factory arguments')
+        if not self.configuration_OK or self.connection_args is None:
+            raise exceptions.ArianeConfError('NATS connection arguments')
+        if self.aio_loop is None:
+            raise exceptions.ArianeConfError('NATS driver aio_loop')
+        my_args['connection'] = self._get_requester_connection()
+        requester = await Requester(my_args, self.connection_args).start_async()
         self.requester_registry.append(requester)
         return requester
 
@@ -0,0 +1,1024 @@
+# Ariane CLI Python 3
+# RabbitMQ asyncio Driver
+#
+# Copyright (C) 2016 echinopsii
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import concurrent.futures
+import copy
+import socket
+import threading
+import timeit
+import traceback
+import uuid
+import logging
+from ariane_clip3.exceptions import ArianeMessagingTimeoutError, ArianeError
+
+import pika
+
+from ariane_clip3 import exceptions
+from ariane_clip3.driver_common import DriverTools, DriverCompression
+from ariane_clip3.rabbitmq import driver
+
+
+LOGGER = logging.getLogger(__name__)
+
+__author__ = 'mffrench'
+
+
+class AmqpProtocol(asyncio.Protocol):
+    """
+    asyncio protocol feeding the pika connection adapter with the data read from the broker socket
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.connection = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.connection._on_data_available(data)
+
+    def connection_lost(self, exc):
+        if self.connection is not None:
+            self.connection._on_transport_lost(exc)
+
+
+class AsyncioConnection(pika.connection.Connection):
+    """
+    pika connection adapter on an asyncio event loop : the broker socket is read by the loop when data is available
+    and the frames sent while a loop iteration runs are written at once at its end.
+    :param parameters: the pika connection parameters
+    :param loop: the asyncio event loop
+    :param transport: the asyncio transport connected to the broker
+    """
+
+    def __init__(self, parameters, loop, transport, on_open_callback=None, on_open_error_callback=None,
+                 on_close_callback=None):
+        self.loop = loop
+        self.transport = transport
+        self.flush_scheduled = False
+        super(AsyncioConnection, self).__init__(parameters, on_open_callback, on_open_error_callback,
+                                                on_close_callback)
+
+    def add_timeout(self, deadline, callback_method):
+        """
+        call the callback after deadline sec on the event loop
+        :return: the timeout id to remove it
+        """
+        return self.loop.call_later(deadline, callback_method)
+
+    def remove_timeout(self, timeout_id):
+        timeout_id.cancel()
+
+    def _adapter_connect(self):
+        # the transport is connected before the adapter is made
+        return None
+
+    def _adapter_disconnect(self):
+        if self.transport is not None:
+            self._flush()
+            self.transport.close()
+            self.transport = None
+
+    def _flush_outbound(self):
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self._flush)
+
+    def _flush(self):
+        self.flush_scheduled = False
+        if self.transport is not None and self.outbound_buffer:
+            frames = self.outbound_buffer
+            self.outbound_buffer = type(frames)()
+            self.transport.write(b''.join(frames))
+
+    def _on_transport_lost(self, exc):
+        self.transport = None
+        if not self.is_closed:
+            LOGGER.warn("rabbitmq.aio.AsyncioConnection._on_transport_lost - connection lost : " + str(exc))
+            self._on_connection_closed(None, True)
+
+
+class Connection(object):
+    """
+    asynchronous RabbitMQ connection : one pika connection driven by an asyncio event loop, its own event loop
+    thread or the caller one if provided. Requesters and services are channels on the connection : requests and
+    replies are handled on the event loop without any thread per channel. The treatment callbacks of the services
+    which are not coroutines are run by the connection dispatch pool of dispatch_pool_size threads.
+    :param connection_args: dict like {user, password, host[, port, vhost, client_properties, dispatch_pool_size]}
+    :param name: the connection name as seen by the RabbitMQ broker
+    :param loop: the caller asyncio event loop. Default None : the connection runs its own event loop thread
+    """
+
+    def __init__(self, connection_args=None, name=None, loop=None):
+        """
+        asynchronous RabbitMQ connection constructor
+        :param connection_args: dict like {user, password, host[, port, vhost, client_properties,
+        dispatch_pool_size]}
+        :param name: the connection name as seen by the RabbitMQ broker
+        :param loop: the caller asyncio event loop. Default None : the connection runs its own event loop thread
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Connection.__init__")
+        Driver.validate_driver_conf(connection_args)
+        self.client_properties = copy.deepcopy(connection_args['client_properties'])
+        if name is not None:
+            self.client_properties['information'] = self.client_properties['information'] + " - " + name
+        self.name = name
+        self.host = connection_args['host']
+        self.port = connection_args['port']
+        self.credentials = pika.PlainCredentials(connection_args['user'], connection_args['password'])
+        self.parameters = pika.ConnectionParameters(connection_args['host'], connection_args['port'],
+                                                    connection_args['vhost'], credentials=self.credentials,
+                                                    client_props=self.client_properties)
+        self.dispatch_pool_size = connection_args['dispatch_pool_size']
+        self.executor = None
+        self.loop = loop
+        # with a caller event loop the connection must be started and stopped with start_async and stop_async
+        self.external_loop = loop is not None
+        self.thread = None
+        # the thread running the event loop, known once started
+        self.loop_thread = None
+        self.connection = None
+        self.is_started = False
+        # set while connecting
+        self.opening = None
+        # futures waiting a broker reply, failed if the connection is closed
+        self.waiters = set()
+        # called on the event loop when the connection is closed
+        self.close_listeners = []
+        self.lock = threading.Lock()
+
+    def run_event_loop(self):
+        LOGGER.debug("rabbitmq.aio.Connection.run_event_loop")
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run_coroutine(self, coroutine, timeout=None):
+        """
+        run a coroutine on the connection event loop and wait its result (to be called from outside the loop)
+        :param coroutine: the coroutine to run
+        :param timeout: max time to wait the result (sec). Default None : no timeout
+        :return: the coroutine result
+        """
+        if self.loop_thread is threading.current_thread():
+            coroutine.close()
+            raise ArianeError('rabbitmq.aio.Connection.run_coroutine',
+                              'Blocking call from the connection event loop : use the async method !')
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def new_waiter(self):
+        """
+        :return: a future for a broker reply, failed if the connection is closed before the reply
+        """
+        waiter = self.loop.create_future()
+        self.waiters.add(waiter)
+        waiter.add_done_callback(self.waiters.discard)
+        return waiter
+
+    @staticmethod
+    def _set_waiter_result(waiter, result):
+        if not waiter.done():
+            waiter.set_result(result)
+
+    async def start_async(self):
+        """
+        connect to the RabbitMQ broker from the connection event loop
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Connection.start_async")
+        if self.is_started:
+            return self
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        self.loop_thread = threading.current_thread()
+        if self.opening is not None:
+            # requesters and services started together share the same connect
+            await asyncio.shield(self.opening)
+            return self
+        self.opening = self.new_waiter()
+        try:
+            protocol = AmqpProtocol()
+            transport, protocol = await self.loop.create_connection(lambda: protocol, self.host, self.port)
+            transport.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connection = AsyncioConnection(self.parameters, self.loop, transport,
+                                                on_open_callback=lambda connection:
+                                                Connection._set_waiter_result(self.opening, connection),
+                                                on_close_callback=self._on_connection_closed)
+            protocol.connection = self.connection
+            await asyncio.shield(self.opening)
+        except Exception as e:
+            if not self.opening.done():
+                self.opening.set_exception(e)
+            raise e
+        finally:
+            self.opening = None
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.dispatch_pool_size)
+        self.is_started = True
+        return self
+
+    async def stop_async(self):
+        """
+        close the RabbitMQ connection from the connection event loop
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Connection.stop_async")
+        if not self.is_started:
+            return self
+        self.is_started = False
+        closed = self.loop.create_future()
+        self.close_listeners.append(lambda: Connection._set_waiter_result(closed, None))
+        try:
+            self.connection.close()
+            await asyncio.wait_for(closed, 10)
+        except Exception as e:
+            LOGGER.warn("rabbitmq.aio.Connection.stop_async - exception on close : " + traceback.format_exc())
+            self.connection._adapter_disconnect()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.close_listeners.clear()
+        return self
+
+    def _on_connection_closed(self, connection, reply_code, reply_text):
+        # on the connection event loop
+        LOGGER.debug("rabbitmq.aio.Connection._on_connection_closed - " + str(reply_code) + " : " + str(reply_text))
+        self.is_started = False
+        for waiter in list(self.waiters):
+            if not waiter.done():
+                waiter.set_exception(ArianeError('rabbitmq.aio.Connection', 'Connection closed (' + str(reply_code) +
+                                                 ' : ' + str(reply_text) + ') !'))
+        for listener in list(self.close_listeners):
+            try:
+                listener()
+            except Exception as e:
+                LOGGER.warn("rabbitmq.aio.Connection._on_connection_closed - Exception raised by close listener : " +
+                            traceback.format_exc())
+
+    def start(self):
+        """
+        start the event loop thread (if the connection has no caller event loop) and connect to the RabbitMQ broker.
+        Not to be called from the connection event loop : use start_async there.
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Connection.start")
+        with self.lock:
+            if self.is_started:
+                return self
+            if not self.external_loop:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.run_event_loop, name=str(self.name) + " thread")
+                self.thread.start()
+            try:
+                self.run_coroutine(self.start_async())
+            except Exception as e:
+                LOGGER.error("rabbitmq.aio.Connection.start - unable to connect " + str(self.name) + " : " + str(e))
+                if not self.external_loop:
+                    self._stop_event_loop()
+                raise e
+        return self
+
+    def _stop_event_loop(self):
+        try:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=120)
+            if self.thread.is_alive():
+                LOGGER.error("rabbitmq.aio.Connection.stop - unable to stop aio loop after 120 sec")
+            else:
+                self.loop.close()
+        except Exception as e:
+            LOGGER.warn("rabbitmq.aio.Connection.stop - exception on aio clean : " + traceback.format_exc())
+        self.thread = None
+
+    def stop(self):
+        """
+        close the RabbitMQ connection and stop the event loop thread
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Connection.stop")
+        with self.lock:
+            if not self.is_started:
+                return self
+            try:
+                self.run_coroutine(self.stop_async(), timeout=15)
+            except Exception as e:
+                LOGGER.warn("rabbitmq.aio.Connection.stop - exception on close : " + traceback.format_exc())
+            if not self.external_loop:
+                self._stop_event_loop()
+        return self
+
+    async def channel_async(self):
+        """
+        open a new channel on the connection from the connection event loop
+        :return: the pika channel
+        """
+        LOGGER.debug("rabbitmq.aio.Connection.channel_async")
+        opened = self.new_waiter()
+        self.connection.channel(lambda channel: Connection._set_waiter_result(opened, channel))
+        return await opened
+
+    async def channel_rpc_async(self, rpc, *args, **kwargs):
+        """
+        call a pika channel method taking the reply callback as first argument and await the broker reply from the
+        connection event loop
+        :param rpc: the pika channel method
+        :return: the broker reply frame
+        """
+        reply = self.new_waiter()
+        rpc(lambda frame: Connection._set_waiter_result(reply, frame), *args, **kwargs)
+        return await reply
+
+    async def close_channel_async(self, channel):
+        """
+        close a channel opened on the connection from the connection event loop
+        :param channel: the pika channel
+        """
+        LOGGER.debug("rabbitmq.aio.Connection.close_channel_async")
+        if not self.is_started or not channel.is_open:
+            return
+        closed = self.new_waiter()
+        channel.add_on_close_callback(lambda *args: Connection._set_waiter_result(closed, None))
+        channel.close()
+        await closed
+
+
+class Requester(object):
+    """
+    asynchronous RabbitMQ requester implementation. The requester is a channel on a connection driven by an asyncio
+    event loop : call_async is a coroutine awaiting the reply on the connection event loop, so that thousands of
+    requests can be in flight at once without any thread. call runs call_async from the callers outside of the loop.
+    Replies are consumed from an exclusive reply queue declared by the requester, or with direct_reply_to from the
+    RabbitMQ amq.rabbitmq.reply-to pseudo queue.
+    Requests bodies bigger than compression_threshold bytes are deflated as with the blocking RabbitMQ requester :
+    only once the service has advertised it can decompress them.
+    :param my_args: dict like {connection, request_q[, fire_and_forget, direct_reply_to, compression_threshold]}
+    """
+
+    def __init__(self, my_args=None, connection_args=None):
+        """
+        asynchronous RabbitMQ requester constructor
+        :param my_args: dict like {request_q[, connection, fire_and_forget, direct_reply_to, compression_threshold]}.
+        If no connection is provided the requester will open its own. direct_reply_to and compression_threshold
+        defaults are the connection_args ones (default False and 0 : no compression).
+        :param connection_args: dict like {user, password, host[, port, vhost, client_properties, direct_reply_to,
+        compression_threshold]}
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Requester.__init__")
+        if my_args is None:
+            raise exceptions.ArianeConfError("requestor arguments")
+        if 'request_q' not in my_args or my_args['request_q'] is None or not my_args['request_q']:
+            raise exceptions.ArianeConfError("request_q")
+        if 'fire_and_forget' not in my_args or my_args['fire_and_forget'] is None or not my_args['fire_and_forget']:
+            self.fire_and_forget = False
+        else:
+            self.fire_and_forget = True
+        if 'rpc_timeout' not in connection_args or connection_args['rpc_timeout'] is None or \
+                not connection_args['rpc_timeout']:
+            # default timeout = no timeout
+            self.rpc_timeout = 0
+        else:
+            self.rpc_timeout = connection_args['rpc_timeout']
+
+        if 'rpc_retry' not in connection_args or connection_args['rpc_retry'] is None or \
+                not connection_args['rpc_retry']:
+            # default retry = no retry
+            self.rpc_retry = 0
+        else:
+            self.rpc_retry = connection_args['rpc_retry']
+
+        self.trace = False
+        Driver.validate_driver_conf(connection_args)
+
+        if 'direct_reply_to' not in my_args or my_args['direct_reply_to'] is None:
+            self.direct_reply_to = connection_args['direct_reply_to']
+        else:
+            self.direct_reply_to = bool(my_args['direct_reply_to'])
+        if 'compression_threshold' not in my_args or my_args['compression_threshold'] is None:
+            self.compression = DriverCompression(connection_args['compression_threshold'])
+        else:
+            self.compression = DriverCompression(int(my_args['compression_threshold']))
+
+        self.connection_args = copy.deepcopy(connection_args)
+        if 'connection' in my_args and my_args['connection'] is not None:
+            self.connection = my_args['connection']
+            self.own_connection = False
+        else:
+            self.connection = Connection(self.connection_args, "requestor on " + my_args['request_q'])
+            self.own_connection = True
+        self.channel = None
+        self.callback_queue = None
+        self.requestQ = my_args['request_q']
+        # correlation ID -> future of the requests waiting for their reply, on the connection event loop
+        self.pending_calls = {}
+        self.is_started = False
+
+    def start(self):
+        """
+        open the requester channel. Not to be called from the connection event loop : use start_async there.
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Requester.start")
+        if self.is_started:
+            return self
+        self.connection.start()
+        return self.connection.run_coroutine(self.start_async())
+
+    async def start_async(self):
+        """
+        open the requester channel from the connection event loop
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Requester.start_async")
+        if self.is_started:
+            return self
+        await self.connection.start_async()
+        self.channel = await self.connection.channel_async()
+        await self.connection.channel_rpc_async(self.channel.queue_declare, queue=self.requestQ, auto_delete=True)
+        if not self.fire_and_forget:
+            if self.direct_reply_to:
+                # must be consumed in no ack mode on the channel requests are published on
+                self.callback_queue = driver.Requester.DIRECT_REPLY_TO_Q
+            else:
+                result = await self.connection.channel_rpc_async(self.channel.queue_declare, exclusive=True,
+                                                                 auto_delete=True)
+                self.callback_queue = result.method.queue
+            self.channel.basic_consume(self.on_response, no_ack=True, queue=self.callback_queue)
+        self.connection.close_listeners.append(self._wake_pending_calls)
+        self.is_started = True
+        return self
+
+    def stop(self):
+        """
+        close the requester channel. Not to be called from the connection event loop : use stop_async there.
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Requester.stop")
+        if not self.is_started:
+            return self
+        if self.connection.is_started:
+            self.connection.run_coroutine(self.stop_async())
+        else:
+            self.is_started = False
+        if self.own_connection:
+            self.connection.stop()
+        return self
+
+    async def stop_async(self):
+        """
+        close the requester channel from the connection event loop
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Requester.stop_async")
+        if not self.is_started:
+            return self
+        self.is_started = False
+        if self._wake_pending_calls in self.connection.close_listeners:
+            self.connection.close_listeners.remove(self._wake_pending_calls)
+        try:
+            await self.connection.close_channel_async(self.channel)
+        except Exception as e:
+            LOGGER.warn("rabbitmq.aio.Requester.stop_async - Exception raised while closing channel")
+        self.channel = None
+        self._wake_pending_calls()
+        if self.own_connection and self.connection.external_loop:
+            await self.connection.stop_async()
+        return self
+
+    def _wake_pending_calls(self):
+        """
+        wake the calls still waiting a reply when the requester or its connection stops : they will fail fast
+        """
+        for pending_call in self.pending_calls.values():
+            if not pending_call.done():
+                pending_call.set_result(None)
+
+    def on_response(self, ch, method_frame, props, body):
+        """
+        route the response to the call waiting for it thanks to its correlation id, on the connection event loop
+        """
+        LOGGER.debug("rabbitmq.aio.Requester.on_response")
+        pending_call = self.pending_calls.get(props.correlation_id)
+        if pending_call is not None and not pending_call.done():
+            pending_call.set_result({'props': props, 'body': body})
+            return
+        LOGGER.warn("rabbitmq.aio.Requester.on_response - discarded response : " +
+                    str(props.correlation_id))
+
+    def _make_request(self, my_args):
+        """
+        check the call arguments and build the request
+        :param my_args: dict like {properties, body}
+        :return: (corr_id, request_q, properties, body)
+        """
+        if not self.is_started:
+            raise ArianeError('rabbitmq.aio.Requester.call',
+                              'Requester not started !')
+        if my_args is None:
+            raise exceptions.ArianeConfError("requestor call arguments")
+        if 'properties' not in my_args or my_args['properties'] is None:
+            raise exceptions.ArianeConfError('requestor call properties')
+        if 'body' not in my_args or my_args['body'] is None:
+            my_args['body'] = ''
+        if 'MSG_CORRELATION_ID' not in my_args['properties']:
+            corr_id = str(uuid.uuid4())
+            my_args['properties']['MSG_CORRELATION_ID'] = corr_id
+        else:
+            corr_id = my_args['properties']['MSG_CORRELATION_ID']
+
+        props = my_args['properties']
+        if 'sessionID' in props and props['sessionID'] is not None and props['sessionID']:
+            request_q = str(props['sessionID']) + '-' + self.requestQ
+        else:
+            request_q = self.requestQ
+
+        if self.trace:
+            props['MSG_TRACE'] = True
+
+        body = str(my_args['body'])
+        content_encoding = None
+        if self.compression.threshold > 0 and body:
+            # the service may compress its reply too
+            props[DriverTools.MSG_ACCEPT_ENCODING] = DriverCompression.CONTENT_ENCODING_DEFLATE
+            compressed_body, content_encoding = self.compression.compress(self.requestQ, body.encode('UTF-8'))
+            if content_encoding is not None:
+                body = compressed_body
+
+        if not self.fire_and_forget:
+            properties = pika.BasicProperties(headers=props, content_encoding=content_encoding,
+                                              correlation_id=corr_id, reply_to=self.callback_queue)
+        else:
+            properties = pika.BasicProperties(headers=props, content_encoding=content_encoding)
+        return corr_id, request_q, properties, body
+
+    def get_compression_stats(self):
+        """
+        get the requests and responses bodies compression statistics
+        :return: dict like {queue: {compressed, compressed_bytes_in, compressed_bytes_out, compression_ratio,
+        compress_time, decompressed, decompressed_bytes_in, decompressed_bytes_out, decompression_ratio,
+        decompress_time}}
+        """
+        return self.compression.get_stats()
+
+    def call(self, my_args=None):
+        """
+        setup the request and call the remote service. Wait the answer (blocking call). Not to be called from the
+        connection event loop : use call_async there.
+        :param my_args: dict like {properties, body}
+        :return response
+        """
+        LOGGER.debug("rabbitmq.aio.Requester.call")
+        if not self.is_started:
+            raise ArianeError('rabbitmq.aio.Requester.call',
+                              'Requester not started !')
+        return self.connection.run_coroutine(self.call_async(my_args))
+
+    async def call_async(self, my_args=None):
+        """
+        setup the request and call the remote service from the connection event loop. Await the answer.
+        :param my_args: dict like {properties, body}
+        :return response
+        """
+        corr_id, request_q, properties, body = self._make_request(my_args)
+        if self.fire_and_forget:
+            self.channel.basic_publish(exchange='', routing_key=request_q, properties=properties, body=body)
+            return None
+
+        pending_call = self.connection.loop.create_future()
+        self.pending_calls[corr_id] = pending_call
+        try:
+            if not self.is_started or not self.connection.is_started:
+                raise ArianeError('rabbitmq.aio.Requester.call',
+                                  'Requester not started !')
+            start_time = timeit.default_timer()
+            self.channel.basic_publish(exchange='', routing_key=request_q, properties=properties, body=body)
+            try:
+                response = await asyncio.wait_for(pending_call, self.rpc_timeout if self.rpc_timeout > 0 else None)
+            except asyncio.TimeoutError:
+                response = None
+            rpc_time = timeit.default_timer() - start_time
+        finally:
+            self.pending_calls.pop(corr_id, None)
+
+        if response is None:
+            if not self.is_started or not self.connection.is_started:
+                raise ArianeError('rabbitmq.aio.Requester.call',
+                                  'Requester stopped while waiting the response !')
+            if self.rpc_retry > 0:
+                if 'retry_count' not in my_args:
+                    my_args['retry_count'] = 1
+                    LOGGER.debug("rabbitmq.aio.Requester.call - Retry (" + str(my_args['retry_count']) + ")")
+                    return await self.call_async(my_args)
+                elif 'retry_count' in my_args and (self.rpc_retry - my_args['retry_count']) > 0:
+                    LOGGER.warn("rabbitmq.aio.Requester.call - No response returned from request on " + request_q +
+                                " queue after " + str(self.rpc_timeout) + '*' +
+                                str(self.rpc_retry) + " sec ...")
+                    self.trace = True
+                    my_args['retry_count'] += 1
+                    LOGGER.warn("rabbitmq.aio.Requester.call - Retry (" + str(my_args['retry_count']) + ")")
+                    return await self.call_async(my_args)
+                else:
+                    raise ArianeMessagingTimeoutError('rabbitmq.aio.Requester.call',
+                                                      'Request timeout (' + str(self.rpc_timeout) + '*' +
+                                                      str(self.rpc_retry) + ' sec) occured')
+            else:
+                raise ArianeMessagingTimeoutError('rabbitmq.aio.Requester.call',
+                                                  'Request timeout (' + str(self.rpc_timeout) + '*' +
+                                                  str(self.rpc_retry) + ' sec) occured')
+        else:
+            if self.rpc_timeout > 0 and rpc_time > self.rpc_timeout*3/5:
+                LOGGER.debug('rabbitmq.aio.Requester.call - slow RPC time (' + str(rpc_time) + ') on request ' +
+                             str(properties))
+            self.trace = False
+            response = driver.Requester._decompress_response(self.compression, self.requestQ, response)
+            return driver.Requester._make_response(response)
+
+
+class Service(object):
+    """
+    asynchronous RabbitMQ service implementation. The service is a channel on a connection driven by an asyncio event
+    loop : requests are consumed on the connection event loop and treated by the treatment callback, awaited on the
+    event loop if it is a coroutine function or else run by the connection dispatch pool shared by all the services
+    of the connection. Each request is acked on the event loop once treated. The broker delivers up to
+    prefetch_count requests not acked yet (default 1000, 0 : no limit).
+    :param my_args: dict like {connection, service_q, treatment_callback[, service_name, prefetch_count]}
+    :param connection_args: dict like {user, password, host[, port, vhost, client_properties, dispatch_pool_size]}
+    """
+
+    def __init__(self, my_args=None, connection_args=None):
+        """
+        asynchronous RabbitMQ service constructor
+        :param my_args: dict like {service_q, treatment_callback[, connection, service_name, prefetch_count]}. If no
+        connection is provided the service will open its own.
+        :param connection_args: dict like {user, password, host[, port, vhost, client_properties,
+        dispatch_pool_size]}
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Service.__init__")
+        if my_args is None or connection_args is None:
+            raise exceptions.ArianeConfError("service arguments")
+        if 'service_q' not in my_args or my_args['service_q'] is None or not my_args['service_q']:
+            raise exceptions.ArianeConfError("service_q")
+        if 'treatment_callback' not in my_args or my_args['treatment_callback'] is None:
+            raise exceptions.ArianeConfError("treatment_callback")
+        if 'service_name' not in my_args or my_args['service_name'] is None or not my_args['service_name']:
+            LOGGER.warn("rabbitmq.aio.Service.__init__ - service_name is not defined ! Use default : " +
+                        self.__class__.__name__)
+            my_args['service_name'] = self.__class__.__name__
+        if 'prefetch_count' not in my_args or my_args['prefetch_count'] is None:
+            my_args['prefetch_count'] = 1000
+
+        Driver.validate_driver_conf(connection_args)
+
+        self.connection_args = copy.deepcopy(connection_args)
+        if 'connection' in my_args and my_args['connection'] is not None:
+            self.connection = my_args['connection']
+            self.own_connection = False
+        else:
+            self.connection = Connection(self.connection_args, my_args['service_name'])
+            self.own_connection = True
+        self.channel = None
+        self.consumer_tag = None
+        self.serviceQ = my_args['service_q']
+        self.service_name = my_args['service_name']
+        self.cb = my_args['treatment_callback']
+        self.cb_is_coroutine = asyncio.iscoroutinefunction(self.cb)
+        self.prefetch_count = int(my_args['prefetch_count'])
+        # the treatments running on the connection event loop
+        self.treatments = set()
+        # requests bodies are decompressed before their treatment
+        self.compression = DriverCompression()
+        self.dispatch_stats = {
+            'treated': 0,
+            'failed': 0,
+            'in_flight_max': 0,
+            'treatment_time_total': 0,
+            'treatment_time_max': 0
+        }
+        self.is_started = False
+
+    def start(self):
+        """
+        start consuming the service queue. Not to be called from the connection event loop : use start_async there.
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Service.start")
+        if self.is_started:
+            return self
+        self.connection.start()
+        return self.connection.run_coroutine(self.start_async())
+
+    async def start_async(self):
+        """
+        start consuming the service queue from the connection event loop
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Service.start_async")
+        if self.is_started:
+            return self
+        await self.connection.start_async()
+        self.channel = await self.connection.channel_async()
+        await self.connection.channel_rpc_async(self.channel.queue_declare, queue=self.serviceQ, auto_delete=True)
+        if self.prefetch_count > 0:
+            await self.connection.channel_rpc_async(self.channel.basic_qos, prefetch_count=self.prefetch_count)
+        self.consumer_tag = self.channel.basic_consume(self.on_request, self.serviceQ)
+        self.is_started = True
+        return self
+
+    def stop(self):
+        """
+        stop the service. Not to be called from the connection event loop : use stop_async there.
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Service.stop")
+        if not self.is_started:
+            return self
+        if self.connection.is_started:
+            self.connection.run_coroutine(self.stop_async())
+        else:
+            self.is_started = False
+        if self.own_connection:
+            self.connection.stop()
+        return self
+
+    async def stop_async(self):
+        """
+        stop the service from the connection event loop once the requests being treated are acked
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Service.stop_async")
+        if not self.is_started:
+            return self
+        self.is_started = False
+        try:
+            if self.consumer_tag is not None:
+                await self.connection.channel_rpc_async(self.channel.basic_cancel, consumer_tag=self.consumer_tag)
+                self.consumer_tag = None
+            if self.treatments:
+                await asyncio.wait(list(self.treatments))
+            await self.connection.close_channel_async(self.channel)
+        except Exception as e:
+            LOGGER.warn("rabbitmq.aio.Service.stop_async - Exception raised while closing channel : " +
+                        traceback.format_exc())
+        self.channel = None
+        if self.own_connection and self.connection.external_loop:
+            await self.connection.stop_async()
+        return self
+
+    async def _treat(self, properties, body, delivery_tag):
+        start_time = timeit.default_timer()
+        failed = False
+        try:
+            if self.cb_is_coroutine:
+                await self.cb(properties, body)
+            else:
+                await self.connection.loop.run_in_executor(self.connection.executor, self.cb, properties, body)
+        except Exception as e:
+            failed = True
+            LOGGER.warn("rabbitmq.aio.Service._treat - Exception raised while treating msg {" + str(properties) +
+                        "," + str(body) + "} : " + traceback.format_exc())
+        treatment_time = timeit.default_timer() - start_time
+        self.dispatch_stats['treated'] += 1
+        if failed:
+            self.dispatch_stats['failed'] += 1
+        self.dispatch_stats['treatment_time_total'] += treatment_time
+        if treatment_time > self.dispatch_stats['treatment_time_max']:
+            self.dispatch_stats['treatment_time_max'] = treatment_time
+        if self.channel is not None and self.channel.is_open:
+            self.channel.basic_ack(delivery_tag=delivery_tag)
+
+    def get_dispatch_stats(self):
+        """
+        get the requests dispatch statistics (times in sec)
+        :return: dict like {prefetch_count, in_flight, in_flight_max, treated, failed, treatment_time_total,
+        treatment_time_max, treatment_time_avg}
+        """
+        stats = dict(self.dispatch_stats)
+        stats['prefetch_count'] = self.prefetch_count
+        stats['in_flight'] = self.treatments.__len__()
+        stats['treatment_time_avg'] = stats['treatment_time_total'] / stats['treated'] if stats['treated'] else 0
+        return stats
+
+    def get_compression_stats(self):
+        """
+        get the requests bodies decompression statistics
+        :return: dict like {queue: {decompressed, decompressed_bytes_in, decompressed_bytes_out, decompression_ratio,
+        decompress_time, ...}}
+        """
+        return self.compression.get_stats()
+
+    def on_request(self, ch, method_frame, props, body):
+        """
+        message consumed treatment through provided callback and basic ack, scheduled on the connection event loop
+        """
+        LOGGER.debug("rabbitmq.aio.Service.on_request - request " + str(props) + " received")
+        try:
+            properties = driver.Service._make_properties(props)
+        except Exception as e:
+            LOGGER.warn("rabbitmq.aio.Service.on_request - Exception raised while reading msg {" +
+                        str(props) + "," + str(body) + "} properties")
+            ch.basic_ack(delivery_tag=method_frame.delivery_tag)
+            return
+        if properties['content_encoding'] in DriverCompression.DECOMPRESSED_ENCODINGS:
+            try:
+                body = self.compression.decompress(self.serviceQ, body, properties['content_encoding'])
+                properties['content_encoding'] = None
+            except Exception as e:
+                LOGGER.warn("rabbitmq.aio.Service.on_request - Exception raised while decompressing msg {" +
+                            str(props) + "} body")
+                ch.basic_ack(delivery_tag=method_frame.delivery_tag)
+                return
+        treatment = self.connection.loop.create_task(self._treat(properties, body, method_frame.delivery_tag))
+        self.treatments.add(treatment)
+        treatment.add_done_callback(self.treatments.discard)
+        if self.treatments.__len__() > self.dispatch_stats['in_flight_max']:
+            self.dispatch_stats['in_flight_max'] = self.treatments.__len__()
+
+
+class Driver(object):
+    """
+    asynchronous RabbitMQ driver class. All the requesters and services of the driver are channels on one connection
+    driven by one asyncio event loop : the driver own event loop thread, or the caller aio_loop if provided. The
+    treatment callbacks of the services which are not coroutines share a dispatch pool of dispatch_pool_size threads
+    (default 4). Requesters and services are made with make_requester and make_service, or with make_requester_async
+    and make_service_async from the driver event loop where the requesters are called with call_async.
+    :param my_args: dict like {user, password, host[, port, vhost, client_properties, direct_reply_to,
+    compression_threshold, dispatch_pool_size, aio_loop]}. Default = None
+    """
+
+    @staticmethod
+    def validate_driver_conf(my_args=None):
+        LOGGER.debug("rabbitmq.aio.Driver.validate_driver_conf")
+        default_dispatch_pool_size = 4
+        driver.Driver.validate_driver_conf(my_args)
+        if 'dispatch_pool_size' not in my_args or my_args['dispatch_pool_size'] is None or \
+                not my_args['dispatch_pool_size']:
+            my_args['dispatch_pool_size'] = default_dispatch_pool_size
+        else:
+            my_args['dispatch_pool_size'] = int(my_args['dispatch_pool_size'])
+
+    def __init__(self, my_args=None):
+        """
+        asynchronous RabbitMQ driver constructor
+        :param my_args: dict like {user, password, host[, port, vhost, client_properties, direct_reply_to,
+        compression_threshold, dispatch_pool_size, aio_loop]}. Default = None
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Driver.__init__")
+        self.type = my_args['type']
+        # the event loop is not part of the connection arguments which are copied by requesters and services
+        self.aio_loop = my_args.pop('aio_loop', None)
+        self.configuration_OK = False
+        try:
+            Driver.validate_driver_conf(my_args)
+            self.configuration_OK = True
+        except Exception as e:
+            raise e
+
+        self.connection_args = my_args
+        self.services_registry = []
+        self.requester_registry = []
+        self.connection = None
+        self.connection_lock = threading.Lock()
+
+    def _get_connection(self):
+        with self.connection_lock:
+            if self.connection is None:
+                self.connection = Connection(self.connection_args, "requestors and services connection",
+                                             loop=self.aio_loop)
+        return self.connection
+
+    def _check_make_args(self, my_args, what):
+        if my_args is None:
+            raise exceptions.ArianeConfError(what + ' factory arguments')
+        if not self.configuration_OK or self.connection_args is None:
+            raise exceptions.ArianeConfError('rabbitmq connection arguments')
+        my_args['connection'] = self._get_connection()
+
+    def start(self):
+        """
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Driver.start")
+        return self
+
+    def stop(self):
+        """
+        Stop services and requestors and then connection.
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Driver.stop")
+        for requester in self.requester_registry:
+            requester.stop()
+        self.requester_registry.clear()
+
+        for service in self.services_registry:
+            service.stop()
+        self.services_registry.clear()
+
+        with self.connection_lock:
+            if self.connection is not None:
+                self.connection.stop()
+                self.connection = None
+
+        return self
+
+    async def stop_async(self):
+        """
+        Stop services and requestors and then connection from the driver aio_loop.
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.aio.Driver.stop_async")
+        for requester in self.requester_registry:
+            await requester.stop_async()
+        self.requester_registry.clear()
+
+        for service in self.services_registry:
+            await service.stop_async()
+        self.services_registry.clear()
+
+        if self.connection is not None:
+            await self.connection.stop_async()
+            self.connection = None
+
+        return self
+
+    def make_service(self, my_args=None):
+        """
+        make a new service instance and handle it from driver
+        :param my_args: dict like {service_q, treatment_callback [, service_name, prefetch_count] }. Default : None
+        :return: created service
+        """
+        LOGGER.debug("rabbitmq.aio.Driver.make_service")
+        self._check_make_args(my_args, 'service')
+        service = Service(my_args, self.connection_args).start()
+        self.services_registry.append(service)
+        return service
+
+    async def make_service_async(self, my_args=None):
+        """
+        make a new service instance started from the driver event loop and handle it from driver
+        :param my_args: dict like {service_q, treatment_callback [, service_name, prefetch_count] }. Default : None
+        :return: created service
+        """
+        LOGGER.debug("rabbitmq.aio.Driver.make_service_async")
+        self._check_make_args(my_args, 'service')
+        service = await Service(my_args, self.connection_args).start_async()
+        self.services_registry.append(service)
+        return service
+
+    def make_requester(self, my_args=None):
+        """
+        make a new requester instance and handle it from driver
+        :param my_args: dict like {request_q[, fire_and_forget, direct_reply_to, compression_threshold]}. Default : None
+        :return: created requester
+        """
+        LOGGER.debug("rabbitmq.aio.Driver.make_requester")
+        self._check_make_args(my_args, 'requester')
+        requester = Requester(my_args, self.connection_args).start()
+        self.requester_registry.append(requester)
+        return requester
+
+    async def make_requester_async(self, my_args=None):
+        """
+        make a new requester instance started from the driver event loop and handle it from driver
+        :param my_args: dict like {request_q[, fire_and_forget, direct_reply_to, compression_threshold]}. Default : None
+        :return: created requester
+        """
+        LOGGER.debug("rabbitmq.aio.Driver.make_requester_async")
+        self._check_make_args(my_args, 'requester')
+        requester = await Requester(my_args, self.connection_args).start_async()
+        self.requester_registry.append(requester)
+        return requester
+
+    def make_publisher(self):
+        """
+        not implemented
+        :return:
+        """
+        LOGGER.debug("rabbitmq.aio.Driver.make_publisher")
+        raise exceptions.ArianeNotImplemented(self.__class__.__name__ + ".make_publisher")
+
+    def make_subscriber(self):
+        """
+        not implemented
+        :return:
+        """
+        LOGGER.debug("rabbitmq.aio.Driver.make_subscriber")
+        raise exceptions.ArianeNotImplemented(self.__class__.__name__ + ".make_subscriber")
@@ -15,20 +15,25 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import collections
 import copy
+import functools
 import json
+import selectors
 import socket
 import threading
 import timeit
+import traceback
 import uuid
 import logging
-from ariane_clip3.exceptions import ArianeMessagingTimeoutError
+import queue
+from ariane_clip3.exceptions import ArianeMessagingTimeoutError, ArianeError
 
 import pika
 import pykka
 
 from ariane_clip3 import exceptions
-from ariane_clip3.driver_common import DriverResponse
+from ariane_clip3.driver_common import DriverTools, DriverResponse, DriverCompression
 
 
 LOGGER = logging.getLogger(__name__)
@@ -36,17 +41,266 @@ LOGGER = logging.getLogger(__name__)
 __author__ = 'mffrench'
 
 
-class Requester(pykka.ThreadingActor):
+class Connection(object):
     """
-    RabbitMQ requester implementation
-    :param my_args: dict like {connection, request_q}
+    RabbitMQ connection : one pika BlockingConnection owned by a single pump thread. A connection is shared by several
+    requesters and services which are just channels on top of it. Channel operations are run on the pump thread as
+    tasks, between two process_data_events, and the channels consumers callbacks are called from the pump thread too.
+    Between two rounds the pump thread waits for the broker socket to be readable or for a task to be submitted : the
+    submitter wakes it up through a socket pair instead of letting it wait for the pika read poll timeout.
+    :param connection_args: dict like {user, password, host[, port, vhost, client_properties]}
+    :param name: the connection name as seen by the RabbitMQ broker
     """
 
+    # max time to wait in sec between two pump rounds so that the pika timeouts (heartbeats...) are processed
+    WAIT_EVENTS_TIMEOUT = 1
+
+    def __init__(self, connection_args=None, name=None):
+        """
+        RabbitMQ connection constructor
+        :param connection_args: dict like {user, password, host[, port, vhost, client_properties]}
+        :param name: the connection name as seen by the RabbitMQ broker
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.Connection.__init__")
+        Driver.validate_driver_conf(connection_args)
+        self.client_properties = copy.deepcopy(connection_args['client_properties'])
+        if name is not None:
+            self.client_properties['information'] = self.client_properties['information'] + " - " + name
+        self.name = name
+        self.credentials = pika.PlainCredentials(connection_args['user'], connection_args['password'])
+        self.parameters = pika.ConnectionParameters(connection_args['host'], connection_args['port'],
+                                                    connection_args['vhost'], credentials=self.credentials,
+                                                    client_props=self.client_properties)
+        self.connection = None
+        self.pump = None
+        self.is_started = False
+        # [task, ...] of the tasks to run on the pump thread
+        self.tasks = collections.deque()
+        # socket pair written by the tasks submitters to wake the pump thread up
+        self.waker = None
+        self.wakeup = None
+        # wait for the broker socket and the wakeup socket events. None if the pika connection has no socket
+        self.selector = None
+        self.channels_count = 0
+        # called from the pump thread when it ends
+        self.close_listeners = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        open the connection and start the pump thread
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.Connection.start")
+        with self.lock:
+            if self.is_started:
+                return self
+            self.connection = pika.BlockingConnection(self.parameters)
+            self.waker, self.wakeup = socket.socketpair()
+            self.waker.setblocking(False)
+            self.wakeup.setblocking(False)
+            self.selector = self._make_selector()
+            self.is_started = True
+            self.pump = threading.Thread(target=self.run, name="rabbitmq connection " + str(self.name))
+            self.pump.start()
+        return self
+
+    def stop(self):
+        """
+        stop the pump thread once the queued tasks are done and close the connection
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.Connection.stop")
+        with self.lock:
+            if not self.is_started:
+                return self
+            self.is_started = False
+            pump = self.pump
+            self.pump = None
+        self._wake()
+        if pump is not threading.current_thread():
+            pump.join()
+        return self
+
+    def run(self):
+        """
+        run the queued tasks and process the connection data events on the pump thread until the connection is
+        stopped.
+        """
+        LOGGER.debug("rabbitmq.Connection.run")
+        try:
+            while self.is_started:
+                self._run_tasks()
+                self.connection.process_data_events()
+                self._wait_events()
+            self._run_tasks()
+            self.connection.process_data_events()
+        except Exception as e:
+            LOGGER.error("rabbitmq.Connection.run - Exception raised while pumping : " + traceback.format_exc())
+            self.is_started = False
+        for listener in list(self.close_listeners):
+            try:
+                listener()
+            except Exception as e:
+                LOGGER.warn("rabbitmq.Connection.run - Exception raised by close listener : " +
+                            traceback.format_exc())
+        try:
+            self.connection.close()
+        except Exception as e:
+            LOGGER.warn("rabbitmq.Connection.run - Exception raised while closing connection")
+        if self.selector is not None:
+            self.selector.close()
+        self.waker.close()
+        self.wakeup.close()
+
+    def _make_selector(self):
+        """
+        register the broker socket and the wakeup socket on a selector. As the pump thread waits on this selector the
+        pika read poll does not have to wait anymore : its timeout is set to 0.
+        :return: the selector or None if the pika connection has no socket to wait for
+        """
+        amqp_socket = getattr(self.connection, 'socket', None)
+        read_poller = getattr(self.connection, '_read_poller', None)
+        if amqp_socket is None or read_poller is None:
+            return None
+        read_poller.poll_timeout = 0
+        selector = selectors.DefaultSelector()
+        selector.register(amqp_socket, selectors.EVENT_READ)
+        selector.register(self.wakeup, selectors.EVENT_READ)
+        return selector
+
+    def _wait_events(self):
+        """
+        wait until the broker socket is readable, a task is submitted or WAIT_EVENTS_TIMEOUT is reached
+        """
+        if self.selector is None:
+            return
+        for key, events in self.selector.select(Connection.WAIT_EVENTS_TIMEOUT):
+            if key.fileobj is self.wakeup:
+                try:
+                    while self.wakeup.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+
+    def _wake(self):
+        """
+        wake the pump thread up if it is waiting for events
+        """
+        try:
+            self.waker.send(b'\x00')
+        except (OSError, AttributeError):
+            # wakeup socket buffer full : the pump thread will wake up anyway. Not started or closed : nothing to wake
+            pass
+
+    def _run_tasks(self):
+        while self.tasks:
+            task = self.tasks.popleft()
+            try:
+                task()
+            except Exception as e:
+                LOGGER.warn("rabbitmq.Connection._run_tasks - Exception raised by task : " + traceback.format_exc())
+
+    def submit(self, task):
+        """
+        queue a task to be run on the pump thread and wake it up. Tasks are run in their submission order.
+        :param task: the callable to run
+        """
+        self.tasks.append(task)
+        self._wake()
+
+    def run_task(self, task, timeout=None):
+        """
+        run a task on the pump thread and wait its result
+        :param task: the callable to run
+        :param timeout: the max time to wait in sec. Default None : no timeout
+        :return: the task result
+        """
+        if threading.current_thread() is self.pump:
+            return task()
+        done = threading.Event()
+        result = {}
+
+        def run():
+            try:
+                result['value'] = task()
+            except Exception as e:
+                result['error'] = e
+            done.set()
+
+        # registered before the started check : a task submitted while the pump thread ends is not waited forever
+        self.close_listeners.append(done.set)
+        try:
+            if not self.is_started:
+                raise ArianeError('rabbitmq.Connection.run_task', 'Connection not started !')
+            self.submit(run)
+            if not done.wait(timeout):
+                raise ArianeMessagingTimeoutError('rabbitmq.Connection.run_task',
+                                                  'Task timeout (' + str(timeout) + ' sec) occured')
+        finally:
+            self.close_listeners.remove(done.set)
+        if 'error' in result:
+            raise result['error']
+        if 'value' not in result:
+            raise ArianeError('rabbitmq.Connection.run_task', 'Connection closed before task completion !')
+        return result['value']
+
+    def channel(self):
+        """
+        open a new channel on the connection
+        :return: the pika channel
+        """
+        LOGGER.debug("rabbitmq.Connection.channel")
+        channel = self.run_task(self.connection.channel)
+        with self.lock:
+            self.channels_count += 1
+        return channel
+
+    def close_channel(self, channel):
+        """
+        close a channel opened on the connection
+        :param channel: the pika channel
+        """
+        LOGGER.debug("rabbitmq.Connection.close_channel")
+        with self.lock:
+            self.channels_count -= 1
+        if self.is_started:
+            self.run_task(channel.close)
+
+
+class Requester(object):
+    """
+    RabbitMQ requester implementation. Thread safe : many threads can have requests in flight on the same requester,
+    replies being routed to the waiting caller thanks to their correlation ID.
+    The requester is a channel on a connection which can be shared with other requesters : requests are published
+    and replies consumed on the connection pump thread.
+    Replies are consumed from an exclusive reply queue declared by the requester, or with direct_reply_to from the
+    RabbitMQ amq.rabbitmq.reply-to pseudo queue : no reply queue is declared and replies are not stored in a queue.
+    Fire and forget requests are queued and published by batches on the connection pump thread. With
+    publisher_confirms the requester channel is in confirm mode and the broker confirmations are tracked by delivery
+    tag without waiting for them. Calls wait while max_outstanding requests are queued or not confirmed yet.
+    With compression_threshold the requests tell the service it may compress its reply with the MSG_ACCEPT_ENCODING
+    header. Once the service has advertised it can decompress requests with the MSG_ACCEPT_ENCODING header of its
+    replies, the requests bodies bigger than compression_threshold bytes are deflated and flagged with the AMQP
+    content_encoding property : services which don't advertise it (like the Ariane server) keep receiving plain
+    requests. Compressed responses are decompressed whatever the requester compression_threshold.
+    :param my_args: dict like {connection, request_q[, fire_and_forget, direct_reply_to, publisher_confirms,
+    max_outstanding, compression_threshold]}
+    """
+
+    DIRECT_REPLY_TO_Q = "amq.rabbitmq.reply-to"
+
     def __init__(self, my_args=None, connection_args=None):
         """
         RabbitMQ requester constructor
-        :param my_args: dict like {connection, request_q}
-        :param connection_args: dict like {user, password, host[, port, vhost, client_properties]}
+        :param my_args: dict like {request_q[, connection, fire_and_forget, direct_reply_to, publisher_confirms,
+        max_outstanding, compression_threshold]}. If no connection is provided the requester will open its own.
+        direct_reply_to and compression_threshold defaults are the connection_args ones (default False and 0 : no
+        compression). publisher_confirms (default False) and max_outstanding (default 1000) are used by fire and forget
+        requesters only.
+        :param connection_args: dict like {user, password, host[, port, vhost, client_properties, direct_reply_to,
+        compression_threshold]}
         :return: self
         """
         LOGGER.debug("rabbitmq.Requester.__init__")
@@ -58,6 +312,15 @@ class Requester(pykka.ThreadingActor):
             self.fire_and_forget = False
         else:
             self.fire_and_forget = True
+        if not self.fire_and_forget or 'publisher_confirms' not in my_args or my_args['publisher_confirms'] is None \
+                or not my_args['publisher_confirms']:
+            self.publisher_confirms = False
+        else:
+            self.publisher_confirms = True
+        if 'max_outstanding' not in my_args or my_args['max_outstanding'] is None or not my_args['max_outstanding']:
+            self.max_outstanding = 1000
+        else:
+            self.max_outstanding = int(my_args['max_outstanding'])
         if 'rpc_timeout' not in connection_args or connection_args['rpc_timeout'] is None or \
                 not connection_args['rpc_timeout']:
             # default timeout = no timeout
@@ -75,74 +338,319 @@ class Requester(pykka.ThreadingActor):
         self.trace = False
         Driver.validate_driver_conf(connection_args)
 
-        super(Requester, self).__init__()
+        if 'direct_reply_to' not in my_args or my_args['direct_reply_to'] is None:
+            self.direct_reply_to = connection_args['direct_reply_to']
+        else:
+            self.direct_reply_to = bool(my_args['direct_reply_to'])
+        if 'compression_threshold' not in my_args or my_args['compression_threshold'] is None:
+            self.compression = DriverCompression(connection_args['compression_threshold'])
+        else:
+            self.compression = DriverCompression(int(my_args['compression_threshold']))
+
         self.connection_args = copy.deepcopy(connection_args)
-        self.connection_args['client_properties']['information'] = \
-            self.connection_args['client_properties']['information'] + " - requestor on " + my_args['request_q']
-        self.credentials = pika.PlainCredentials(connection_args['user'], connection_args['password'])
-        self.parameters = pika.ConnectionParameters(connection_args['host'], connection_args['port'],
-                                                    connection_args['vhost'], credentials=self.credentials,
-                                                    client_props=self.connection_args['client_properties'])
-        self.connection = pika.BlockingConnection(self.parameters)
+        if 'connection' in my_args and my_args['connection'] is not None:
+            self.connection = my_args['connection']
+            self.own_connection = False
+        else:
+            self.connection = Connection(self.connection_args, "requestor on " + my_args['request_q'])
+            self.own_connection = True
+        self.channel = None
+        self.callback_queue = None
+        self.requestQ = my_args['request_q']
+        # correlation ID -> {event, response} of the requests waiting for their reply
+        self.pending_calls = {}
+        self.pending_calls_lock = threading.Lock()
+        # [(request_q, properties, body), ...] of the fire and forget requests to publish
+        self.outbound = collections.deque()
+        self.outbound_scheduled = False
+        # delivery tag -> publish time of the requests not confirmed yet by the broker
+        self.unconfirmed = collections.OrderedDict()
+        self.delivery_tag = 0
+        # guards outbound, unconfirmed and publish_stats. Notified when some room is made.
+        self.publish_condition = threading.Condition()
+        self.publish_stats = {
+            'published': 0,
+            'batches': 0,
+            'batch_size_max': 0,
+            'confirmed': 0,
+            'nacked': 0,
+            'first_publish_time': None,
+            'last_publish_time': None
+        }
+        self.is_started = False
 
+    def start(self):
+        """
+        open the requester channel
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.Requester.start")
+        if self.is_started:
+            return self
+        self.connection.start()
         self.channel = self.connection.channel()
-        self.requestQ = my_args['request_q']
+        self.connection.run_task(self._declare_queues)
+        self.connection.close_listeners.append(self._wake_pending_calls)
+        self.is_started = True
+        return self
+
+    def stop(self):
+        """
+        close the requester channel once the queued requests are published
+        :return: self
+        """
+        LOGGER.debug("rabbitmq.Requester.stop")
+        if not self.is_started:
+            return self
+        if self.publisher_confirms:
+            if not self.wait_for_confirms(self.rpc_timeout if self.rpc_timeout > 0 else 10):
+                LOGGER.warn("rabbitmq.Requester.stop - " + str(self.get_publish_stats()['outstanding']) +
+                            " requests not confirmed on stop")
+        self.is_started = False
+        if self._wake_pending_calls in self.connection.close_listeners:
+            self.connection.close_listeners.remove(self._wake_pending_calls)
+        try:
+            self.connection.close_channel(self.channel)
+        except Exception as e:
+            LOGGER.warn("rabbitmq.Requester.stop - Exception raised while closing channel")
+        self.channel = None
+        self._wake_pending_calls()
+        if self.own_connection:
+            self.connection.stop()
+        return self
+
+    def _declare_queues(self):
+        """
+        declare the request queue and consume the reply queue on the connection pump thread
+        """
         self.channel.queue_declare(queue=self.requestQ, auto_delete=True)
         if not self.fire_and_forget:
-            self.result = self.channel.queue_declare(exclusive=True, auto_delete=True)
-            self.callback_queue = self.result.method.queue
-            self.response = None
-            self.corr_id = None
+            if self.direct_reply_to:
+                # must be consumed in no ack mode on the channel requests are published on
+                self.callback_queue = Requester.DIRECT_REPLY_TO_Q
+            else:
+                result = self.channel.queue_declare(exclusive=True, auto_delete=True)
+                self.callback_queue = result.method.queue
+            self.channel.basic_consume(self.on_response, no_ack=True, queue=self.callback_queue)
+        elif self.publisher_confirms:
+            # the BlockingChannel confirm_delivery would wait the confirmation of each publish
+            pika.channel.Channel.confirm_delivery(self.channel, self._on_delivery_confirmation)
 
-    def on_start(self):
+    def _publish(self, request_q, properties, body):
         """
-        start requester
+        publish a request on the connection pump thread
         """
-        LOGGER.debug("rabbitmq.Requester.on_start")
-        if not self.fire_and_forget:
-            self.channel.basic_consume(self.on_response, no_ack=True,
-                                       queue=self.callback_queue)
+        self.channel.basic_publish(exchange='', routing_key=request_q, properties=properties, body=body)
+        LOGGER.debug("rabbitmq.Requester.call - published msg {" + str(body) + "," + str(properties) + "}")
 
-    def on_stop(self):
+    def _queue_outbound(self, request):
         """
-        stop requester
+        queue a fire and forget request and schedule the outbound publish on the pump thread if not already done.
+        Wait while max_outstanding requests are queued or not confirmed.
+        :param request: (request_q, properties, body)
         """
-        LOGGER.debug("rabbitmq.Requester.on_stop")
-        try:
-            self.channel.close()
-        except Exception as e:
-            LOGGER.warn("rabbitmq.Requester.on_stop - Exception raised while closing channel")
-        try:
-            self.connection.close()
-        except Exception as e:
-            LOGGER.warn("rabbitmq.Requester.on_stop - Exception raised while closing connection")
+        with self.publish_condition:
+            if threading.current_thread() is not self.connection.pump:
+                while self.outbound.__len__() + self.unconfirmed.__len__() >= self.max_outstanding:
+                    if not self.is_started or not self.connection.is_started:
+                        raise ArianeError('rabbitmq.Requester.call',
+                                          'Requester not started !')
+                    self.publish_condition.wait()
+            self.outbound.append(request)
+            if self.outbound_scheduled:
+                return
+            self.outbound_scheduled = True
+        self.connection.submit(self._publish_outbound)
 
-    def on_failure(self, exception_type, exception_value, traceback_):
-        LOGGER.error("rabbitmq.Requester.on_failure - " + exception_type.__str__() + "/" + exception_value.__str__())
-        LOGGER.error("rabbitmq.Requester.on_failure - " + traceback_.format_exc())
-        try:
-            self.channel.close()
-        except Exception as e:
-            LOGGER.warn("rabbitmq.Requester.on_failure - Exception raised while closing channel")
+    def _publish_outbound(self):
+        """
+        publish the queued fire and forget requests as one batch on the connection pump thread
+        """
+        with self.publish_condition:
+            batch = self.outbound
+            self.outbound = collections.deque()
+            self.outbound_scheduled = False
+        published = 0
         try:
-            self.connection.close()
+            for request_q, properties, body in batch:
+                if self.publisher_confirms:
+                    # registered before the publish : pika may read the broker confirm while publishing
+                    with self.publish_condition:
+                        self.delivery_tag += 1
+                        self.unconfirmed[self.delivery_tag] = timeit.default_timer()
+                self._publish(request_q, properties, body)
+                published += 1
         except Exception as e:
-            LOGGER.warn("rabbitmq.Requester.on_failure - Exception raised while closing connection")
+            if self.publisher_confirms:
+                with self.publish_condition:
+                    self.unconfirmed.pop(self.delivery_tag, None)
+            LOGGER.warn("rabbitmq.Requester._publish_outbound - " + str(batch.__len__() - published) +
+                        " requests lost on publish : " + traceback.format_exc())
+        now = timeit.default_timer()
+        with self.publish_condition:
+            self.publish_stats['published'] += published
+            self.publish_stats['batches'] += 1
+            if published > self.publish_stats['batch_size_max']:
+                self.publish_stats['batch_size_max'] = published
+            if self.publish_stats['first_publish_time'] is None:
+                self.publish_stats['first_publish_time'] = now
+            self.publish_stats['last_publish_time'] = now
+            self.publish_condition.notify_all()
+
+    def _on_delivery_confirmation(self, method_frame):
+        """
+        forget the requests acked or nacked by the broker, on the connection pump thread
+        """
+        delivery_tag = method_frame.method.delivery_tag
+        nacked = method_frame.method.NAME == 'Basic.Nack'
+        with self.publish_condition:
+            if method_frame.method.multiple:
+                confirmed = 0
+                while self.unconfirmed and next(iter(self.unconfirmed)) <= delivery_tag:
+                    self.unconfirmed.popitem(last=False)
+                    confirmed += 1
+            else:
+                confirmed = 1 if self.unconfirmed.pop(delivery_tag, None) is not None else 0
+            self.publish_stats['nacked' if nacked else 'confirmed'] += confirmed
+            self.publish_condition.notify_all()
+        if nacked:
+            LOGGER.warn("rabbitmq.Requester._on_delivery_confirmation - " + str(confirmed) +
+                        " requests nacked by the broker on " + self.requestQ)
+
+    def wait_for_confirms(self, timeout=None):
+        """
+        wait until the queued requests are published and confirmed by the broker
+        :param timeout: the max time to wait in sec. Default None : no timeout
+        :return: True if every request is confirmed
+        """
+        LOGGER.debug("rabbitmq.Requester.wait_for_confirms")
+        deadline = timeit.default_timer() + timeout if timeout is not None else None
+        with self.publish_condition:
+            while self.outbound or self.unconfirmed:
+                if not self.connection.is_started:
+                    return False
+                if deadline is None:
+                    self.publish_condition.wait()
+                else:
+                    remaining = deadline - timeit.default_timer()
+                    if remaining <= 0:
+                        return False
+                    self.publish_condition.wait(remaining)
+        return True
+
+    def get_publish_stats(self):
+        """
+        get the fire and forget publish statistics
+        :return: dict like {published, batches, batch_size_avg, batch_size_max, publish_rate (requests/sec),
+        confirmed, nacked, queued, unconfirmed, outstanding}
+        """
+        with self.publish_condition:
+            stats = dict(self.publish_stats)
+            stats['queued'] = self.outbound.__len__()
+            stats['unconfirmed'] = self.unconfirmed.__len__()
+        stats['outstanding'] = stats['queued'] + stats['unconfirmed']
+        stats['batch_size_avg'] = stats['published'] / stats['batches'] if stats['batches'] else 0
+        if stats['first_publish_time'] is not None and stats['last_publish_time'] > stats['first_publish_time']:
+            stats['publish_rate'] = stats['published'] / (stats['last_publish_time'] - stats['first_publish_time'])
+        else:
+            stats['publish_rate'] = 0
+        stats.pop('first_publish_time')
+        stats.pop('last_publish_time')
+        return stats
+
+    def _wake_pending_calls(self):
+        """
+        wake the calls still waiting a reply or some publish room when the requester or its connection stops : they
+        will fail fast
+        """
+        with self.pending_calls_lock:
+            for pending_call in self.pending_calls.values():
+                pending_call['event'].set()
+        with self.publish_condition:
+            self.publish_condition.notify_all()
 
     def on_response(self, ch, method_frame, props, body):
         """
-        setup response is correlation id is the good one
+        route the response to the call waiting for it thanks to its correlation id
         """
         LOGGER.debug("rabbitmq.Requester.on_response")
-        if self.corr_id == props.correlation_id:
-            self.response = {'props': props, 'body': body}
+        with self.pending_calls_lock:
+            pending_call = self.pending_calls.get(props.correlation_id)
+            if pending_call is not None and pending_call['response'] is None:
+                pending_call['response'] = {'props': props, 'body': body}
+                pending_call['event'].set()
+                return
+        LOGGER.warn("rabbitmq.Requester.on_response - discarded response : " +
+                    str(props.correlation_id))
+        LOGGER.debug("rabbitmq.Requester.on_response - discarded response : " + str({
+            'properties': props,
+            'body': body
+        }))
+
+    @staticmethod
+    def _decompress_response(compression, request_q, response):
+        """
+        record the encodings the service accepts and decompress a response body compressed by the service
+        :param compression: the requester DriverCompression
+        :param request_q: the requester queue the compression statistics are reported for
+        :param response: dict like {props, body}
+        :return: the response with its decompressed body
+        """
+        if response['props'].headers is not None:
+            compression.on_accept_encoding(request_q, response['props'].headers.get(DriverTools.MSG_ACCEPT_ENCODING))
+        if response['props'].content_encoding not in DriverCompression.DECOMPRESSED_ENCODINGS:
+            return response
+        return {'props': response['props'],
+                'body': compression.decompress(request_q, response['body'], response['props'].content_encoding)}
+
+    def get_compression_stats(self):
+        """
+        get the requests and responses bodies compression statistics
+        :return: dict like {queue: {compressed, compressed_bytes_in, compressed_bytes_out, compression_ratio,
+        compress_time, decompressed, decompressed_bytes_in, decompressed_bytes_out, decompression_ratio,
+        decompress_time}}
+        """
+        return self.compression.get_stats()
+
+    @staticmethod
+    def _make_response(response):
+        """
+        build the driver response from the RabbitMQ response
+        :param response: dict like {props, body}
+        :return: the driver response
+        """
+        rc_ = response['props'].headers['RC']
+        if rc_ != 0:
+            try:
+                content = json.loads(response['body'].decode("UTF-8"))
+            except ValueError:
+                content = response['body'].decode("UTF-8")
+            return DriverResponse(
+                rc=rc_,
+                error_message=response['props'].headers['SERVER_ERROR_MESSAGE']
+                if 'SERVER_ERROR_MESSAGE' in response['props'].headers else '',
+                response_content=content
+            )
         else:
-            LOGGER.warn("rabbitmq.Requester.on_response - discarded response : " +
-                        str(props.correlation_id))
-            LOGGER.debug("natsd.Requester.on_response - discarded response : " + str({
-                'properties': props,
-                'body': body
-            }))
+            try:
+                if 'MSG_PROPERTIES' in response['props'].headers:
+                    props = json.loads(response['props'].headers['MSG_PROPERTIES'])
+                else:
+                    props = None
+            except ValueError:
+                if 'MSG_PROPERTIES' in response['props'].headers:
+                    props = response['props'].headers['MSG_PROPERTIES']
+                else:
+                    props = None
+            try:
+                content = json.loads(response['body'].decode("UTF-8"))
+            except ValueError:
+                content = response['body'].decode("UTF-8")
+            return DriverResponse(
+                rc=rc_,
+                response_properties=props,
+                response_content=content
+            )
 
     def call(self, my_args=None):
         """
@@ -151,6 +659,9 @@ class Requester(pykka.ThreadingActor):
         :return response
         """
         LOGGER.debug("rabbitmq.Requester.call")
+        if not self.is_started:
+            raise ArianeError('rabbitmq.Requester.call',
+                              'Requester not started !')
         if my_args is None:
             raise exceptions.ArianeConfError("requestor call arguments")
         if 'properties' not in my_args or my_args['properties'] is None:
@@ -158,13 +669,10 @@ class Requester(pykka.ThreadingActor):
         if 'body' not in my_args or my_args['body'] is None:
             my_args['body'] = ''
         if 'MSG_CORRELATION_ID' not in my_args['properties']:
-            self.corr_id = str(uuid.uuid4())
-            my_args['properties']['MSG_CORRELATION_ID'] = self.corr_id
+            corr_id = str(uuid.uuid4())
+            my_args['properties']['MSG_CORRELATION_ID'] = corr_id
         else:
-            self.corr_id = my_args['properties']['MSG_CORRELATION_ID']
-
-        self.response = None
-        self.corr_id = str(uuid.uuid4())
+            corr_id = my_args['properties']['MSG_CORRELATION_ID']
 
         props = my_args['properties']
         if 'sessionID' in props and props['sessionID'] is not None and props['sessionID']:
@@ -175,115 +683,114 @@ class Requester(pykka.ThreadingActor):
         if self.trace:
             props['MSG_TRACE'] = True
 
+        body = str(my_args['body'])
+        content_encoding = None
+        if self.compression.threshold > 0 and body:
+            # the service may compress its reply too
+            props[DriverTools.MSG_ACCEPT_ENCODING] = DriverCompression.CONTENT_ENCODING_DEFLATE
+            compressed_body, content_encoding = self.compression.compress(self.requestQ, body.encode('UTF-8'))
+            if content_encoding is not None:
+                body = compressed_body
+
         if not self.fire_and_forget:
-            properties = pika.BasicProperties(content_type=None, content_encoding=None,
+            properties = pika.BasicProperties(content_type=None, content_encoding=content_encoding,
                                               headers=props, delivery_mode=None,
-                                              priority=None, correlation_id=self.corr_id,
+                                              priority=None, correlation_id=corr_id,
                                               reply_to=self.callback_queue, expiration=None,
                                               message_id=None, timestamp=None,
                                               type=None, user_id=None,
                                               app_id=None, cluster_id=None)
         else:
-            properties = pika.BasicProperties(content_type=None, content_encoding=None,
+            properties = pika.BasicProperties(content_type=None, content_encoding=content_encoding,
                                               headers=props, delivery_mode=None,
                                               priority=None, expiration=None,
                                               message_id=None, timestamp=None,
                                               type=None, user_id=None,
                                               app_id=None, cluster_id=None)
 
-        self.channel.basic_publish(exchange='',
-                                   routing_key=request_q,
-                                   properties=properties,
-                                   body=str(my_args['body']))
-
-        LOGGER.debug("rabbitmq.Requester.call - published msg {"+str(my_args['body'])+","+str(properties)+"}")
+        if self.fire_and_forget:
+            self._queue_outbound((request_q, properties, body))
+            return None
 
-        if not self.fire_and_forget:
+        pending_call = {'event': threading.Event(), 'response': None}
+        with self.pending_calls_lock:
+            self.pending_calls[corr_id] = pending_call
+        try:
+            if not self.is_started or not self.connection.is_started:
+                raise ArianeError('rabbitmq.Requester.call',
+                                  'Requester not started !')
             start_time = timeit.default_timer()
-            timeout = self.rpc_timeout if self.rpc_timeout > 0 else 0
-            while self.response is None and timeout >= 0:
-                timeout_id = None
-                if timeout > 0:
-                    timeout_id = self.connection.add_timeout(timeout, self.on_response)
-                self.connection.process_data_events()
-                if timeout_id is not None:
-                    self.connection.remove_timeout(timeout_id)
-                timeout = round(self.rpc_timeout - (timeit.default_timer() - start_time))
+            self.connection.submit(functools.partial(self._publish, request_q, properties, body))
+            pending_call['event'].wait(self.rpc_timeout if self.rpc_timeout > 0 else None)
             rpc_time = timeit.default_timer() - start_time
+        finally:
+            with self.pending_calls_lock:
+                self.pending_calls.pop(corr_id, None)
+        response = pending_call['response']
 
-            if self.response is None:
-                if self.rpc_retry > 0:
-                    if 'retry_count' not in my_args:
-                        my_args['retry_count'] = 1
-                        LOGGER.debug("rabbitmq.Requester.call - Retry (" + str(my_args['retry_count']) + ")")
-                        return self.call(my_args)
-                    elif 'retry_count' in my_args and (self.rpc_retry - my_args['retry_count']) > 0:
-                        LOGGER.warn("rabbitmq.Requester.call - No response returned from request on " + request_q +
-                                    " queue after " + str(self.rpc_timeout) + '*' +
-                                    str(self.rpc_retry) + " sec ...")
-                        self.trace = True
-                        my_args['retry_count'] += 1
-                        LOGGER.warn("rabbitmq.Requester.call - Retry (" + str(my_args['retry_count']) + ")")
-                        return self.call(my_args)
-                    else:
-                        raise ArianeMessagingTimeoutError('rabbitmq.Requester.call',
-                                                          'Request timeout (' + str(self.rpc_timeout) + '*' +
-                                                          str(self.rpc_retry) + ' sec) occured')
+        if response is None:
+            if not self.is_started or not self.connection.is_started:
+                raise ArianeError('rabbitmq.Requester.call',
+                                  'Requester stopped while waiting the response !')
+            if self.rpc_retry > 0:
+                if 'retry_count' not in my_args:
+                    my_args['retry_count'] = 1
+                    LOGGER.debug("rabbitmq.Requester.call - Retry (" + str(my_args['retry_count']) + ")")
+                    return self.call(my_args)
+                elif 'retry_count' in my_args and (self.rpc_retry - my_args['retry_count']) > 0:
+                    LOGGER.warn("rabbitmq.Requester.call - No response returned from request on " + request_q +
+                                " queue after " + str(self.rpc_timeout) + '*' +
+                                str(self.rpc_retry) + " sec ...")
+                    self.trace = True
+                    my_args['retry_count'] += 1
+                    LOGGER.warn("rabbitmq.Requester.call - Retry (" + str(my_args['retry_count']) + ")")
+                    return self.call(my_args)
                 else:
                     raise ArianeMessagingTimeoutError('rabbitmq.Requester.call',
                                                       'Request timeout (' + str(self.rpc_timeout) + '*' +
                                                       str(self.rpc_retry) + ' sec) occured')
             else:
-                if self.rpc_timeout > 0 and rpc_time > self.rpc_timeout*3/5:
-                    LOGGER.debug('rabbitmq.Requester.call - slow RPC time (' + str(rpc_time) + ') on request ' +
-                                 str(properties))
-                self.trace = False
-
-                rc_ = self.response['props'].headers['RC']
-                if rc_ != 0:
-                    try:
-                        content = json.loads(self.response['body'].decode("UTF-8"))
-                    except ValueError:
-                        content = self.response['body'].decode("UTF-8")
-                    return DriverResponse(
-                        rc=rc_,
-                        error_message=self.response['props'].headers['SERVER_ERROR_MESSAGE']
-                        if 'SERVER_ERROR_MESSAGE' in self.response['props'].headers else '',
-                        response_content=content
-                    )
-                else:
-                    try:
-                        if 'MSG_PROPERTIES' in self.response['props'].headers:
-                            props = json.loads(self.response['props'].headers['MSG_PROPERTIES'])
-                        else:
-                            props = None
-                    except ValueError:
-                        if 'MSG_PROPERTIES' in self.response['props'].headers:
-                            props = self.response['props'].headers['MSG_PROPERTIES']
-                        else:
-                            props = None
-                    try:
-                        content = json.loads(self.response['body'].decode("UTF-8"))
-                    except ValueError:
-                        content = self.response['body'].decode("UTF-8")
-                    return DriverResponse(
-                        rc=rc_,
-                        response_properties=props,
-                        response_content=content
-                    )
+                raise ArianeMessagingTimeoutError('rabbitmq.Requester.call',
+                                                  'Request timeout (' + str(self.rpc_timeout) + '*' +
+                                                  str(self.rpc_retry) + ' sec) occured')
+        else:
+            if self.rpc_timeout > 0 and rpc_time > self.rpc_timeout*3/5:
+                LOGGER.debug('rabbitmq.Requester.call - slow RPC time (' + str(rpc_time) + ') on request ' +
+                             str(properties))
+            self.trace = False
+            response = Requester._decompress_response(self.compression, self.requestQ, response)
+            return Requester._make_response(response)
 
 
 class Service(pykka.ThreadingActor):
     """
-    RabbitMQ service implementation.
-    :param my_args: dict like {connection, service_q, treatment_callback[, service_name]}
+    RabbitMQ service implementation. The service is a channel on a connection which can be shared with other
+    services : requests are consumed on the connection pump thread and then treated by the treatment callback
+    according to the dispatch mode :
+    - inline (default) : on the connection pump thread,
+    - pool : on a pool of dispatch_pool_size threads sharing a dispatch_queue_size bounded queue,
+    - serial : on a pool of dispatch_pool_size threads, each with its own dispatch_queue_size bounded queue. Requests
+      with the same dispatch_key property value are always treated by the same thread, in their arrival order.
+    The broker delivers up to prefetch_count requests not acked yet (default 0 : no limit when inline, else
+    dispatch_queue_size). Requests are acked on the connection pump thread once treated, one by one or with
+    ack_multiple by batches of contiguous treated requests.
+    The connection pump thread, shared by all the connection channels, never waits for the dispatch queue : when it is
+    full (prefetch_count greater than dispatch_queue_size) the request is nacked to be requeued by the broker.
+    :param my_args: dict like {connection, service_q, treatment_callback[, service_name, dispatch_mode,
+    dispatch_pool_size, dispatch_queue_size, dispatch_key, prefetch_count, ack_multiple]}
     :param connection_args: dict like {user, password, host[, port, vhost, client_properties]}
     """
 
+    DISPATCH_INLINE = "inline"
+    DISPATCH_POOL = "pool"
+    DISPATCH_SERIAL = "serial"
+
     def __init__(self, my_args=None, connection_args=None):
         """
         RabbitMQ service constructor
-        :param my_args: dict like {connection, service_q, treatment_callback[, service_name]}
+        :param my_args: dict like {service_q, treatment_callback[, connection, service_name, dispatch_mode,
+        dispatch_pool_size, dispatch_queue_size, dispatch_key, prefetch_count, ack_multiple]}. If no connection is
+        provided the service will open its own.
         :param connection_args: dict like {user, password, host[, port, vhost, client_properties]}
         :return: self
         """
@@ -298,35 +805,275 @@ class Service(pykka.ThreadingActor):
             LOGGER.warn("rabbitmq.Service.__init__ - service_name is not defined ! Use default : " +
                         self.__class__.__name__)
             my_args['service_name'] = self.__class__.__name__
+        if 'dispatch_mode' not in my_args or my_args['dispatch_mode'] is None or not my_args['dispatch_mode']:
+            my_args['dispatch_mode'] = Service.DISPATCH_INLINE
+        elif my_args['dispatch_mode'] not in [Service.DISPATCH_INLINE, Service.DISPATCH_POOL,
+                                              Service.DISPATCH_SERIAL]:
+            raise exceptions.ArianeConfError("dispatch_mode")
+        if 'dispatch_pool_size' not in my_args or my_args['dispatch_pool_size'] is None or \
+                not my_args['dispatch_pool_size']:
+            my_args['dispatch_pool_size'] = 4
+        if 'dispatch_queue_size' not in my_args or my_args['dispatch_queue_size'] is None or \
+                not my_args['dispatch_queue_size']:
+            my_args['dispatch_queue_size'] = 1000
+        if my_args['dispatch_mode'] == Service.DISPATCH_SERIAL and \
+                ('dispatch_key' not in my_args or my_args['dispatch_key'] is None or not my_args['dispatch_key']):
+            raise exceptions.ArianeConfError("dispatch_key")
+        if 'prefetch_count' not in my_args or my_args['prefetch_count'] is None or not my_args['prefetch_count']:
+            # with workers the broker does not deliver more requests than the dispatch queue can hold
+            my_args['prefetch_count'] = 0 if my_args['dispatch_mode'] == Service.DISPATCH_INLINE else \
+                int(my_args['dispatch_queue_size'])
+        if 'ack_multiple' not in my_args or my_args['ack_multiple'] is None or not my_args['ack_multiple']:
+            my_args['ack_multiple'] = False
 
         Driver.validate_driver_conf(connection_args)
 
         super(Service, self).__init__()
         self.connection_args = copy.deepcopy(connection_args)
-        self.connection_args['client_properties']['information'] = \
-            self.connection_args['client_properties']['information'] + " - " + my_args['service_name']
-
-        self.credentials = pika.PlainCredentials(connection_args['user'], connection_args['password'])
-        self.parameters = pika.ConnectionParameters(connection_args['host'], connection_args['port'],
-                                                    connection_args['vhost'], credentials=self.credentials,
-                                                    client_props=self.connection_args['client_properties'])
-        self.connection = None
+        if 'connection' in my_args and my_args['connection'] is not None:
+            self.connection = my_args['connection']
+            self.own_connection = False
+        else:
+            self.connection = Connection(self.connection_args, my_args['service_name'])
+            self.own_connection = True
         self.channel = None
-        self.service = None
+        self.consumer_tag = None
         self.serviceQ = my_args['service_q']
         self.service_name = my_args['service_name']
         self.cb = my_args['treatment_callback']
         self.is_started = False
 
-    def run(self):
+        self.dispatch_mode = my_args['dispatch_mode']
+        self.dispatch_pool_size = int(my_args['dispatch_pool_size'])
+        self.dispatch_queue_size = int(my_args['dispatch_queue_size'])
+        self.dispatch_key = my_args['dispatch_key'] if 'dispatch_key' in my_args else None
+        self.dispatch_queues = []
+        self.dispatch_threads = []
+        self.dispatch_stats = {
+            'treated': 0,
+            'failed': 0,
+            'acks': 0,
+            'rejected': 0,
+            'queue_depth_max': 0,
+            'queue_time_total': 0,
+            'queue_time_max': 0,
+            'treatment_time_total': 0,
+            'treatment_time_max': 0
+        }
+        self.dispatch_stats_lock = threading.Lock()
+        self.prefetch_count = int(my_args['prefetch_count'])
+        self.ack_multiple = bool(my_args['ack_multiple'])
+        # delivery tags of the requests not acked yet, in delivery order, and the treated ones among them
+        self.delivered_tags = collections.deque()
+        self.treated_tags = set()
+        self.ack_scheduled = False
+        self.ack_lock = threading.Lock()
+        # requests bodies are decompressed before their treatment
+        self.compression = DriverCompression()
+
+    def _consume(self):
         """
-        consume message from channel on the consuming thread.
+        declare and consume the service queue on the connection pump thread
         """
-        LOGGER.debug("rabbitmq.Service.run")
+        self.channel.queue_declare(queue=self.serviceQ, auto_delete=True)
+        if self.prefetch_count > 0:
+            self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        self.consumer_tag = self.channel.basic_consume(self.on_request, self.serviceQ)
+
+    def _cancel_consume(self):
+        """
+        stop consuming the service queue on the connection pump thread
+        """
+        if self.consumer_tag is not None:
+            self.channel.basic_cancel(self.consumer_tag)
+            self.consumer_tag = None
+
+    def _treat(self, properties, body, delivery_tag, received_time):
+        start_time = timeit.default_timer()
+        failed = False
         try:
-            self.channel.start_consuming()
+            self.cb(properties, body)
         except Exception as e:
-            LOGGER.warn("rabbitmq.Service.run - Exception raised while consuming")
+            failed = True
+            LOGGER.warn("rabbitmq.Service._treat - Exception raised while treating msg {" + str(properties) + "," +
+                        str(body) + "} : " + traceback.format_exc())
+        end_time = timeit.default_timer()
+        with self.dispatch_stats_lock:
+            self.dispatch_stats['treated'] += 1
+            if failed:
+                self.dispatch_stats['failed'] += 1
+            queue_time = start_time - received_time
+            self.dispatch_stats['queue_time_total'] += queue_time
+            if queue_time > self.dispatch_stats['queue_time_max']:
+                self.dispatch_stats['queue_time_max'] = queue_time
+            treatment_time = end_time - start_time
+            self.dispatch_stats['treatment_time_total'] += treatment_time
+            if treatment_time > self.dispatch_stats['treatment_time_max']:
+                self.dispatch_stats['treatment_time_max'] = treatment_time
+        self._ack(delivery_tag)
+
+    def _ack(self, delivery_tag):
+        """
+        ack a treated request on the connection pump thread
+        :param delivery_tag: the treated request delivery tag
+        """
+        if not self.ack_multiple:
+            self.connection.submit(functools.partial(self._basic_ack, delivery_tag, False))
+            return
+        with self.ack_lock:
+            self.treated_tags.add(delivery_tag)
+            if self.ack_scheduled:
+                return
+            self.ack_scheduled = True
+        self.connection.submit(self._ack_treated)
+
+    def _ack_treated(self):
+        """
+        ack at once the treated requests delivered before the first one still being treated, on the connection pump
+        thread
+        """
+        last_tag = None
+        with self.ack_lock:
+            self.ack_scheduled = False
+            while self.delivered_tags and self.delivered_tags[0] in self.treated_tags:
+                last_tag = self.delivered_tags.popleft()
+                self.treated_tags.remove(last_tag)
+        if last_tag is not None:
+            self._basic_ack(last_tag, True)
+
+    def _basic_ack(self, delivery_tag, multiple):
+        self.channel.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+        with self.dispatch_stats_lock:
+            self.dispatch_stats['acks'] += 1
+
+    def _run_dispatch_worker(self, dispatch_queue):
+        LOGGER.debug("rabbitmq.Service._run_dispatch_worker - start")
+        while True:
+            request = dispatch_queue.get()
+            if request is None:
+                break
+            self._treat(*request)
+        LOGGER.debug("rabbitmq.Service._run_dispatch_worker - stop")
+
+    def _start_dispatch_workers(self):
+        if self.dispatch_mode == Service.DISPATCH_INLINE:
+            return
+        if self.dispatch_mode == Service.DISPATCH_POOL:
+            self.dispatch_queues = [queue.Queue(self.dispatch_queue_size)]
+        else:
+            self.dispatch_queues = [queue.Queue(self.dispatch_queue_size) for i in range(0, self.dispatch_pool_size)]
+        for i in range(0, self.dispatch_pool_size):
+            dispatch_queue = self.dispatch_queues[i % self.dispatch_queues.__len__()]
+            dispatch_thread = threading.Thread(target=self._run_dispatch_worker, args=(dispatch_queue,),
+                                               name=self.service_name + " dispatch thread " + str(i))
+            dispatch_thread.start()
+            self.dispatch_threads.append(dispatch_thread)
+
+    def _stop_dispatch_workers(self):
+        for i in range(0, self.dispatch_threads.__len__()):
+            self.dispatch_queues[i % self.dispatch_queues.__len__()].put(None)
+        for dispatch_thread in self.dispatch_threads:
+            dispatch_thread.join()
+        self.dispatch_threads = []
+        self.dispatch_queues = []
+
+    def _dispatch(self, properties, body, delivery_tag):
+        """
+        treat the request inline or queue it for the dispatch workers without waiting for room in the dispatch queue
+        :return: False if the request has been rejected as the dispatch queue is full
+        """
+        received_time = timeit.default_timer()
+        if self.ack_multiple:
+            with self.ack_lock:
+                self.delivered_tags.append(delivery_tag)
+        if self.dispatch_mode == Service.DISPATCH_INLINE:
+            self._treat(properties, body, delivery_tag, received_time)
+            return True
+        if self.dispatch_mode == Service.DISPATCH_POOL:
+            dispatch_queue = self.dispatch_queues[0]
+        else:
+            key = properties[self.dispatch_key] if self.dispatch_key in properties else None
+            dispatch_queue = self.dispatch_queues[hash(str(key)) % self.dispatch_queues.__len__()]
+        try:
+            dispatch_queue.put_nowait((properties, body, delivery_tag, received_time))
+        except queue.Full:
+            if self.ack_multiple:
+                with self.ack_lock:
+                    # the last delivered tag : requests are dispatched on the connection pump thread only
+                    self.delivered_tags.pop()
+            with self.dispatch_stats_lock:
+                self.dispatch_stats['rejected'] += 1
+            return False
+        queue_depth = self.get_dispatch_queue_depth()
+        with self.dispatch_stats_lock:
+            if queue_depth > self.dispatch_stats['queue_depth_max']:
+                self.dispatch_stats['queue_depth_max'] = queue_depth
+        return True
+
+    def _reject(self, delivery_tag):
+        """
+        nack a request to be requeued by the broker as the dispatch queue is full, on the connection pump thread
+        :param delivery_tag: the rejected request delivery tag
+        """
+        LOGGER.warn("rabbitmq.Service._reject - " + self.serviceQ + " dispatch queue is full : request " +
+                    str(delivery_tag) + " requeued")
+        self.channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+
+    def get_dispatch_queue_depth(self):
+        """
+        :return: the count of requests waiting to be treated
+        """
+        queue_depth = 0
+        for dispatch_queue in self.dispatch_queues:
+            queue_depth += dispatch_queue.qsize()
+        return queue_depth
+
+    def get_dispatch_stats(self):
+        """
+        get the requests dispatch statistics (times in sec)
+        :return: dict like {dispatch_mode, prefetch_count, queue_depth, queue_depth_max, treated, failed, acks,
+        rejected, queue_time_total, queue_time_max, queue_time_avg, treatment_time_total, treatment_time_max,
+        treatment_time_avg}
+        """
+        with self.dispatch_stats_lock:
+            stats = dict(self.dispatch_stats)
+        stats['dispatch_mode'] = self.dispatch_mode
+        stats['prefetch_count'] = self.prefetch_count
+        stats['queue_depth'] = self.get_dispatch_queue_depth()
+        stats['queue_time_avg'] = stats['queue_time_total'] / stats['treated'] if stats['treated'] else 0
+        stats['treatment_time_avg'] = stats['treatment_time_total'] / stats['treated'] if stats['treated'] else 0
+        return stats
+
+    def get_compression_stats(self):
+        """
+        get the requests bodies decompression statistics
+        :return: dict like {queue: {decompressed, decompressed_bytes_in, decompressed_bytes_out, decompression_ratio,
+        decompress_time, ...}}
+        """
+        return self.compression.get_stats()
+
+    @staticmethod
+    def _make_properties(props):
+        """
+        build the treatment callback properties from the RabbitMQ request properties
+        :param props: the pika request properties
+        :return: the request headers and properties dict
+        """
+        properties = props.headers.copy()
+        properties['app_id'] = props.app_id
+        properties['cluster_id'] = props.cluster_id
+        properties['content_encoding'] = props.content_encoding
+        properties['content_type'] = props.content_type
+        properties['correlation_id'] = props.correlation_id
+        properties['delivery_mode'] = props.delivery_mode
+        properties['expiration'] = props.expiration
+        properties['message_id'] = props.message_id
+        properties['priority'] = props.priority
+        properties['reply_to'] = props.reply_to
+        properties['timestamp'] = props.timestamp
+        properties['type'] = props.type
+        properties['user_id'] = props.user_id
+        return properties
 
     def on_request(self, ch, method_frame, props, body):
         """
@@ -334,86 +1081,76 @@ class Service(pykka.ThreadingActor):
         """
         LOGGER.debug("rabbitmq.Service.on_request - request " + str(props) + " received")
         try:
-            properties = props.headers.copy()
-            properties['app_id'] = props.app_id
-            properties['cluster_id'] = props.cluster_id
-            properties['content_encoding'] = props.content_encoding
-            properties['content_type'] = props.content_type
-            properties['correlation_id'] = props.correlation_id
-            properties['delivery_mode'] = props.delivery_mode
-            properties['expiration'] = props.expiration
-            properties['message_id'] = props.message_id
-            properties['priority'] = props.priority
-            properties['reply_to'] = props.reply_to
-            properties['timestamp'] = props.timestamp
-            properties['type'] = props.type
-            properties['user_id'] = props.user_id
-            self.cb(properties, body)
+            properties = Service._make_properties(props)
         except Exception as e:
-            LOGGER.warn("rabbitmq.Service.on_request - Exception raised while treating msg {" +
-                        str(props) + "," + str(body) + "}")
-        LOGGER.debug("rabbitmq.Service.on_request - request " + str(props) + " treated")
-        ch.basic_ack(delivery_tag=method_frame.delivery_tag)
-        LOGGER.debug("rabbitmq.Service.on_request - request " + str(props) + " acked")
+            LOGGER.warn("rabbitmq.Service.on_request - Exception raised while reading msg {" +
+                        str(props) + "," + str(body) + "} properties")
+            ch.basic_ack(delivery_tag=method_frame.delivery_tag)
+            return
+        if properties['content_encoding'] in DriverCompression.DECOMPRESSED_ENCODINGS:
+            try:
+                body = self.compression.decompress(self.serviceQ, body, properties['content_encoding'])
+                properties['content_encoding'] = None
+            except Exception as e:
+                LOGGER.warn("rabbitmq.Service.on_request - Exception raised while decompressing msg {" +
+                            str(props) + "} body")
+                ch.basic_ack(delivery_tag=method_frame.delivery_tag)
+                return
+        if not self._dispatch(properties, body, method_frame.delivery_tag):
+            self._reject(method_frame.delivery_tag)
+            return
+        LOGGER.debug("rabbitmq.Service.on_request - request " + str(props) + " dispatched")
 
     def on_start(self):
         """
         start the service
         """
         LOGGER.debug("rabbitmq.Service.on_start")
-        self.connection = pika.BlockingConnection(self.parameters)
+        self._start_dispatch_workers()
+        self.connection.start()
         self.channel = self.connection.channel()
-        self.channel.queue_declare(queue=self.serviceQ, auto_delete=True)
-        self.channel.basic_consume(self.on_request, self.serviceQ)
-        self.service = threading.Thread(target=self.run, name=self.service_name)
-        self.service.start()
+        self.connection.run_task(self._consume)
         self.is_started = True
 
+    def _clean(self):
+        self.is_started = False
+        if self.channel is not None:
+            try:
+                self.connection.run_task(self._cancel_consume)
+            except Exception as e:
+                LOGGER.warn("rabbitmq.Service._clean - Exception raised while canceling consume")
+        # requests already dispatched are treated and acked before the channel is closed
+        self._stop_dispatch_workers()
+        if self.channel is not None:
+            try:
+                self.connection.close_channel(self.channel)
+            except Exception as e:
+                LOGGER.warn("rabbitmq.Service._clean - Exception raised while closing channel")
+            self.channel = None
+        if self.own_connection:
+            self.connection.stop()
+
     def on_stop(self):
         """
         stop the service
         """
         LOGGER.debug("rabbitmq.Service.on_stop")
-        self.is_started = False
-        try:
-            self.channel.stop_consuming()
-        except Exception as e:
-            LOGGER.warn("rabbitmq.Service.on_stop - Exception raised while stoping consuming")
-
-        try:
-            self.channel.close()
-        except Exception as e:
-            LOGGER.warn("rabbitmq.Service.on_stop - Exception raised while closing channel")
-
-        try:
-            self.connection.close()
-        except Exception as e:
-            LOGGER.warn("rabbitmq.Service.on_stop - Exception raised while closing connection")
+        self._clean()
 
     def on_failure(self, exception_type, exception_value, traceback_):
-        LOGGER.error("rabbitmq.Requester.on_failure - " + exception_type.__str__() + "/" + exception_value.__str__())
-        LOGGER.error("rabbitmq.Requester.on_failure - " + traceback_.format_exc())
-        self.is_started = False
-        try:
-            self.channel.stop_consuming()
-        except Exception as e:
-            LOGGER.warn("rabbitmq.Service.on_failure - Exception raised while stoping consuming")
-
-        try:
-            self.channel.close()
-        except Exception as e:
-            LOGGER.warn("rabbitmq.Service.on_failure - Exception raised while closing channel")
-
-        try:
-            self.connection.close()
-        except Exception as e:
-            LOGGER.warn("rabbitmq.Service.on_failure - Exception raised while closing connection")
+        LOGGER.error("rabbitmq.Service.on_failure - " + exception_type.__str__() + "/" + exception_value.__str__())
+        LOGGER.error("rabbitmq.Service.on_failure - " + traceback_.format_exc())
+        self._clean()
 
 
 class Driver(object):
     """
-    RabbitMQ driver class.
-    :param my_args: dict like {user, password, host[, port, vhost, client_properties]}. Default = None
+    RabbitMQ driver class. The driver owns the RabbitMQ connections : requesters are channels spread over a pool of
+    connection_pool_size connections (default 1) and services are channels on one dedicated connection, so that a
+    treatment callback running on the service connection pump thread can call requesters without blocking their
+    replies.
+    :param my_args: dict like {user, password, host[, port, vhost, client_properties, connection_pool_size,
+    direct_reply_to, compression_threshold]}. Default = None
     """
 
     @staticmethod
@@ -452,11 +1189,27 @@ class Driver(object):
             my_args['client_properties'] = default_client_properties
             LOGGER.info("rabbitmq.Driver.validate_driver_conf - client properties are not defined. Use default " +
                         str(default_client_properties))
+        if 'connection_pool_size' not in my_args or my_args['connection_pool_size'] is None or \
+                not my_args['connection_pool_size']:
+            my_args['connection_pool_size'] = 1
+        else:
+            my_args['connection_pool_size'] = int(my_args['connection_pool_size'])
+        if 'direct_reply_to' not in my_args or my_args['direct_reply_to'] is None:
+            my_args['direct_reply_to'] = False
+        else:
+            my_args['direct_reply_to'] = bool(my_args['direct_reply_to'])
+        if 'compression_threshold' not in my_args or my_args['compression_threshold'] is None or \
+                not my_args['compression_threshold']:
+            # no compression
+            my_args['compression_threshold'] = 0
+        else:
+            my_args['compression_threshold'] = int(my_args['compression_threshold'])
 
     def __init__(self, my_args=None):
         """
         RabbitMQ driver constructor
-        :param my_args: dict like {user, password, host[, port, vhost, client_properties]}. Default = None
+        :param my_args: dict like {user, password, host[, port, vhost, client_properties, connection_pool_size,
+        direct_reply_to, compression_threshold]}. Default = None
         :return: self
         """
         LOGGER.debug("rabbitmq.Driver.__init__")
@@ -471,6 +1224,27 @@ class Driver(object):
         self.connection_args = my_args
         self.services_registry = []
         self.requester_registry = []
+        self.connection_pool = []
+        self.connection_pool_index = 0
+        self.service_connection = None
+        self.connection_lock = threading.Lock()
+
+    def _get_requester_connection(self):
+        with self.connection_lock:
+            if self.connection_pool.__len__() < self.connection_args['connection_pool_size']:
+                connection = Connection(self.connection_args,
+                                        "requestors connection " + str(self.connection_pool.__len__()))
+                self.connection_pool.append(connection)
+            else:
+                connection = self.connection_pool[self.connection_pool_index]
+                self.connection_pool_index = (self.connection_pool_index + 1) % self.connection_pool.__len__()
+        return connection
+
+    def _get_service_connection(self):
+        with self.connection_lock:
+            if self.service_connection is None:
+                self.service_connection = Connection(self.connection_args, "services connection")
+        return self.service_connection
 
     def start(self):
         """
@@ -496,12 +1270,22 @@ class Driver(object):
 
         pykka.ActorRegistry.stop_all()
 
+        with self.connection_lock:
+            for connection in self.connection_pool:
+                connection.stop()
+            self.connection_pool.clear()
+            self.connection_pool_index = 0
+            if self.service_connection is not None:
+                self.service_connection.stop()
+                self.service_connection = None
+
         return self
 
     def make_service(self, my_args=None):
         """
         make a new service instance and handle it from driver
-        :param my_args: dict like {service_q, treatment_callback [, service_name] }. Default : None
+        :param my_args: dict like {service_q, treatment_callback [, service_name, dispatch_mode, dispatch_pool_size,
+        dispatch_queue_size, dispatch_key, prefetch_count, ack_multiple] }. Default : None
         :return: created service proxy
         """
         LOGGER.debug("rabbitmq.Driver.make_service")
@@ -509,6 +1293,7 @@ class Driver(object):
             raise exceptions.ArianeConfError('service factory arguments')
         if not self.configuration_OK or self.connection_args is None:
             raise exceptions.ArianeConfError('rabbitmq connection arguments')
+        my_args['connection'] = self._get_service_connection()
         service = Service.start(my_args, self.connection_args).proxy()
         self.services_registry.append(service)
         return service
@@ -516,15 +1301,16 @@ class Driver(object):
     def make_requester(self, my_args=None):
         """
         make a new requester instance and handle it from driver
-        :param my_args: dict like {request_q}. Default : None
-        :return: created requester proxy
+        :param my_args: dict like {request_q[, fire_and_forget, direct_reply_to]}. Default : None
+        :return: created requester
         """
         LOGGER.debug("rabbitmq.Driver.make_requester")
         if my_args is None:
             raise exceptions.ArianeConfError('requester factory arguments')
         if not self.configuration_OK or self.connection_args is None:
             raise exceptions.ArianeConfError('rabbitmq connection arguments')
-        requester = Requester.start(my_args, self.connection_args).proxy()
+        my_args['connection'] = self._get_requester_connection()
+        requester = Requester(my_args, self.connection_args).start()
         self.requester_registry.append(requester)
         return requester
 
@@ -0,0 +1,416 @@
+# Ariane CLI Python 3
+# REST asyncio driver
+#
+# Copyright (C) 2016 echinopsii
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import threading
+import traceback
+import logging
+import aiohttp
+
+from ariane_clip3 import exceptions
+from ariane_clip3.exceptions import ArianeError
+from ariane_clip3.rest import driver
+
+__author__ = 'mffrench'
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Connection(object):
+    """
+    asynchronous REST connection : one aiohttp client session driven by an asyncio event loop, its own event loop
+    thread or the caller one if provided. The session keeps up to pool_maxsize connections alive (closed after each
+    call if keep_alive is False) and up to max_concurrency calls run at once, the other ones waiting their turn.
+    :param connection_args: dict like {base_url, user, password, pool_maxsize, keep_alive, max_concurrency}
+    :param loop: the caller asyncio event loop. Default None : the connection runs its own event loop thread
+    """
+
+    def __init__(self, connection_args=None, loop=None):
+        """
+        asynchronous REST connection constructor
+        :param connection_args: dict like {base_url, user, password, pool_maxsize, keep_alive, max_concurrency}
+        :param loop: the caller asyncio event loop. Default None : the connection runs its own event loop thread
+        :return: self
+        """
+        LOGGER.debug("rest.aio.Connection.__init__")
+        self.base_url = connection_args['base_url']
+        self.user = connection_args['user']
+        self.password = connection_args['password']
+        self.pool_maxsize = connection_args['pool_maxsize']
+        self.keep_alive = connection_args['keep_alive']
+        self.max_concurrency = connection_args['max_concurrency']
+        self.loop = loop
+        # with a caller event loop the connection must be started and stopped with start_async and stop_async
+        self.external_loop = loop is not None
+        self.thread = None
+        # the thread running the event loop, known once started
+        self.loop_thread = None
+        self.session = None
+        self.semaphore = None
+        self.is_started = False
+        self.lock = threading.Lock()
+
+    def run_event_loop(self):
+        LOGGER.debug("rest.aio.Connection.run_event_loop")
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run_coroutine(self, coroutine, timeout=None):
+        """
+        run a coroutine on the connection event loop and wait its result (to be called from outside the loop)
+        :param coroutine: the coroutine to run
+        :param timeout: max time to wait the result (sec). Default None : no timeout
+        :return: the coroutine result
+        """
+        if self.loop_thread is threading.current_thread():
+            coroutine.close()
+            raise ArianeError('rest.aio.Connection.run_coroutine',
+                              'Blocking call from the connection event loop : use the async method !')
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    async def start_async(self):
+        """
+        open the client session from the connection event loop
+        :return: self
+        """
+        LOGGER.debug("rest.aio.Connection.start_async")
+        if self.is_started:
+            return self
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        self.loop_thread = threading.current_thread()
+        connector = aiohttp.TCPConnector(limit=self.pool_maxsize, force_close=not self.keep_alive)
+        self.session = aiohttp.ClientSession(connector=connector, headers={
+            'Authorization': aiohttp.BasicAuth(self.user, self.password).encode()
+        })
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.is_started = True
+        return self
+
+    async def stop_async(self):
+        """
+        close the client session and its connections from the connection event loop
+        :return: self
+        """
+        LOGGER.debug("rest.aio.Connection.stop_async")
+        if not self.is_started:
+            return self
+        self.is_started = False
+        try:
+            await self.session.close()
+        except Exception as e:
+            LOGGER.warn("rest.aio.Connection.stop_async - exception on close : " + traceback.format_exc())
+        self.session = None
+        return self
+
+    def start(self):
+        """
+        start the event loop thread (if the connection has no caller event loop) and open the client session.
+        Not to be called from the connection event loop : use start_async there.
+        :return: self
+        """
+        LOGGER.debug("rest.aio.Connection.start")
+        with self.lock:
+            if self.is_started:
+                return self
+            if not self.external_loop:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.run_event_loop, name="rest aio connection thread")
+                self.thread.start()
+            self.run_coroutine(self.start_async())
+        return self
+
+    def _stop_event_loop(self):
+        try:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=120)
+            if self.thread.is_alive():
+                LOGGER.error("rest.aio.Connection.stop - unable to stop aio loop after 120 sec")
+            else:
+                self.loop.close()
+        except Exception as e:
+            LOGGER.warn("rest.aio.Connection.stop - exception on aio clean : " + traceback.format_exc())
+        self.thread = None
+
+    def stop(self):
+        """
+        close the client session and stop the event loop thread
+        :return: self
+        """
+        LOGGER.debug("rest.aio.Connection.stop")
+        with self.lock:
+            if not self.is_started:
+                return self
+            try:
+                self.run_coroutine(self.stop_async(), timeout=15)
+            except Exception as e:
+                LOGGER.warn("rest.aio.Connection.stop - exception on close : " + traceback.format_exc())
+            if not self.external_loop:
+                self._stop_event_loop()
+        return self
+
+
+class Requester(object):
+    """
+    asynchronous REST requester implementation. call_async is a coroutine awaiting the answer on the connection event
+    loop, so that thousands of calls can be in flight at once without any thread. call runs call_async from the
+    callers outside of the loop and returns the same responses as the REST requester, so that the directory and
+    mapping services can use this requester too.
+    :param my_args: dict like {connection, repository_path[, post_body_encoding]}
+    """
+
+    def __init__(self, my_args=None):
+        """
+        asynchronous REST requester constructor
+        :param my_args: dict like {connection, repository_path[, post_body_encoding]}. Default post_body_encoding is
+        form (see rest.Requester).
+        :return: self
+        """
+        LOGGER.debug("rest.aio.Requester.__init__")
+        if my_args is None:
+            raise exceptions.ArianeConfError('requester arguments')
+        if 'connection' not in my_args or my_args['connection'] is None:
+            raise exceptions.ArianeConfError('connection')
+        if 'repository_path' not in my_args or my_args['repository_path'] is None or not my_args['repository_path']:
+            raise exceptions.ArianeConfError('repository_path')
+        if 'post_body_encoding' not in my_args or my_args['post_body_encoding'] is None or \
+                not my_args['post_body_encoding']:
+            my_args['post_body_encoding'] = driver.Requester.POST_BODY_FORM
+        elif my_args['post_body_encoding'] not in [driver.Requester.POST_BODY_FORM, driver.Requester.POST_BODY_JSON,
+                                                   driver.Requester.POST_BODY_PARAMS]:
+            raise exceptions.ArianeConfError('post_body_encoding')
+
+        self.connection = my_args['connection']
+        self.repository_path = my_args['repository_path']
+        self.post_body_encoding = my_args['post_body_encoding']
+
+    @staticmethod
+    def _encode_parameters(parameters):
+        """
+        encode the call parameters values as the requests library does : None values are dropped, list values are
+        repeated and the other values are converted to str
+        :param parameters: dict of the call parameters
+        :return: the [(key, value), ...] parameters list
+        """
+        encoded_parameters = []
+        for key, value in parameters.items():
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple)):
+                for item in value:
+                    encoded_parameters.append((key, str(item)))
+            else:
+                encoded_parameters.append((key, str(value)))
+        return encoded_parameters
+
+    def call(self, my_args=None):
+        """
+        call the remote service. Wait the answer (blocking call). Not to be called from the connection event loop :
+        use call_async there.
+        :param my_args: dict like {http_operation, operation_path, parameters}
+        :return: response
+        """
+        LOGGER.debug("rest.aio.Requester.call")
+        return self.connection.run_coroutine(self.call_async(my_args))
+
+    async def call_async(self, my_args=None):
+        """
+        call the remote service from the connection event loop. Await the answer.
+        :param my_args: dict like {http_operation, operation_path, parameters}
+        :return: response
+        """
+        if my_args is None:
+            raise exceptions.ArianeConfError('requester call arguments')
+        if 'http_operation' not in my_args or my_args['http_operation'] is None or not my_args['http_operation']:
+            raise exceptions.ArianeConfError('requester call http_operation')
+        if 'operation_path' not in my_args or my_args['operation_path'] is None:  # can be empty
+            raise exceptions.ArianeConfError('requester call operation_path')
+        if 'parameters' not in my_args:
+            my_args['parameters'] = None
+        if not self.connection.is_started:
+            raise ArianeError('rest.aio.Requester.call', 'Connection not started !')
+
+        url = self.connection.base_url + self.repository_path + my_args['operation_path']
+        parameters = Requester._encode_parameters(my_args['parameters']) if my_args['parameters'] is not None \
+            else None
+        if my_args['http_operation'] == "GET":
+            kwargs = {'params': parameters}
+        elif my_args['http_operation'] == "POST":
+            if parameters is None:
+                raise exceptions.ArianeConfError('parameters argument is mandatory for http POST request')
+            if self.post_body_encoding == driver.Requester.POST_BODY_FORM:
+                kwargs = {'data': parameters}
+            elif self.post_body_encoding == driver.Requester.POST_BODY_JSON:
+                kwargs = {'json': my_args['parameters']}
+            else:
+                kwargs = {'params': parameters}
+        else:
+            raise exceptions.ArianeNotImplemented(my_args['http_operation'])
+
+        async with self.connection.semaphore:
+            async with self.connection.session.request(my_args['http_operation'], url, **kwargs) as response:
+                text = await response.text()
+        return driver.Requester._make_response(response.status, response.reason, text)
+
+    def call_many(self, my_args_list=None):
+        """
+        call the remote service with many independent requests running concurrently on the connection event loop.
+        Wait all the answers (blocking call)
+        :param my_args_list: list of dict like {http_operation, operation_path, parameters}
+        :return: the responses list, in the my_args_list order. Raise the first call exception if any.
+        """
+        LOGGER.debug("rest.aio.Requester.call_many")
+        return self.connection.run_coroutine(self.call_many_async(my_args_list))
+
+    async def call_many_async(self, my_args_list=None):
+        """
+        call the remote service with many independent requests running concurrently from the connection event loop.
+        Await all the answers.
+        :param my_args_list: list of dict like {http_operation, operation_path, parameters}
+        :return: the responses list, in the my_args_list order. Raise the first call exception if any.
+        """
+        if my_args_list is None:
+            raise exceptions.ArianeConfError('requester call_many arguments')
+        return await asyncio.gather(*[self.call_async(my_args) for my_args in my_args_list])
+
+
+class Driver(object):
+    """
+    asynchronous REST driver class. All the requesters of the driver share one aiohttp client session driven by one
+    asyncio event loop : the driver own event loop thread, or the caller aio_loop if provided. The session keeps up
+    to pool_maxsize connections alive (default 100, closed after each call if keep_alive is False) and runs up to
+    max_concurrency calls at once (default pool_maxsize). post_body_encoding is the requesters default one.
+    With an aio_loop the driver must be started and stopped with start_async and stop_async from this loop.
+    :param my_args: some dict like {base_url, user, password[, pool_maxsize, keep_alive, max_concurrency,
+    post_body_encoding, aio_loop]}
+    """
+
+    def __init__(self, my_args=None):
+        """
+        asynchronous REST driver constructor
+        :param my_args: some dict like {base_url, user, password[, pool_maxsize, keep_alive, max_concurrency,
+        post_body_encoding, aio_loop]}
+        :return:
+        """
+        LOGGER.debug("rest.aio.Driver.__init__")
+        if my_args is None:
+            raise exceptions.ArianeConfError("rest driver arguments")
+        if 'base_url' not in my_args or my_args['base_url'] is None or not my_args['base_url']:
+            raise exceptions.ArianeConfError('base_url')
+        if 'user' not in my_args or my_args['user'] is None or not my_args['user']:
+            raise exceptions.ArianeConfError('user')
+        if 'password' not in my_args or my_args['password'] is None or not my_args['password']:
+            raise exceptions.ArianeConfError('password')
+        if 'pool_maxsize' not in my_args or my_args['pool_maxsize'] is None or not my_args['pool_maxsize']:
+            my_args['pool_maxsize'] = 100
+        else:
+            my_args['pool_maxsize'] = int(my_args['pool_maxsize'])
+        if 'keep_alive' not in my_args or my_args['keep_alive'] is None:
+            my_args['keep_alive'] = True
+        else:
+            my_args['keep_alive'] = bool(my_args['keep_alive'])
+        if 'max_concurrency' not in my_args or my_args['max_concurrency'] is None or \
+                not my_args['max_concurrency']:
+            my_args['max_concurrency'] = my_args['pool_maxsize']
+        else:
+            my_args['max_concurrency'] = int(my_args['max_concurrency'])
+        if 'post_body_encoding' not in my_args or my_args['post_body_encoding'] is None or \
+                not my_args['post_body_encoding']:
+            my_args['post_body_encoding'] = driver.Requester.POST_BODY_FORM
+
+        self.type = my_args['type']
+        # the event loop is not part of the connection arguments
+        self.aio_loop = my_args.pop('aio_loop', None)
+        self.post_body_encoding = my_args['post_body_encoding']
+        self.connection = Connection(my_args, loop=self.aio_loop)
+
+    def start(self):
+        """
+        start the driver event loop thread and open the client session. Not to be called from the driver aio_loop :
+        use start_async there.
+        :return: self
+        """
+        LOGGER.debug("rest.aio.Driver.start")
+        self.connection.start()
+        return self
+
+    async def start_async(self):
+        """
+        open the client session from the driver aio_loop
+        :return: self
+        """
+        LOGGER.debug("rest.aio.Driver.start_async")
+        await self.connection.start_async()
+        return self
+
+    def stop(self):
+        """
+        close the client session and stop the driver event loop thread
+        :return: self
+        """
+        LOGGER.debug("rest.aio.Driver.stop")
+        self.connection.stop()
+        return self
+
+    async def stop_async(self):
+        """
+        close the client session from the driver aio_loop
+        :return: self
+        """
+        LOGGER.debug("rest.aio.Driver.stop_async")
+        await self.connection.stop_async()
+        return self
+
+    def make_service(self):
+        """
+        not implemented
+        :return:
+        """
+        LOGGER.debug("rest.aio.Driver.make_service")
+        raise exceptions.ArianeNotImplemented(self.__class__.__name__ + ".make_service")
+
+    def make_requester(self, my_args=None):
+        """
+        make a new requester
+        :param my_args: some dict not None dict like {repository_path[, post_body_encoding]}
+        :return: instanciated Requester
+        """
+        LOGGER.debug("rest.aio.Driver.make_requester")
+        if my_args is None:
+            raise exceptions.ArianeConfError('requester factory arguments')
+        my_args['connection'] = self.connection
+        if 'post_body_encoding' not in my_args or my_args['post_body_encoding'] is None or \
+                not my_args['post_body_encoding']:
+            my_args['post_body_encoding'] = self.post_body_encoding
+
+        return Requester(my_args)
+
+    def make_publisher(self):
+        """
+        not implemented
+        :return:
+        """
+        LOGGER.debug("rest.aio.Driver.make_publisher")
+        raise exceptions.ArianeNotImplemented(self.__class__.__name__ + ".make_publisher")
+
+    def make_subscriber(self):
+        """
+        not implemented
+        :return:
+        """
+        LOGGER.debug("rest.aio.Driver.make_subscriber")
+        raise exceptions.ArianeNotImplemented(self.__class__.__name__ + ".make_subscriber")
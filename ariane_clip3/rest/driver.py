@@ -15,8 +15,16 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import collections
+import concurrent.futures
+import json
 import logging
+import threading
+import timeit
+import urllib.parse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from ariane_clip3 import exceptions
 from ariane_clip3.driver_common import DriverResponse
@@ -27,14 +35,32 @@ LOGGER = logging.getLogger(__name__)
 
 class Requester(object):
     """
-    REST Requester implementation
-    :param: my_args: dict like {session, base_url, repository_path}
+    REST Requester implementation. The requester session is thread safe : with the driver executor call_many fans out
+    independent calls over the session connection pool.
+    POST parameters are sent according to post_body_encoding : as an url encoded form body (form, default), as a JSON
+    body (json) or in the query string (params, as before).
+    With cache_max_entries the GET read operations (READ_OPERATION_PATHS) responses are cached by URL and parameters
+    (LRU) : responses with an ETag or a Last-Modified header are revalidated with a conditional GET, the other ones are
+    served from cache for cache_ttl sec. The calls with cache_bypass are not served from cache. As the Ariane REST API
+    writes over GET too (delete, update/..., ...), the other GET calls and the POST calls are never served from cache
+    and clear the requester cache.
+    :param: my_args: dict like {session, base_url, repository_path[, executor, post_body_encoding, cache_max_entries,
+    cache_ttl]}
     """
 
+    POST_BODY_FORM = "form"
+    POST_BODY_JSON = "json"
+    POST_BODY_PARAMS = "params"
+
+    # first operation path segment of the cacheable GET operations. Any other GET operation is a write.
+    READ_OPERATION_PATHS = ['', 'get', 'find']
+
     def __init__(self, my_args=None):
         """
         REST requester constructor
-        :param my_args: dict like {session, base_url, repository_path}
+        :param my_args: dict like {session, base_url, repository_path[, executor, post_body_encoding,
+        cache_max_entries, cache_ttl]}. Without executor call_many runs the calls one after the other. Default
+        cache_max_entries is 0 : no cache. Default cache_ttl is 1 sec.
         :return: self
         """
         LOGGER.debug("rest.Requester.__init__")
@@ -46,15 +72,146 @@ class Requester(object):
             raise exceptions.ArianeConfError('base_path')
         if 'repository_path' not in my_args or my_args['repository_path'] is None or not my_args['repository_path']:
             raise exceptions.ArianeConfError('repository_path')
+        if 'post_body_encoding' not in my_args or my_args['post_body_encoding'] is None or \
+                not my_args['post_body_encoding']:
+            my_args['post_body_encoding'] = Requester.POST_BODY_FORM
+        elif my_args['post_body_encoding'] not in [Requester.POST_BODY_FORM, Requester.POST_BODY_JSON,
+                                                   Requester.POST_BODY_PARAMS]:
+            raise exceptions.ArianeConfError('post_body_encoding')
+        if 'cache_max_entries' not in my_args or my_args['cache_max_entries'] is None or \
+                not my_args['cache_max_entries']:
+            # default = no cache
+            my_args['cache_max_entries'] = 0
+        if 'cache_ttl' not in my_args or my_args['cache_ttl'] is None:
+            my_args['cache_ttl'] = 1
 
         self.session = my_args['session']
         self.base_url = my_args['base_url']
         self.repository_path = my_args['repository_path']
+        self.executor = my_args['executor'] if 'executor' in my_args else None
+        self.post_body_encoding = my_args['post_body_encoding']
+        self.cache_max_entries = int(my_args['cache_max_entries'])
+        self.cache_ttl = float(my_args['cache_ttl'])
+        # cache key -> {status_code, reason, text, etag, last_modified, expiration} of the cached GET responses
+        self.cache = collections.OrderedDict()
+        self.cache_stats = {
+            'hits': 0,
+            'misses': 0,
+            'revalidated': 0,
+            'bypassed': 0,
+            'invalidations': 0
+        }
+        self.cache_lock = threading.Lock()
+
+    @staticmethod
+    def _make_response(status_code, reason, text):
+        """
+        build the driver response from the HTTP response
+        :param status_code: the HTTP response status code
+        :param reason: the HTTP response reason
+        :param text: the HTTP response body
+        :return: the driver response
+        """
+        if status_code == 200:
+            try:
+                return DriverResponse(
+                    rc=0,
+                    error_message=reason,
+                    response_content=json.loads(text)
+                )
+            except ValueError as e:
+                return DriverResponse(
+                    rc=0,
+                    error_message=reason,
+                    response_content=text
+                )
+        else:
+            return DriverResponse(
+                rc=status_code,
+                error_message=reason,
+                response_content=text
+            )
+
+    def _cached_get(self, url, parameters):
+        """
+        GET the url from cache, or from the server with a conditional GET if the cached response has validators
+        :param url: the url
+        :param parameters: the GET parameters or None
+        :return: the driver response
+        """
+        cache_key = url
+        if parameters is not None:
+            cache_key += '?' + urllib.parse.urlencode(sorted(parameters.items()), doseq=True)
+        with self.cache_lock:
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                self.cache.move_to_end(cache_key)
+                if entry['etag'] is None and entry['last_modified'] is None:
+                    if timeit.default_timer() < entry['expiration']:
+                        self.cache_stats['hits'] += 1
+                        return Requester._make_response(entry['status_code'], entry['reason'], entry['text'])
+                    entry = None
+        headers = {}
+        if entry is not None:
+            if entry['etag'] is not None:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified'] is not None:
+                headers['If-Modified-Since'] = entry['last_modified']
+        response = self.session.get(url, params=parameters, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            with self.cache_lock:
+                self.cache_stats['revalidated'] += 1
+            return Requester._make_response(entry['status_code'], entry['reason'], entry['text'])
+        with self.cache_lock:
+            self.cache_stats['misses'] += 1
+            if response.status_code == 200:
+                self.cache[cache_key] = {
+                    'status_code': response.status_code,
+                    'reason': response.reason,
+                    'text': response.text,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'expiration': timeit.default_timer() + self.cache_ttl
+                }
+                self.cache.move_to_end(cache_key)
+                while self.cache.__len__() > self.cache_max_entries:
+                    self.cache.popitem(last=False)
+            else:
+                self.cache.pop(cache_key, None)
+        return Requester._make_response(response.status_code, response.reason, response.text)
+
+    @staticmethod
+    def _is_read_operation(operation_path):
+        """
+        :param operation_path: the call operation path
+        :return: True if the GET operation path is a read operation which can be served from cache
+        """
+        return operation_path.split('/')[0] in Requester.READ_OPERATION_PATHS
+
+    def clear_cache(self):
+        """
+        clear the requester GET responses cache
+        """
+        LOGGER.debug("rest.Requester.clear_cache")
+        with self.cache_lock:
+            if self.cache:
+                self.cache.clear()
+                self.cache_stats['invalidations'] += 1
+
+    def get_cache_stats(self):
+        """
+        get the GET responses cache statistics
+        :return: dict like {entries, hits, misses, revalidated, bypassed, invalidations}
+        """
+        with self.cache_lock:
+            stats = dict(self.cache_stats)
+            stats['entries'] = self.cache.__len__()
+        return stats
 
     def call(self, my_args=None):
         """
         call the remote service. Wait the answer (blocking call)
-        :param my_args: dict like {http_operation, operation_path, parameters}
+        :param my_args: dict like {http_operation, operation_path, parameters[, cache_bypass]}
         :return: response
         """
         LOGGER.debug("rest.Requester.call")
@@ -67,6 +224,17 @@ class Requester(object):
         if 'parameters' not in my_args:
             my_args['parameters'] = None
 
+        if my_args['http_operation'] == "GET" and self.cache_max_entries > 0:
+            if not Requester._is_read_operation(my_args['operation_path']):
+                # the cached responses may be outdated by the write
+                self.clear_cache()
+            elif 'cache_bypass' not in my_args or my_args['cache_bypass'] is None or not my_args['cache_bypass']:
+                return self._cached_get(self.base_url + self.repository_path + my_args['operation_path'],
+                                        my_args['parameters'])
+            else:
+                with self.cache_lock:
+                    self.cache_stats['bypassed'] += 1
+
         if my_args['http_operation'] is "GET":
             if my_args['parameters'] is None:
                 response = self.session.get(self.base_url + self.repository_path + my_args['operation_path'])
@@ -75,44 +243,59 @@ class Requester(object):
                                             params=my_args['parameters'])
         elif my_args['http_operation'] is "POST":
             if my_args['parameters'] is not None:
-                response = self.session.post(self.base_url + self.repository_path + my_args['operation_path'],
-                                             params=my_args['parameters'])
+                if self.cache_max_entries > 0:
+                    # the cached responses may be outdated by the write
+                    self.clear_cache()
+                url = self.base_url + self.repository_path + my_args['operation_path']
+                if self.post_body_encoding == Requester.POST_BODY_FORM:
+                    response = self.session.post(url, data=my_args['parameters'])
+                elif self.post_body_encoding == Requester.POST_BODY_JSON:
+                    response = self.session.post(url, json=my_args['parameters'])
+                else:
+                    response = self.session.post(url, params=my_args['parameters'])
             else:
                 raise exceptions.ArianeConfError('parameters argument is mandatory for http POST request')
         else:
             raise exceptions.ArianeNotImplemented(my_args['http_operation'])
 
-        if response.status_code is 200:
-            try:
-                return DriverResponse(
-                    rc=0,
-                    error_message=response.reason,
-                    response_content=response.json()
-                )
-            except ValueError as e:
-                return DriverResponse(
-                    rc=0,
-                    error_message=response.reason,
-                    response_content=response.text
-                )
-        else:
-            return DriverResponse(
-                rc=response.status_code,
-                error_message=response.reason,
-                response_content=response.text
-            )
+        return Requester._make_response(response.status_code, response.reason, response.text)
+
+    def call_many(self, my_args_list=None):
+        """
+        call the remote service with many independent requests running concurrently on the driver executor. Wait all
+        the answers (blocking call)
+        :param my_args_list: list of dict like {http_operation, operation_path, parameters}
+        :return: the responses list, in the my_args_list order. Raise the first call exception if any.
+        """
+        LOGGER.debug("rest.Requester.call_many")
+        if my_args_list is None:
+            raise exceptions.ArianeConfError('requester call_many arguments')
+        if self.executor is None or my_args_list.__len__() < 2:
+            return [self.call(my_args) for my_args in my_args_list]
+        futures = [self.executor.submit(self.call, my_args) for my_args in my_args_list]
+        concurrent.futures.wait(futures)
+        return [future.result() for future in futures]
 
 
 class Driver(object):
     """
-    REST driver class.
-    :param my_args: some dict like {base_url, user, password}
+    REST driver class. The driver session keeps up to pool_maxsize (default 10) connections alive per host, for up to
+    pool_connections (default 10) hosts, unless keep_alive is False. Failed connections, and responses with a
+    retry_status_list status (default [502, 503, 504]), are retried up to max_retries times (default 0 : no retry)
+    with a retry_backoff_factor exponential backoff (default 0) for idempotent HTTP operations. Requesters call_many
+    run on an executor of executor_pool_size threads (default pool_maxsize). post_body_encoding, cache_max_entries and
+    cache_ttl are the requesters default ones.
+    :param my_args: some dict like {base_url, user, password[, pool_connections, pool_maxsize, keep_alive,
+    max_retries, retry_backoff_factor, retry_status_list, executor_pool_size, post_body_encoding, cache_max_entries,
+    cache_ttl]}
     """
 
     def __init__(self, my_args=None):
         """
         REST driver constructor
-        :param my_args: some dict like {base_url, user, password}
+        :param my_args: some dict like {base_url, user, password[, pool_connections, pool_maxsize, keep_alive,
+        max_retries, retry_backoff_factor, retry_status_list, executor_pool_size, post_body_encoding,
+        cache_max_entries, cache_ttl]}
         :return:
         """
         LOGGER.debug("rest.Driver.__init__")
@@ -124,28 +307,74 @@ class Driver(object):
             raise exceptions.ArianeConfError('user')
         if 'password' not in my_args or my_args['password'] is None or not my_args['password']:
             raise exceptions.ArianeConfError('password')
+        if 'pool_connections' not in my_args or my_args['pool_connections'] is None or \
+                not my_args['pool_connections']:
+            my_args['pool_connections'] = 10
+        if 'pool_maxsize' not in my_args or my_args['pool_maxsize'] is None or not my_args['pool_maxsize']:
+            my_args['pool_maxsize'] = 10
+        if 'keep_alive' not in my_args or my_args['keep_alive'] is None:
+            my_args['keep_alive'] = True
+        if 'max_retries' not in my_args or my_args['max_retries'] is None or not my_args['max_retries']:
+            # default retry = no retry
+            my_args['max_retries'] = 0
+        if 'retry_backoff_factor' not in my_args or my_args['retry_backoff_factor'] is None or \
+                not my_args['retry_backoff_factor']:
+            my_args['retry_backoff_factor'] = 0
+        if 'retry_status_list' not in my_args or my_args['retry_status_list'] is None:
+            my_args['retry_status_list'] = [502, 503, 504]
+        if 'executor_pool_size' not in my_args or my_args['executor_pool_size'] is None or \
+                not my_args['executor_pool_size']:
+            my_args['executor_pool_size'] = my_args['pool_maxsize']
+        if 'post_body_encoding' not in my_args or my_args['post_body_encoding'] is None or \
+                not my_args['post_body_encoding']:
+            my_args['post_body_encoding'] = Requester.POST_BODY_FORM
 
         self.type = my_args['type']
         self.user = my_args['user']
         self.password = my_args['password']
         self.base_url = my_args['base_url']
+        self.pool_connections = int(my_args['pool_connections'])
+        self.pool_maxsize = int(my_args['pool_maxsize'])
+        self.keep_alive = bool(my_args['keep_alive'])
+        self.max_retries = int(my_args['max_retries'])
+        self.retry_backoff_factor = float(my_args['retry_backoff_factor'])
+        self.retry_status_list = list(my_args['retry_status_list'])
+        self.executor_pool_size = int(my_args['executor_pool_size'])
+        self.post_body_encoding = my_args['post_body_encoding']
+        self.cache_max_entries = my_args['cache_max_entries'] if 'cache_max_entries' in my_args else None
+        self.cache_ttl = my_args['cache_ttl'] if 'cache_ttl' in my_args else None
         self.session = None
+        self.executor = None
 
     def start(self):
         """
-        instanciate request session with authent
+        instanciate request session with authent, its connection pool and the requesters executor
         :return:
         """
         LOGGER.debug("rest.Driver.start")
         self.session = requests.Session()
         self.session.auth = (self.user, self.password)
+        retries = Retry(total=self.max_retries, backoff_factor=self.retry_backoff_factor,
+                        status_forcelist=self.retry_status_list, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+                              max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if not self.keep_alive:
+            self.session.headers['Connection'] = 'close'
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.executor_pool_size)
 
     def stop(self):
         """
-        uninstanciate request
+        uninstanciate request : wait the running calls and close the session connections
         :return:
         """
         LOGGER.debug("rest.Driver.stop")
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.session is not None:
+            self.session.close()
         self.session = None
 
     def make_service(self):
@@ -159,7 +388,8 @@ class Driver(object):
     def make_requester(self, my_args=None):
         """
         make a new requester
-        :param my_args: some dict not None dict
+        :param my_args: some dict not None dict like {repository_path[, post_body_encoding, cache_max_entries,
+        cache_ttl]}
         :return: instanciated Requester
         """
         LOGGER.debug("rest.Driver.make_requester")
@@ -167,6 +397,14 @@ class Driver(object):
             raise exceptions.ArianeConfError('requester factory arguments')
         my_args['session'] = self.session
         my_args['base_url'] = self.base_url
+        my_args['executor'] = self.executor
+        if 'post_body_encoding' not in my_args or my_args['post_body_encoding'] is None or \
+                not my_args['post_body_encoding']:
+            my_args['post_body_encoding'] = self.post_body_encoding
+        if 'cache_max_entries' not in my_args or my_args['cache_max_entries'] is None:
+            my_args['cache_max_entries'] = self.cache_max_entries
+        if 'cache_ttl' not in my_args or my_args['cache_ttl'] is None:
+            my_args['cache_ttl'] = self.cache_ttl
 
         return Requester(my_args)
 
@@ -19,7 +19,6 @@ import logging
 
 import pykka
 import threading
-import time
 
 from ariane_clip3 import exceptions
 import zmq
@@ -33,16 +32,18 @@ class Publisher(pykka.ThreadingActor):
     """
     ZeroMQ publisher implementation.
     :param connection_args: dict like {user, password, host[, port, vhost, client_properties]}
+    :param zmqcontext: the zmq context to create the socket from. Default = the process shared zmq context instance
     """
-    def __init__(self, connection_args=None):
+    def __init__(self, connection_args=None, zmqcontext=None):
         """
         ZeroMQ service constructor
         :param connection_args: dict like {[host, port]}
+        :param zmqcontext: the zmq context to create the socket from. Default = zmq.Context.instance()
         :return: self
         """
         LOGGER.debug("zeromq.Publisher.__init__")
         super(Publisher, self).__init__()
-        self.zmqcontext = zmq.Context.instance()
+        self.zmqcontext = zmqcontext if zmqcontext is not None else zmq.Context.instance()
         self.zmqsocket = self.zmqcontext.socket(zmq.PUB)
         self.zmqbind_url = "tcp://" + str(connection_args['host']) + ':' + str(connection_args['port'])
 
@@ -78,26 +79,115 @@ class Publisher(pykka.ThreadingActor):
         """
         LOGGER.debug("zeromq.Publisher.on_stop")
         self.zmqsocket.close()
-        self.zmqcontext.destroy()
 
     def on_failure(self, exception_type, exception_value, traceback_):
         LOGGER.error("zeromq.Publisher.on_failure - " + exception_type.__str__() + "/" + exception_value.__str__())
         LOGGER.error("zeromq.Publisher.on_failure - " + traceback_.format_exc())
         self.zmqsocket.close()
-        self.zmqcontext.destroy()
+
+
+class TopicTrie(object):
+    """
+    Prefix tree of the subscribed topics and their treatment callbacks. As with the zmq SUB socket filter, a message
+    matches a topic if it starts with it : match walks the message once whatever the subscribed topics count.
+    """
+    def __init__(self):
+        self.root = {'children': {}, 'callbacks': []}
+        self.lock = threading.Lock()
+
+    def add(self, topic, callback):
+        """
+        register the callback on the topic
+        :param topic: the topic
+        :param callback: the treatment callback
+        :return: True if topic had no callback registered yet
+        """
+        with self.lock:
+            node = self.root
+            for char in topic:
+                node = node['children'].setdefault(char, {'children': {}, 'callbacks': []})
+            node['callbacks'].append(callback)
+            return node['callbacks'].__len__() == 1
+
+    def remove(self, topic, callback):
+        """
+        unregister the callback from the topic
+        :param topic: the topic
+        :param callback: the treatment callback
+        :return: True if topic has no callback registered anymore
+        """
+        with self.lock:
+            path = [self.root]
+            for char in topic:
+                node = path[-1]['children'].get(char)
+                if node is None:
+                    return False
+                path.append(node)
+            if callback not in path[-1]['callbacks']:
+                return False
+            path[-1]['callbacks'].remove(callback)
+            if path[-1]['callbacks']:
+                return False
+            # prune the nodes left without callbacks nor children
+            for i in range(topic.__len__(), 0, -1):
+                if path[i]['callbacks'] or path[i]['children']:
+                    break
+                del path[i - 1]['children'][topic[i - 1]]
+            return True
+
+    def match(self, msg):
+        """
+        :param msg: the received message
+        :return: the callbacks registered on the topics msg starts with
+        """
+        with self.lock:
+            node = self.root
+            callbacks = list(node['callbacks'])
+            for char in msg:
+                node = node['children'].get(char)
+                if node is None:
+                    break
+                callbacks.extend(node['callbacks'])
+            return callbacks
+
+    def topics(self):
+        """
+        :return: the topics having at least one callback registered
+        """
+        with self.lock:
+            topics = []
+            nodes = [('', self.root)]
+            while nodes:
+                prefix, node = nodes.pop()
+                if node['callbacks']:
+                    topics.append(prefix)
+                for char, child in node['children'].items():
+                    nodes.append((prefix + char, child))
+            return topics
 
 
 class Subscriber(pykka.ThreadingActor):
     """
-    ZeroMQ subscriber implementation.
+    ZeroMQ subscriber implementation. The subscriber multiplexes its topics subscriptions on one SUB socket and
+    dispatches the received messages to the treatment callbacks through a TopicTrie. The subscriber thread blocks in a
+    zmq.Poller on the SUB socket and on an inproc control socket : messages are treated as soon as they are received,
+    idle subscribers don't wake up, and subscribe, unsubscribe and stop are sent to the subscriber thread through the
+    control socket as it is the only one allowed to use the SUB socket. The zmq context is not destroyed on stop as
+    other publishers and subscribers threads may be using it.
     :param my_args: dict like {connection, service_q, treatment_callback[, service_name]}
     :param connection_args: dict like {[host, port]}
+    :param zmqcontext: the zmq context to create the sockets from. Default = the process shared zmq context instance
     """
-    def __init__(self, my_args=None, connection_args=None):
+    CONTROL_STOP = b'STOP'
+    CONTROL_SUBSCRIBE = b'SUBSCRIBE'
+    CONTROL_UNSUBSCRIBE = b'UNSUBSCRIBE'
+
+    def __init__(self, my_args=None, connection_args=None, zmqcontext=None):
         """
         ZeroMQ subscriber constructor
         :param my_args: dict like {connection, topic, treatment_callback[, service_name]}
         :param connection_args: dict like {[host, port]}
+        :param zmqcontext: the zmq context to create the sockets from. Default = zmq.Context.instance()
         :return: self
         """
         LOGGER.debug("zeromq.Subscriber.__init__")
@@ -114,12 +204,16 @@ class Subscriber(pykka.ThreadingActor):
 
         super(Subscriber, self).__init__()
         self.subscriber = None
-        self.zmqtopic = my_args['topic']
         self.subscriber_name = my_args['subscriber_name']
-        self.cb = my_args['treatment_callback']
-        self.zmqcontext = zmq.Context.instance()
+        self.topics = TopicTrie()
+        self.topics.add(my_args['topic'], my_args['treatment_callback'])
+        self.zmqcontext = zmqcontext if zmqcontext is not None else zmq.Context.instance()
         self.zmqsocket = self.zmqcontext.socket(zmq.SUB)
         self.zmqbind_url = "tcp://" + str(connection_args['host']) + ':' + str(connection_args['port'])
+        # the subscriber thread polls the control socket bound on zmqcontrol_url, on_stop sends on the connected one
+        self.zmqcontrol_url = "inproc://zeromq.Subscriber-" + str(id(self))
+        self.zmqcontrol_recv = None
+        self.zmqcontrol_send = None
         self.is_started = False
         self.running = False
 
@@ -130,21 +224,107 @@ class Subscriber(pykka.ThreadingActor):
         LOGGER.debug("zeromq.Subscriber.run")
         self.running = True
         self.is_started = True
+        poller = zmq.Poller()
+        poller.register(self.zmqsocket, zmq.POLLIN)
+        poller.register(self.zmqcontrol_recv, zmq.POLLIN)
         while self.running:
-            msg = None
             try:
-                msg = self.zmqsocket.recv_string(zmq.NOBLOCK)
-            except zmq.ZMQError:
-                time.sleep(0.1)
-            except Exception as e:
-                LOGGER.warn("zeromq.Subscriber.run - Exception raised while consuming on topic " + str(self.zmqtopic))
-            if msg is not None:
+                events = dict(poller.poll())
+            except zmq.ZMQError as e:
+                LOGGER.warn("zeromq.Subscriber.run - Exception raised while polling on " + self.zmqbind_url)
+                break
+            if self.zmqcontrol_recv in events and not self._on_control():
+                break
+            if self.zmqsocket not in events:
+                continue
+            # treat all the messages received since the last poll
+            while self.running:
                 try:
-                    self.cb(msg)
+                    msg = self.zmqsocket.recv_string(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
                 except Exception as e:
-                    LOGGER.warn("zeromq.Subscriber.run - Exception raised while treating msg {" + str(msg) + "}")
+                    LOGGER.warn("zeromq.Subscriber.run - Exception raised while consuming on " + self.zmqbind_url)
+                    break
+                for callback in self.topics.match(msg):
+                    try:
+                        callback(msg)
+                    except Exception as e:
+                        LOGGER.warn("zeromq.Subscriber.run - Exception raised while treating msg {" + str(msg) + "}")
         self.is_started = False
 
+    def _on_control(self):
+        """
+        apply the commands received on the control socket on the subscriber thread.
+        :return: False if the subscriber thread must stop
+        """
+        while True:
+            try:
+                command = self.zmqcontrol_recv.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return True
+            if command[0] == Subscriber.CONTROL_STOP:
+                return False
+            elif command[0] == Subscriber.CONTROL_SUBSCRIBE:
+                self.zmqsocket.setsockopt(zmq.SUBSCRIBE, command[1])
+            elif command[0] == Subscriber.CONTROL_UNSUBSCRIBE:
+                self.zmqsocket.setsockopt(zmq.UNSUBSCRIBE, command[1])
+
+    def subscribe(self, my_args=None):
+        """
+        add a topic subscription to this subscriber
+        :param my_args: dict like {topic, treatment_callback}
+        :return:
+        """
+        LOGGER.debug("zeromq.Subscriber.subscribe")
+        if my_args is None:
+            raise exceptions.ArianeConfError("subscriber arguments")
+        if 'topic' not in my_args or my_args['topic'] is None or not my_args['topic']:
+            raise exceptions.ArianeConfError("subscriber topic")
+        if 'treatment_callback' not in my_args or my_args['treatment_callback'] is None:
+            raise exceptions.ArianeConfError("treatment_callback")
+        if self.topics.add(my_args['topic'], my_args['treatment_callback']):
+            self.zmqcontrol_send.send_multipart([Subscriber.CONTROL_SUBSCRIBE, my_args['topic'].encode('UTF-8')])
+
+    def unsubscribe(self, my_args=None):
+        """
+        remove a topic subscription from this subscriber. The SUB socket topic filter is removed with the topic last
+        treatment callback.
+        :param my_args: dict like {topic, treatment_callback}
+        :return:
+        """
+        LOGGER.debug("zeromq.Subscriber.unsubscribe")
+        if my_args is None:
+            raise exceptions.ArianeConfError("subscriber arguments")
+        if 'topic' not in my_args or my_args['topic'] is None or not my_args['topic']:
+            raise exceptions.ArianeConfError("subscriber topic")
+        if 'treatment_callback' not in my_args or my_args['treatment_callback'] is None:
+            raise exceptions.ArianeConfError("treatment_callback")
+        if self.topics.remove(my_args['topic'], my_args['treatment_callback']):
+            self.zmqcontrol_send.send_multipart([Subscriber.CONTROL_UNSUBSCRIBE, my_args['topic'].encode('UTF-8')])
+
+    def get_topics(self):
+        """
+        :return: the topics subscribed by this subscriber
+        """
+        return self.topics.topics()
+
+    def _stop_consuming(self):
+        """
+        wake the subscriber thread up through the control socket and wait its end
+        """
+        self.running = False
+        if self.zmqcontrol_send is not None:
+            self.zmqcontrol_send.send_multipart([Subscriber.CONTROL_STOP])
+        if self.subscriber is not None:
+            self.subscriber.join()
+            self.subscriber = None
+        for zmqsocket in [self.zmqcontrol_send, self.zmqcontrol_recv, self.zmqsocket]:
+            if zmqsocket is not None:
+                zmqsocket.close(linger=0)
+        self.zmqcontrol_send = None
+        self.zmqcontrol_recv = None
+
     def on_start(self):
         """
         start subscriber
@@ -152,10 +332,15 @@ class Subscriber(pykka.ThreadingActor):
         LOGGER.debug("zeromq.Subscriber.on_start")
         try:
             self.zmqsocket.connect(self.zmqbind_url)
-            self.zmqsocket.setsockopt_string(zmq.SUBSCRIBE, self.zmqtopic)
+            for topic in self.topics.topics():
+                self.zmqsocket.setsockopt_string(zmq.SUBSCRIBE, topic)
         except Exception as e:
             LOGGER.error("error while subscribing ! " + e.__cause__)
             raise e
+        self.zmqcontrol_recv = self.zmqcontext.socket(zmq.PAIR)
+        self.zmqcontrol_recv.bind(self.zmqcontrol_url)
+        self.zmqcontrol_send = self.zmqcontext.socket(zmq.PAIR)
+        self.zmqcontrol_send.connect(self.zmqcontrol_url)
         self.subscriber = threading.Thread(target=self.run, name=self.subscriber_name)
         self.subscriber.start()
 
@@ -164,25 +349,18 @@ class Subscriber(pykka.ThreadingActor):
         stop subscriber
         """
         LOGGER.debug("zeromq.Subscriber.on_stop")
-        self.running = False
-        while self.is_started:
-            time.sleep(0.1)
-        self.zmqsocket.close()
-        self.zmqcontext.destroy()
+        self._stop_consuming()
 
     def on_failure(self, exception_type, exception_value, traceback_):
         LOGGER.error("zeromq.Subscriber.on_failure - " + exception_type.__str__() + "/" + exception_value.__str__())
         LOGGER.error("zeromq.Subscriber.on_failure - " + traceback_.format_exc())
-        self.running = False
-        while self.is_started:
-            time.sleep(0.1)
-        self.zmqsocket.close()
-        self.zmqcontext.destroy()
+        self._stop_consuming()
 
 
 class Driver(object):
     """
-    ZeroMQ driver class.
+    ZeroMQ driver class. The driver publishers and subscriber share the driver zmq context, which is terminated on
+    driver stop. The driver topics subscriptions are multiplexed on one Subscriber (one thread and one SUB socket).
     :param my_args: dict like {[host, port]}. Default = None
     """
     default_host = "127.0.0.1"
@@ -226,6 +404,8 @@ class Driver(object):
             raise e
         self.subscribers_registry = []
         self.publishers_registry = []
+        self.subscriber = None
+        self.zmqcontext = zmq.Context()
 
     def start(self):
         """
@@ -240,16 +420,28 @@ class Driver(object):
         :return: self
         """
         LOGGER.debug("zeromq.Driver.stop")
+        # stop the actors synchronously : their sockets must be closed before the zmq context termination
         for publisher in self.publishers_registry:
-            publisher.stop()
+            publisher.actor_ref.stop()
         self.publishers_registry.clear()
         for subscriber in self.subscribers_registry:
             if subscriber.is_started:
-                subscriber.stop()
+                subscriber.actor_ref.stop()
         self.subscribers_registry.clear()
+        self.subscriber = None
         # pykka.ActorRegistry.stop_all()
+        # wait the publishers and subscribers sockets closing so that the publishers ports are released
+        self.zmqcontext.term()
         return self
 
+    def _get_zmqcontext(self):
+        """
+        :return: the driver zmq context, a new one if the driver has been stopped
+        """
+        if self.zmqcontext.closed:
+            self.zmqcontext = zmq.Context()
+        return self.zmqcontext
+
     def make_service(self, my_args=None):
         """
         not implemented
@@ -274,20 +466,24 @@ class Driver(object):
         LOGGER.debug("zeromq.Driver.make_publisher")
         if not self.configuration_OK or self.connection_args is None:
             raise exceptions.ArianeConfError('zeromq connection arguments')
-        publisher = Publisher.start(self.connection_args).proxy()
+        publisher = Publisher.start(self.connection_args, self._get_zmqcontext()).proxy()
         self.publishers_registry.append(publisher)
         return publisher
 
     def make_subscriber(self, my_args=None):
         """
-        not implemented
-        :return:
+        subscribe the treatment callback to the topic on the driver subscriber, which is started on first call.
+        :param my_args: dict like {topic, treatment_callback[, subscriber_name]}
+        :return: the driver subscriber proxy (use its unsubscribe method to remove the subscription)
         """
         LOGGER.debug("zeromq.Driver.make_subscriber")
         if my_args is None:
             raise exceptions.ArianeConfError('subscriber arguments')
         if not self.configuration_OK or self.connection_args is None:
             raise exceptions.ArianeConfError('zeromq connection arguments')
-        subscriber = Subscriber.start(my_args, self.connection_args).proxy()
-        self.subscribers_registry.append(subscriber)
-        return subscriber
+        if self.subscriber is None:
+            self.subscriber = Subscriber.start(my_args, self.connection_args, self._get_zmqcontext()).proxy()
+            self.subscribers_registry.append(self.subscriber)
+        else:
+            self.subscriber.subscribe(my_args).get()
+        return self.subscriber
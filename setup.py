@@ -26,7 +26,7 @@ setup(name='ariane_clip3',
       packages=['ariane_clip3', 'ariane_clip3.rabbitmq', 'ariane_clip3.rest',
                 'ariane_clip3.zeromq', 'ariane_clip3.natsd'],
       license='AGPLv3',
-      install_requires=['asyncio-nats-client', 'requests', 'epika-python3', 'pykka', 'pyzmq'],
+      install_requires=['asyncio-nats-client', 'requests', 'aiohttp', 'epika-python3', 'pykka', 'pyzmq'],
       package_data={'': ['LICENSE', 'README.md']},
       classifiers=[
           'Development Status :: 4 - Beta',
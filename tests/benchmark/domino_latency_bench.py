@@ -0,0 +1,77 @@
+# Ariane CLI Python 3
+# Domino activation latency benchmark
+#
+# Copyright (C) 2016 echinopsii
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import threading
+import time
+from ariane_clip3.domino import DominoActivator, DominoReceptor
+
+__author__ = 'mffrench'
+
+# print the latency between DominoActivator.activate and the DominoReceptor treatment callback, then the CPU time
+# spent by this process and its threads count while IDLE_RECEPTORS receptors wait for an activation which never comes.
+# activations are paced so that each one is received before the next one is sent.
+# needs a free local port 6669 (zeromq driver default).
+
+ACTIVATIONS = 500
+IDLE_RECEPTORS = 50
+IDLE_SECONDS = 5
+
+
+def percentile(values, rank):
+    return values[min(values.__len__() - 1, int(values.__len__() * rank / 100))]
+
+
+if __name__ == '__main__':
+    args_driver = {'type': 'Z0MQ'}
+    received = threading.Event()
+    latencies = []
+
+    def on_message(msg):
+        received.set()
+
+    activator = DominoActivator(args_driver)
+    receptor = DominoReceptor(args_driver, {'topic': "bench", 'treatment_callback': on_message,
+                                            'subscriber_name': "bench receptor"})
+    # wait the subscription propagation (zeromq slow joiner)
+    while not received.is_set():
+        activator.activate("bench")
+        received.wait(0.01)
+    for i in range(0, ACTIVATIONS):
+        received.clear()
+        start = time.perf_counter()
+        activator.activate("bench")
+        received.wait()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    print("activate -> callback latency on " + str(ACTIVATIONS) + " activations (ms) : p50 = " +
+          "%.3f" % percentile(latencies, 50) + ", p99 = " + "%.3f" % percentile(latencies, 99) +
+          ", max = " + "%.3f" % latencies[-1])
+
+    idle_receptors = [DominoReceptor(args_driver, {'topic': "idle" + str(i), 'treatment_callback': on_message,
+                                                   'subscriber_name': "idle receptor " + str(i)})
+                      for i in range(0, IDLE_RECEPTORS)]
+    time.sleep(1)
+    cpu_start = time.process_time()
+    time.sleep(IDLE_SECONDS)
+    print("CPU time spent by " + str(IDLE_RECEPTORS) + " idle receptors during " + str(IDLE_SECONDS) + " s : " +
+          "%.3f" % ((time.process_time() - cpu_start) * 1000) + " ms")
+    print("threads count with " + str(IDLE_RECEPTORS) + " idle receptors : " + str(threading.active_count()))
+
+    for idle_receptor in idle_receptors:
+        idle_receptor.stop()
+    receptor.stop()
+    activator.stop()
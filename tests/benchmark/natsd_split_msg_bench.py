@@ -0,0 +1,48 @@
+# Ariane CLI Python 3
+# NATS driver message splitter benchmark
+#
+# Copyright (C) 2016 echinopsii
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import timeit
+import uuid
+from ariane_clip3.driver_common import DriverTools
+from ariane_clip3.natsd import driver
+
+__author__ = 'mffrench'
+
+# print the time spent by natsd.Requester._split_msg for growing payloads : it should grow linearly
+
+if __name__ == '__main__':
+    requester = driver.Requester({'request_q': 'BENCH_Q'}, {'user': 'ariane', 'password': 'password',
+                                                             'host': 'localhost', 'port': 4222})
+    requester.max_payload = 1048576
+    typed_properties = [
+        DriverTools.property_params(DriverTools.MSG_CORRELATION_ID, str(uuid.uuid4())),
+        DriverTools.property_params('OPERATION', 'BENCH')
+    ]
+    for size in [1, 2, 4, 8, 16, 32, 64]:
+        body = 'x' * size * 1048576
+        duration = min(timeit.repeat(lambda: requester._split_msg(str(uuid.uuid4()), typed_properties, body),
+                                     number=1, repeat=3))
+        print("%4d MB body: %8.3f s (%7.1f MB/s)" % (size, duration, size / duration))
+
+    requester.max_payload = 65536
+    for count in [500, 1000, 2000, 4000, 8000]:
+        typed_properties = [DriverTools.property_params(DriverTools.MSG_CORRELATION_ID, str(uuid.uuid4()))]
+        for i in range(0, count):
+            typed_properties.append(DriverTools.property_params('property_' + str(i), 'v' * 40))
+        duration = min(timeit.repeat(lambda: requester._split_msg(str(uuid.uuid4()), typed_properties, ''),
+                                     number=1, repeat=3))
+        print("%5d properties: %8.3f s" % (count, duration))
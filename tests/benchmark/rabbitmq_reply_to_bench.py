@@ -0,0 +1,65 @@
+# Ariane CLI Python 3
+# RabbitMQ driver reply queue vs direct reply-to benchmark
+#
+# Copyright (C) 2016 echinopsii
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import timeit
+import pika
+from ariane_clip3.rabbitmq import driver
+
+__author__ = 'mffrench'
+
+# print the requester creation time and the RPC latency with an exclusive reply queue and with direct reply-to.
+# needs a RabbitMQ broker on localhost:5672 with an ariane/password user.
+
+REQUESTERS = 50
+CALLS = 2000
+
+if __name__ == '__main__':
+    rbmq_driver = driver.Driver({'type': 'RBMQ', 'user': 'ariane', 'password': 'password', 'host': 'localhost',
+                                 'port': 5672, 'rpc_timeout': 10})
+    service_connection = rbmq_driver._get_service_connection().start()
+    reply_channel = service_connection.channel()
+
+    def echo(properties, body):
+        reply_channel.basic_publish(exchange='', routing_key=properties['reply_to'], body=body,
+                                    properties=pika.BasicProperties(correlation_id=properties['correlation_id'],
+                                                                    headers={'RC': 0}))
+
+    service = rbmq_driver.make_service({'service_q': 'BENCH_Q', 'treatment_callback': echo,
+                                        'service_name': 'bench echo'})
+    # the service is started once on_start ran on its actor thread
+    service.is_started.get()
+    try:
+        for direct_reply_to in [False, True]:
+            mode = "direct reply-to" if direct_reply_to else "reply queue    "
+            start_time = timeit.default_timer()
+            requesters = [rbmq_driver.make_requester({'request_q': 'BENCH_Q', 'direct_reply_to': direct_reply_to})
+                          for i in range(0, REQUESTERS)]
+            creation_time = (timeit.default_timer() - start_time) / REQUESTERS
+            latencies = []
+            for i in range(0, CALLS):
+                start_time = timeit.default_timer()
+                requesters[i % REQUESTERS].call({'properties': {'OPERATION': 'BENCH'}, 'body': '{}'}).get()
+                latencies.append(timeit.default_timer() - start_time)
+            latencies.sort()
+            print("%s: requester creation %7.3f ms, RPC latency avg %7.3f ms, p50 %7.3f ms, p99 %7.3f ms" % (
+                mode, creation_time * 1000, sum(latencies) / CALLS * 1000, latencies[CALLS // 2] * 1000,
+                latencies[CALLS * 99 // 100] * 1000))
+            for requester in requesters:
+                requester.stop()
+                rbmq_driver.requester_registry.remove(requester)
+    finally:
+        rbmq_driver.stop()
@@ -0,0 +1,49 @@
+# Ariane CLI Python 3
+# REST driver POST payload encoding benchmark
+#
+# Copyright (C) 2016 echinopsii
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import timeit
+import uuid
+import requests
+from ariane_clip3.rest import driver
+
+__author__ = 'mffrench'
+
+# print the encode time, URL size and body size of a Container.save like POST request for growing child nodes
+# count, with the payload sent in the query string (params, previous behavior), as a form body and as a JSON body.
+# the requests are prepared only : no server is needed.
+
+URL = 'http://localhost:6969/ariane/rest/mapping/domain/containers/'
+
+if __name__ == '__main__':
+    session = requests.Session()
+    for count in [100, 1000, 5000, 20000]:
+        payload = json.dumps({
+            'containerID': str(uuid.uuid4()),
+            'containerName': 'bench container',
+            'containerChildNodesID': [str(uuid.uuid4()) for i in range(0, count)]
+        })
+        parameters = {'payload': payload, 'sessionID': str(uuid.uuid4())}
+        for post_body_encoding, kwargs in [(driver.Requester.POST_BODY_PARAMS, {'params': parameters}),
+                                           (driver.Requester.POST_BODY_FORM, {'data': parameters}),
+                                           (driver.Requester.POST_BODY_JSON, {'json': parameters})]:
+            request = requests.Request('POST', URL, **kwargs)
+            duration = min(timeit.repeat(lambda: session.prepare_request(request), number=10, repeat=3)) / 10
+            prepared = session.prepare_request(request)
+            body_size = prepared.body.__len__() if prepared.body is not None else 0
+            print("%5d child nodes, %-6s: encode %8.3f ms, URL %8d bytes, body %8d bytes" % (
+                count, post_body_encoding, duration * 1000, prepared.url.__len__(), body_size))
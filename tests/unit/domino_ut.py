@@ -43,3 +43,33 @@ class DominoTest(unittest.TestCase):
         self.assertEqual(self.msg_count, 1)
         domino_receptor.stop()
         domino_activator.stop()
+
+    def test_shared_driver(self):
+        received = {'test1': [], 'test2': []}
+        args_driver = {'type': 'Z0MQ'}
+        domino_activator = DominoActivator(args_driver)
+        receptors = [DominoReceptor(args_driver, {'topic': topic, 'treatment_callback': received[topic].append,
+                                                  'subscriber_name': "test subscriber"})
+                     for topic in sorted(received)]
+        # the receptors topics are multiplexed on the same driver subscriber
+        self.assertIs(receptors[0].driver, receptors[1].driver)
+        self.assertIs(receptors[0].subscriber, receptors[1].subscriber)
+        # activate until the subscriptions are propagated to the activator
+        while not received['test1'] or not received['test2']:
+            domino_activator.activate('test1')
+            domino_activator.activate('test2')
+            time.sleep(0.01)
+        time.sleep(0.1)
+        received['test1'].clear()
+        received['test2'].clear()
+        domino_activator.activate('test1')
+        domino_activator.activate('test2')
+        time.sleep(1)
+        self.assertEqual(received, {'test1': ["test1 GO"], 'test2': ["test2 GO"]})
+        receptors[0].stop()
+        domino_activator.activate('test1')
+        domino_activator.activate('test2')
+        time.sleep(1)
+        self.assertEqual(received, {'test1': ["test1 GO"], 'test2': ["test2 GO", "test2 GO"]})
+        receptors[1].stop()
+        domino_activator.stop()
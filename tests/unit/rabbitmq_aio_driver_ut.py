@@ -0,0 +1,242 @@
+# Ariane CLI Python 3
+# RabbitMQ asyncio driver unit tests
+#
+# Copyright (C) 2016 echinopsii
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import concurrent.futures
+import json
+import threading
+import time
+import unittest
+
+from ariane_clip3.driver_common import DriverTools
+from ariane_clip3.exceptions import ArianeError
+from ariane_clip3.rabbitmq import aio_driver
+from ariane_clip3.rabbitmq import driver
+
+
+__author__ = 'mffrench'
+
+
+class AsyncDriverTest(unittest.TestCase):
+
+    class Frame(object):
+        def __init__(self, queue=None, delivery_tag=None):
+            self.method = self
+            self.queue = queue
+            self.delivery_tag = delivery_tag
+
+    class Channel(object):
+        """
+        route the published messages to the queue consumers on the connection event loop
+        """
+        def __init__(self, connection, number):
+            self.connection = connection
+            self.number = number
+            self.is_open = True
+            self.consumers = {}
+            self.delivery_tag = 0
+            self.acks = []
+            self.close_callbacks = []
+
+        def queue_declare(self, callback, queue='', exclusive=False, auto_delete=False):
+            callback(AsyncDriverTest.Frame(queue=queue if queue else 'REPLY_Q_' + str(self.number)))
+
+        def basic_qos(self, callback, prefetch_count=0):
+            self.prefetch_count = prefetch_count
+            callback(AsyncDriverTest.Frame())
+
+        def basic_consume(self, callback, queue='', no_ack=False):
+            self.consumers[queue] = callback
+            if queue != driver.Requester.DIRECT_REPLY_TO_Q:
+                self.connection.consumers[queue] = (self, callback)
+            return 'ctag-' + queue
+
+        def basic_cancel(self, callback, consumer_tag=''):
+            self.connection.consumers.pop(consumer_tag[len('ctag-'):], None)
+            callback(AsyncDriverTest.Frame())
+
+        def basic_publish(self, exchange, routing_key, body, properties=None):
+            if routing_key == driver.Requester.DIRECT_REPLY_TO_Q + '.' + str(self.number):
+                routing_key = driver.Requester.DIRECT_REPLY_TO_Q
+            if properties.reply_to == driver.Requester.DIRECT_REPLY_TO_Q:
+                # the broker routes direct replies to the publishing channel
+                properties.reply_to = driver.Requester.DIRECT_REPLY_TO_Q + '.' + str(self.number)
+            consumer = self.connection.consumers.get(routing_key)
+            if consumer is None:
+                for channel in self.connection.channels:
+                    if routing_key.startswith(driver.Requester.DIRECT_REPLY_TO_Q) and \
+                            routing_key.endswith('.' + str(channel.number)):
+                        consumer = (channel, channel.consumers[driver.Requester.DIRECT_REPLY_TO_Q])
+            if consumer is not None:
+                channel, callback = consumer
+                channel.delivery_tag += 1
+                if not isinstance(body, bytes):
+                    body = body.encode('UTF-8')
+                self.connection.loop.call_soon(callback, channel, AsyncDriverTest.Frame(
+                    delivery_tag=channel.delivery_tag), properties, body)
+
+        def basic_ack(self, delivery_tag=0, multiple=False):
+            self.acks.append(delivery_tag)
+
+        def add_on_close_callback(self, callback):
+            self.close_callbacks.append(callback)
+
+        def close(self):
+            self.is_open = False
+            for callback in self.close_callbacks:
+                callback(self, 0, '')
+
+    class Connection(aio_driver.Connection):
+        """
+        asyncio connection without broker socket
+        """
+        def __init__(self, connection_args=None, name=None, loop=None):
+            super(AsyncDriverTest.Connection, self).__init__(connection_args, name, loop)
+            self.consumers = {}
+            self.channels = []
+
+        async def start_async(self):
+            self.loop_thread = threading.current_thread()
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.dispatch_pool_size)
+            self.is_started = True
+            return self
+
+        async def stop_async(self):
+            self.is_started = False
+            for listener in list(self.close_listeners):
+                listener()
+            self.executor.shutdown(wait=False)
+            return self
+
+        async def channel_async(self):
+            channel = AsyncDriverTest.Channel(self, self.channels.__len__() + 1)
+            self.channels.append(channel)
+            return channel
+
+    def setUp(self):
+        self.connection_args = {'user': 'ariane', 'password': 'password', 'host': 'localhost', 'port': 5672,
+                                'rpc_timeout': 5}
+        aio_driver.Driver.validate_driver_conf(self.connection_args)
+        self.connection = AsyncDriverTest.Connection(self.connection_args, "test").start()
+        self.reply_channel = self.connection.run_coroutine(self.connection.channel_async())
+
+    def tearDown(self):
+        self.connection.stop()
+
+    def echo(self, properties, body):
+        self.reply_channel.basic_publish(exchange='', routing_key=properties['reply_to'], body=body.decode('UTF-8'),
+                                         properties=driver.pika.BasicProperties(
+                                             correlation_id=properties['correlation_id'],
+                                             headers={'RC': 0, DriverTools.MSG_ACCEPT_ENCODING: 'deflate'}))
+
+    async def echo_async(self, properties, body):
+        self.echo(properties, body)
+
+    def make_service(self, treatment_callback):
+        return aio_driver.Service({'service_q': 'TEST_Q', 'treatment_callback': treatment_callback,
+                                   'connection': self.connection}, dict(self.connection_args)).start()
+
+    def make_requester(self, direct_reply_to=None, fire_and_forget=False, compression_threshold=None):
+        return aio_driver.Requester({'request_q': 'TEST_Q', 'direct_reply_to': direct_reply_to,
+                                     'fire_and_forget': fire_and_forget, 'connection': self.connection,
+                                     'compression_threshold': compression_threshold},
+                                    dict(self.connection_args)).start()
+
+    def check_concurrent_calls_async(self, requester):
+        async def calls():
+            return await asyncio.gather(*[requester.call_async({'properties': {'OPERATION': 'TEST'},
+                                                                'body': str(i)}) for i in range(0, 2000)])
+        responses = self.connection.run_coroutine(calls())
+        self.assertEqual([response.response_content for response in responses], list(range(0, 2000)))
+        self.assertFalse(requester.pending_calls)
+
+    def test_concurrent_calls_async(self):
+        self.make_service(self.echo_async)
+        self.check_concurrent_calls_async(self.make_requester())
+
+    def test_concurrent_calls_async_direct_reply_to(self):
+        self.make_service(self.echo_async)
+        requester = self.make_requester(direct_reply_to=True)
+        self.assertEqual(requester.callback_queue, driver.Requester.DIRECT_REPLY_TO_Q)
+        self.check_concurrent_calls_async(requester)
+
+    def test_concurrent_calls_threads(self):
+        # the plain treatment callback is run by the connection dispatch pool
+        service = self.make_service(self.echo)
+        requester = self.make_requester()
+        results = {}
+
+        def call(i):
+            results[i] = requester.call({'properties': {'OPERATION': 'TEST'}, 'body': str(i)}).get().response_content
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(0, 50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {i: i for i in range(0, 50)})
+        self.assertEqual(service.get_dispatch_stats()['treated'], 50)
+        self.assertEqual(sorted(service.channel.acks), list(range(1, 51)))
+
+    def test_compressed_calls(self):
+        service = self.make_service(self.echo_async)
+        requester = self.make_requester(compression_threshold=1024)
+        body = json.dumps([{'id': i, 'name': 'node ' + str(i)} for i in range(0, 1000)])
+        # not compressed until the service has advertised it can decompress
+        for i in range(0, 2):
+            response = requester.call({'properties': {'OPERATION': 'TEST'}, 'body': body})
+            self.assertEqual(response.response_content, json.loads(body))
+        self.assertEqual(requester.get_compression_stats()['TEST_Q']['compressed'], 1)
+        self.assertEqual(service.get_compression_stats()['TEST_Q']['decompressed_bytes_out'], body.__len__())
+
+    def test_blocking_call_on_loop(self):
+        requester = self.make_requester()
+
+        async def call():
+            requester.call({'properties': {'OPERATION': 'TEST'}})
+        self.assertRaises(ArianeError, self.connection.run_coroutine, call())
+
+    def test_call_on_stopped_requester(self):
+        requester = self.make_requester()
+        requester.stop()
+        self.assertRaises(ArianeError, requester.call, {'properties': {'OPERATION': 'TEST'}})
+
+    def test_stop_wakes_pending_calls(self):
+        # no service : the call waits its reply until the requester is stopped
+        requester = self.make_requester()
+        pending_call = asyncio.run_coroutine_threadsafe(
+            requester.call_async({'properties': {'OPERATION': 'TEST'}}), self.connection.loop)
+        time.sleep(0.1)
+        requester.stop()
+        self.assertRaises(ArianeError, pending_call.result, 5)
+
+    def test_fire_and_forget(self):
+        treated = []
+
+        async def treat(properties, body):
+            treated.append(body)
+        service = self.make_service(treat)
+        requester = self.make_requester(fire_and_forget=True)
+        for i in range(0, 100):
+            self.assertIsNone(requester.call({'properties': {'OPERATION': 'TEST'}, 'body': str(i)}))
+        service.stop()
+        self.assertEqual(treated, [str(i).encode('UTF-8') for i in range(0, 100)])
+        self.assertEqual(service.get_dispatch_stats()['in_flight'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,11 +15,17 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import collections
+import json
 import socket
+import threading
+import time
 import unittest
-#from unittest import mock
+import zlib
+from unittest import mock
 
 from ariane_clip3 import exceptions
+from ariane_clip3.driver_common import DriverTools, DriverCompression
 from ariane_clip3.rabbitmq import driver
 
 
@@ -239,3 +245,451 @@ class DriverConfTest(unittest.TestCase):
         })
 
 
+class RequesterConcurrentCallTest(unittest.TestCase):
+
+    connection_args = {'user': 'ariane', 'password': 'password', 'host': 'localhost', 'port': 5672,
+                       'rpc_timeout': 5}
+
+    class Method(object):
+        def __init__(self, queue):
+            self.queue = queue
+
+    class Result(object):
+        def __init__(self, queue):
+            self.method = RequesterConcurrentCallTest.Method(queue)
+
+    class Frame(object):
+        def __init__(self, delivery_tag):
+            self.method = self
+            self.NAME = 'Basic.Ack'
+            self.delivery_tag = delivery_tag
+            self.multiple = True
+
+    class Channel(object):
+        def __init__(self, connection, number):
+            self.connection = connection
+            self.number = number
+            self.consumers = {}
+            self.confirm_callback = None
+            self.delivery_tag = 0
+
+        def confirm_delivery(self, callback):
+            self.confirm_callback = callback
+            self.connection.confirm_channels.append(self)
+
+        def queue_declare(self, queue=None, exclusive=False, auto_delete=False):
+            self.connection.declared += 1
+            return RequesterConcurrentCallTest.Result(queue if queue is not None else 'REPLY_Q_' + str(self.number))
+
+        def basic_consume(self, callback, no_ack=False, queue=None):
+            self.consumers[queue] = callback
+            self.connection.consumers[queue] = (self, callback)
+
+        def basic_publish(self, exchange, routing_key, body, properties=None):
+            if self.confirm_callback is not None:
+                self.delivery_tag += 1
+                return
+            if properties.reply_to is None:
+                return
+            if properties.reply_to == driver.Requester.DIRECT_REPLY_TO_Q:
+                # the broker routes direct replies to the publishing channel
+                consumer = (self, self.consumers[properties.reply_to])
+            else:
+                consumer = self.connection.consumers[properties.reply_to]
+            self.connection.published.append((consumer, properties, body))
+
+        def close(self):
+            for queue in self.consumers:
+                self.connection.consumers.pop(queue, None)
+
+    class Connection(object):
+        """
+        echo the requests body on their reply queue, the replies of each pump round being delivered in reverse order
+        """
+        def __init__(self, parameters):
+            self.published = collections.deque()
+            self.consumers = {}
+            self.channels_count = 0
+            self.declared = 0
+            self.confirm_channels = []
+            self.hold_confirms = False
+            self.closed = False
+
+        def channel(self):
+            self.channels_count += 1
+            return RequesterConcurrentCallTest.Channel(self, self.channels_count)
+
+        def process_data_events(self):
+            time.sleep(0.005)
+            if not self.hold_confirms:
+                for channel in self.confirm_channels:
+                    channel.confirm_callback(RequesterConcurrentCallTest.Frame(channel.delivery_tag))
+            replies = []
+            while self.published:
+                consumer, properties, body = self.published.popleft()
+                # the echo service advertises it can decompress the requests
+                headers = {'RC': 0, DriverTools.MSG_ACCEPT_ENCODING: DriverCompression.CONTENT_ENCODING_DEFLATE}
+                replies.append((consumer, driver.pika.BasicProperties(correlation_id=properties.correlation_id,
+                                                                      content_encoding=properties.content_encoding,
+                                                                      headers=headers),
+                                body if isinstance(body, bytes) else body.encode('UTF-8')))
+            for (channel, callback), props, body in reversed(replies):
+                callback(channel, None, props, body)
+
+        def close(self):
+            self.closed = True
+
+    def make_requester(self, direct_reply_to=None, compression_threshold=None):
+        with mock.patch.object(driver.pika, 'BlockingConnection', self.Connection):
+            return driver.Requester({'request_q': 'TEST_Q', 'direct_reply_to': direct_reply_to,
+                                     'compression_threshold': compression_threshold},
+                                    dict(self.connection_args)).start()
+
+    def test_concurrent_calls(self):
+        self.check_concurrent_calls(self.make_requester())
+
+    def test_concurrent_calls_direct_reply_to(self):
+        requester = self.make_requester(direct_reply_to=True)
+        self.assertEqual(requester.callback_queue, driver.Requester.DIRECT_REPLY_TO_Q)
+        # the request queue only
+        self.assertEqual(requester.connection.connection.declared, 1)
+        self.check_concurrent_calls(requester)
+
+    def check_concurrent_calls(self, requester):
+        responses = {}
+
+        def call(i):
+            responses[i] = requester.call({'properties': {'id': i}, 'body': json.dumps({'id': i})}).get()
+
+        try:
+            threads = [threading.Thread(target=call, args=(i,)) for i in range(0, 16)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            requester.stop()
+        self.assertEqual(sorted(responses.keys()), list(range(0, 16)))
+        for i, response in responses.items():
+            self.assertEqual(response.rc, 0)
+            self.assertEqual(response.response_content, {'id': i})
+        self.assertEqual(requester.pending_calls, {})
+        self.assertFalse(requester.connection.is_started)
+        self.assertTrue(requester.connection.connection.closed)
+
+    def test_compressed_calls(self):
+        # the replies are echoed with the request content encoding and advertise the service accepts deflate
+        requester = self.make_requester(compression_threshold=1024)
+        body = [{'id': i, 'name': 'node ' + str(i)} for i in range(0, 1000)]
+        properties = {'OPERATION': 'TEST'}
+        try:
+            # not compressed until the service has advertised it can decompress
+            response = requester.call({'properties': properties, 'body': json.dumps(body)}).get()
+            self.assertEqual(response.response_content, body)
+            self.assertEqual(properties[DriverTools.MSG_ACCEPT_ENCODING], DriverCompression.CONTENT_ENCODING_DEFLATE)
+            self.assertEqual(requester.get_compression_stats(), {})
+            response = requester.call({'properties': {'OPERATION': 'TEST'}, 'body': json.dumps(body)}).get()
+            self.assertEqual(response.response_content, body)
+            response = requester.call({'properties': {'OPERATION': 'TEST'}, 'body': json.dumps({'id': 0})}).get()
+            self.assertEqual(response.response_content, {'id': 0})
+        finally:
+            requester.stop()
+        stats = requester.get_compression_stats()['TEST_Q']
+        self.assertEqual(stats['compressed'], 1)
+        self.assertEqual(stats['decompressed'], 1)
+        self.assertEqual(stats['compressed_bytes_in'], json.dumps(body).__len__())
+        self.assertEqual(stats['decompressed_bytes_out'], json.dumps(body).__len__())
+        self.assertGreater(stats['compression_ratio'], 5)
+
+    def test_call_on_stopped_requester(self):
+        requester = self.make_requester()
+        requester.stop()
+        self.assertRaises(exceptions.ArianeError, requester.call, {'properties': {'id': 0}})
+
+    def test_connection_pool(self):
+        my_args = dict(self.connection_args)
+        my_args['type'] = 'RBMQ'
+        my_args['connection_pool_size'] = 2
+        driver_test = driver.Driver(my_args)
+        with mock.patch.object(driver.pika, 'BlockingConnection', self.Connection):
+            requesters = [driver_test.make_requester({'request_q': 'TEST_Q_' + str(i)}) for i in range(0, 3)]
+        try:
+            self.assertEqual(driver_test.connection_pool.__len__(), 2)
+            self.assertIs(requesters[0].connection, driver_test.connection_pool[0])
+            self.assertIs(requesters[1].connection, driver_test.connection_pool[1])
+            self.assertIs(requesters[2].connection, driver_test.connection_pool[0])
+            self.assertEqual(driver_test.connection_pool[0].channels_count, 2)
+            for i, requester in enumerate(requesters):
+                response = requester.call({'properties': {'id': i}, 'body': json.dumps({'id': i})}).get()
+                self.assertEqual(response.response_content, {'id': i})
+            requesters[0].stop()
+            self.assertTrue(driver_test.connection_pool[0].is_started)
+            self.assertEqual(driver_test.connection_pool[0].channels_count, 1)
+        finally:
+            driver_test.stop()
+        self.assertEqual(driver_test.connection_pool, [])
+        for requester in requesters:
+            self.assertFalse(requester.connection.is_started)
+
+    def make_confirm_requester(self, max_outstanding):
+        with mock.patch.object(driver.pika, 'BlockingConnection', self.Connection), \
+                mock.patch.object(driver.pika.channel.Channel, 'confirm_delivery', self.Channel.confirm_delivery):
+            return driver.Requester({'request_q': 'TEST_Q', 'fire_and_forget': True, 'publisher_confirms': True,
+                                     'max_outstanding': max_outstanding}, dict(self.connection_args)).start()
+
+    def test_publisher_confirms(self):
+        requester = self.make_confirm_requester(1000)
+        try:
+            for i in range(0, 100):
+                requester.call({'properties': {'id': i}})
+            self.assertTrue(requester.wait_for_confirms(5))
+        finally:
+            requester.stop()
+        stats = requester.get_publish_stats()
+        self.assertEqual(stats['published'], 100)
+        self.assertEqual(stats['confirmed'], 100)
+        self.assertEqual(stats['nacked'], 0)
+        self.assertEqual(stats['outstanding'], 0)
+
+    def test_max_outstanding(self):
+        requester = self.make_confirm_requester(5)
+        requester.connection.connection.hold_confirms = True
+        try:
+            for i in range(0, 5):
+                requester.call({'properties': {'id': i}})
+            blocked_call = threading.Thread(target=requester.call, args=({'properties': {'id': 5}},))
+            blocked_call.start()
+            time.sleep(0.05)
+            self.assertTrue(blocked_call.is_alive())
+            stats = requester.get_publish_stats()
+            self.assertEqual(stats['unconfirmed'], 5)
+            self.assertEqual(stats['outstanding'], 5)
+            self.assertFalse(requester.wait_for_confirms(0.01))
+            requester.connection.connection.hold_confirms = False
+            blocked_call.join(1)
+            self.assertFalse(blocked_call.is_alive())
+            self.assertTrue(requester.wait_for_confirms(5))
+        finally:
+            requester.stop()
+        self.assertEqual(requester.get_publish_stats()['confirmed'], 6)
+
+
+class ConnectionWakeupTest(unittest.TestCase):
+
+    connection_args = {'user': 'ariane', 'password': 'password', 'host': 'localhost', 'port': 5672}
+
+    class ReadPoller(object):
+        def __init__(self):
+            self.poll_timeout = 10
+
+    class Connection(object):
+        """
+        a pika connection on one end of a socket pair, the other end playing the broker
+        """
+        def __init__(self, parameters):
+            self.socket, self.broker = socket.socketpair()
+            self.socket.setblocking(False)
+            self._read_poller = ConnectionWakeupTest.ReadPoller()
+            self.received = []
+            self.rounds = 0
+
+        def process_data_events(self):
+            self.rounds += 1
+            try:
+                self.received.append(self.socket.recv(4096))
+            except BlockingIOError:
+                pass
+
+        def close(self):
+            self.socket.close()
+            self.broker.close()
+
+    def setUp(self):
+        # the pump thread waits for events until it is woken up
+        self.wait_events_timeout = driver.Connection.WAIT_EVENTS_TIMEOUT
+        driver.Connection.WAIT_EVENTS_TIMEOUT = 10
+        with mock.patch.object(driver.pika, 'BlockingConnection', self.Connection):
+            self.connection = driver.Connection(dict(self.connection_args), name='test').start()
+
+    def tearDown(self):
+        self.connection.stop()
+        driver.Connection.WAIT_EVENTS_TIMEOUT = self.wait_events_timeout
+
+    def test_task_wakes_the_pump(self):
+        self.assertEqual(self.connection.connection._read_poller.poll_timeout, 0)
+        time.sleep(0.05)
+        rounds = self.connection.connection.rounds
+        self.assertLessEqual(rounds, 2)
+        for i in range(0, 10):
+            start_time = time.time()
+            self.assertEqual(self.connection.run_task(lambda: i), i)
+            self.assertLess(time.time() - start_time, 1)
+        self.assertLessEqual(self.connection.connection.rounds, rounds + 20)
+
+    def test_broker_data_wakes_the_pump(self):
+        time.sleep(0.05)
+        self.connection.connection.broker.send(b'frame')
+        start_time = time.time()
+        while not self.connection.connection.received and time.time() - start_time < 1:
+            time.sleep(0.001)
+        self.assertEqual(self.connection.connection.received, [b'frame'])
+
+    def test_stop_wakes_the_pump(self):
+        time.sleep(0.05)
+        pump = self.connection.pump
+        start_time = time.time()
+        self.connection.stop()
+        self.assertLess(time.time() - start_time, 1)
+        self.assertFalse(pump.is_alive())
+
+
+class ServiceDispatchTest(unittest.TestCase):
+
+    connection_args = {'user': 'ariane', 'password': 'password', 'host': 'localhost', 'port': 5672}
+
+    class Connection(object):
+        """
+        queue the submitted tasks until run_tasks is called, like a pump round, and record the channel acks
+        """
+        def __init__(self):
+            self.tasks = collections.deque()
+            self.acks = []
+            self.acks_lock = threading.Lock()
+
+        def submit(self, task):
+            self.tasks.append(task)
+
+        def run_tasks(self):
+            while self.tasks:
+                self.tasks.popleft()()
+
+        def basic_ack(self, delivery_tag=0, multiple=False):
+            with self.acks_lock:
+                self.acks.append((delivery_tag, multiple))
+
+        def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+            self.nacks.append((delivery_tag, requeue))
+
+    class Method(object):
+        def __init__(self, delivery_tag):
+            self.delivery_tag = delivery_tag
+
+    def make_service(self, dispatch_mode, ack_multiple=False, dispatch_pool_size=4, dispatch_queue_size=None,
+                     prefetch_count=None):
+        self.treated = []
+        self.treated_lock = threading.Lock()
+        connection = self.Connection()
+        connection.nacks = []
+        service = driver.Service({'service_q': 'TEST_Q', 'treatment_callback': self.on_request,
+                                  'service_name': 'test service', 'dispatch_mode': dispatch_mode,
+                                  'dispatch_pool_size': dispatch_pool_size, 'dispatch_queue_size': dispatch_queue_size,
+                                  'prefetch_count': prefetch_count, 'dispatch_key': 'key',
+                                  'ack_multiple': ack_multiple, 'connection': connection}, dict(self.connection_args))
+        service.channel = connection
+        return service
+
+    def on_request(self, properties, body):
+        time.sleep(0.05)
+        with self.treated_lock:
+            self.treated.append((properties['key'], properties['id']))
+
+    def dispatch(self, service):
+        service._start_dispatch_workers()
+        start_time = time.time()
+        for i in range(0, 20):
+            service._dispatch({'key': i % 4, 'id': i}, b'', i + 1)
+        service._stop_dispatch_workers()
+        duration = time.time() - start_time
+        service.connection.run_tasks()
+        return duration
+
+    def test_bad_dispatch_mode(self):
+        self.assertRaises(exceptions.ArianeConfError, self.make_service, 'bad')
+
+    def test_default_prefetch_count(self):
+        self.assertEqual(self.make_service(driver.Service.DISPATCH_INLINE).prefetch_count, 0)
+        self.assertEqual(self.make_service(driver.Service.DISPATCH_POOL).prefetch_count, 1000)
+
+    def test_dispatch_inline(self):
+        service = self.make_service(driver.Service.DISPATCH_INLINE)
+        self.dispatch(service)
+        self.assertEqual([treated[1] for treated in self.treated], list(range(0, 20)))
+        self.assertEqual(service.connection.acks, [(i, False) for i in range(1, 21)])
+
+    def test_dispatch_pool(self):
+        service = self.make_service(driver.Service.DISPATCH_POOL)
+        duration = self.dispatch(service)
+        self.assertEqual(self.treated.__len__(), 20)
+        self.assertLess(duration, 0.9)
+        self.assertEqual(sorted(service.connection.acks), [(i, False) for i in range(1, 21)])
+        stats = service.get_dispatch_stats()
+        self.assertEqual(stats['treated'], 20)
+        self.assertEqual(stats['acks'], 20)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertGreater(stats['queue_depth_max'], 0)
+
+    def test_full_dispatch_queue_requeues(self):
+        # the broker delivers more requests than the dispatch queue can hold
+        service = self.make_service(driver.Service.DISPATCH_POOL, ack_multiple=True, dispatch_pool_size=1,
+                                    dispatch_queue_size=2, prefetch_count=10)
+        service._start_dispatch_workers()
+        start_time = time.time()
+        for i in range(0, 10):
+            service.on_request(service.channel, self.Method(i + 1),
+                               driver.pika.BasicProperties(headers={'key': 0, 'id': i}), b'')
+        self.assertLess(time.time() - start_time, 0.05)
+        service._stop_dispatch_workers()
+        service.connection.run_tasks()
+        rejected = [tag for tag, requeue in service.connection.nacks]
+        self.assertGreater(rejected.__len__(), 0)
+        self.assertEqual([requeue for tag, requeue in service.connection.nacks], [True] * rejected.__len__())
+        self.assertEqual(sorted([treated[1] + 1 for treated in self.treated] + rejected), list(range(1, 11)))
+        stats = service.get_dispatch_stats()
+        self.assertEqual(stats['rejected'], rejected.__len__())
+        self.assertEqual(stats['treated'], 10 - rejected.__len__())
+        self.assertEqual(service.delivered_tags.__len__(), 0)
+        self.assertEqual(service.treated_tags, set())
+
+    def test_dispatch_pool_ack_multiple(self):
+        service = self.make_service(driver.Service.DISPATCH_POOL, ack_multiple=True)
+        self.dispatch(service)
+        self.assertEqual(service.connection.acks, [(20, True)])
+        self.assertEqual(service.get_dispatch_stats()['acks'], 1)
+        self.assertEqual(service.delivered_tags.__len__(), 0)
+        self.assertEqual(service.treated_tags, set())
+
+    def test_ack_multiple_contiguous(self):
+        service = self.make_service(driver.Service.DISPATCH_POOL, ack_multiple=True)
+        service.delivered_tags.extend([1, 2, 3, 4])
+        for delivery_tag in [2, 1, 4]:
+            service._ack(delivery_tag)
+        service.connection.run_tasks()
+        self.assertEqual(service.connection.acks, [(2, True)])
+        service._ack(3)
+        service.connection.run_tasks()
+        self.assertEqual(service.connection.acks, [(2, True), (4, True)])
+
+    def test_decompress_request(self):
+        service = self.make_service(driver.Service.DISPATCH_INLINE)
+        treated = []
+        service.cb = lambda properties, body: treated.append((properties, body))
+        body = b'x' * 10000
+        for delivery_tag, content_encoding, request_body in [(1, 'deflate', zlib.compress(body)),
+                                                             (2, None, body), (3, 'identity', body)]:
+            service.on_request(service.connection, RequesterConcurrentCallTest.Frame(delivery_tag),
+                               driver.pika.BasicProperties(headers={}, content_encoding=content_encoding),
+                               request_body)
+        self.assertEqual([treated_body for properties, treated_body in treated], [body, body, body])
+        self.assertEqual([properties['content_encoding'] for properties, treated_body in treated],
+                         [None, None, 'identity'])
+        stats = service.get_compression_stats()['TEST_Q']
+        self.assertEqual(stats['decompressed'], 1)
+        self.assertEqual(stats['decompressed_bytes_out'], body.__len__())
+
+    def test_dispatch_serial(self):
+        service = self.make_service(driver.Service.DISPATCH_SERIAL)
+        self.dispatch(service)
+        self.assertEqual(self.treated.__len__(), 20)
+        for key in range(0, 4):
+            ids = [treated[1] for treated in self.treated if treated[0] == key]
+            self.assertEqual(ids, sorted(ids))
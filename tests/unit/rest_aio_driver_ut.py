@@ -0,0 +1,159 @@
+# Ariane CLI Python 3
+# REST asyncio driver unit tests
+#
+# Copyright (C) 2016 echinopsii
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import http.server
+import json
+import threading
+import time
+import unittest
+import urllib.parse
+
+from ariane_clip3 import exceptions
+from ariane_clip3.driver_factory import DriverFactory
+from ariane_clip3.rest import aio_driver
+from ariane_clip3.rest import driver
+from tests.unit import rest_driver_ut
+
+__author__ = 'mffrench'
+
+
+class AsyncRestDriverTest(unittest.TestCase):
+
+    class Server(http.server.ThreadingHTTPServer):
+        # the concurrent calls connect at once
+        request_queue_size = 128
+        daemon_threads = True
+
+    def setUp(self):
+        self.server = self.Server(('127.0.0.1', 0), rest_driver_ut.RestDriverTest.Handler)
+        self.server.requests = []
+        self.server.version = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:' + str(self.server.server_port) + '/'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_driver_args(self, **kwargs):
+        my_args = {'type': DriverFactory.DRIVER_REST_AIO, 'base_url': self.base_url, 'user': 'ariane',
+                   'password': 'password'}
+        my_args.update(kwargs)
+        return my_args
+
+    def make_driver(self, **kwargs):
+        return DriverFactory.make(self.make_driver_args(**kwargs)).start()
+
+    def test_concurrent_calls_async(self):
+        rest_driver = self.make_driver(max_concurrency=50)
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+
+            async def calls():
+                return await asyncio.gather(*[requester.call_async({'http_operation': 'GET', 'operation_path': 'get',
+                                                                    'parameters': {'id': i}})
+                                              for i in range(0, 100)])
+            start_time = time.time()
+            responses = rest_driver.connection.run_coroutine(calls())
+            duration = time.time() - start_time
+        finally:
+            rest_driver.stop()
+        self.assertEqual([response.response_content for response in responses],
+                         [{'id': str(i)} for i in range(0, 100)])
+        # 100 calls of 0.1 sec, 50 at once
+        self.assertGreater(duration, 0.2)
+        self.assertLess(duration, 1)
+
+    def test_call_and_call_many(self):
+        rest_driver = self.make_driver()
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+            response = requester.call({'http_operation': 'GET', 'operation_path': 'get', 'parameters': {'id': 0}})
+            self.assertEqual(response.rc, 0)
+            self.assertEqual(response.response_content, {'id': '0'})
+            responses = requester.call_many([{'http_operation': 'GET', 'operation_path': 'get',
+                                              'parameters': {'id': i}} for i in range(0, 10)])
+            self.assertEqual([response.response_content for response in responses],
+                             [{'id': str(i)} for i in range(0, 10)])
+            response = requester.call({'http_operation': 'GET', 'operation_path': 'unavailable'})
+            self.assertEqual(response.rc, 503)
+            self.assertEqual(response.response_content, 'unavailable')
+        finally:
+            rest_driver.stop()
+
+    def test_post(self):
+        payload = json.dumps({'containerID': 1, 'containerChildNodesID': list(range(0, 1000))})
+        for post_body_encoding in [None, driver.Requester.POST_BODY_JSON, driver.Requester.POST_BODY_PARAMS]:
+            rest_driver = self.make_driver(post_body_encoding=post_body_encoding)
+            try:
+                requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+                echo = requester.call({'http_operation': 'POST', 'operation_path': '',
+                                       'parameters': {'payload': payload}}).response_content
+            finally:
+                rest_driver.stop()
+            if post_body_encoding is None:
+                self.assertEqual(urllib.parse.parse_qs(echo['body']), {'payload': [payload]})
+            elif post_body_encoding == driver.Requester.POST_BODY_JSON:
+                self.assertEqual(json.loads(echo['body']), {'payload': payload})
+            else:
+                self.assertEqual(urllib.parse.parse_qs(echo['query']), {'payload': [payload]})
+
+    def test_blocking_call_on_loop(self):
+        rest_driver = self.make_driver()
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+
+            async def call():
+                requester.call({'http_operation': 'GET', 'operation_path': 'get'})
+            self.assertRaises(exceptions.ArianeError, rest_driver.connection.run_coroutine, call())
+        finally:
+            rest_driver.stop()
+
+    def test_call_on_stopped_driver(self):
+        rest_driver = self.make_driver()
+        requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+        rest_driver.stop()
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertRaises(exceptions.ArianeError, loop.run_until_complete,
+                              requester.call_async({'http_operation': 'GET', 'operation_path': 'get'}))
+        finally:
+            loop.close()
+
+    def test_aio_loop(self):
+        loop = asyncio.new_event_loop()
+
+        async def run():
+            rest_driver = aio_driver.Driver(self.make_driver_args(aio_loop=loop))
+            await rest_driver.start_async()
+            try:
+                requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+                return await requester.call_many_async([{'http_operation': 'GET', 'operation_path': 'get',
+                                                         'parameters': {'id': i}} for i in range(0, 10)])
+            finally:
+                await rest_driver.stop_async()
+        try:
+            responses = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertEqual([response.response_content for response in responses],
+                         [{'id': str(i)} for i in range(0, 10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
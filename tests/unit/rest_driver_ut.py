@@ -15,4 +15,235 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import http.server
+import json
+import threading
+import time
+import unittest
+import urllib.parse
+
+from ariane_clip3 import exceptions
+from ariane_clip3.rest import driver
+
 __author__ = 'mffrench'
+
+
+class RestDriverTest(unittest.TestCase):
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        """
+        echo the GET query parameters as JSON after 0.1 sec. The /unavailable path answers 503 once then 200.
+        echo the POST query string, content type and body as JSON.
+        The /etag path answers with an ETag header and 304 to the GET matching it.
+        """
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            self.server.requests.append(url.path)
+            if url.path.endswith('/unavailable') and self.server.requests.count(url.path) == 1:
+                self.reply(503, b'unavailable')
+                return
+            if url.path.endswith('/etag'):
+                etag = '"' + str(self.server.version) + '"'
+                if self.headers['If-None-Match'] == etag:
+                    self.reply(304, b'', etag)
+                else:
+                    self.reply(200, bytes(json.dumps({'version': self.server.version}), 'utf8'), etag)
+                return
+            time.sleep(0.1)
+            self.reply(200, bytes(json.dumps(dict(urllib.parse.parse_qsl(url.query))), 'utf8'))
+
+        def do_POST(self):
+            url = urllib.parse.urlparse(self.path)
+            body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf8')
+            self.reply(200, bytes(json.dumps({'query': url.query, 'content_type': self.headers['Content-Type'],
+                                              'body': body}), 'utf8'))
+
+        def reply(self, status, body, etag=None):
+            self.send_response(status)
+            if etag is not None:
+                self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(body.__len__()))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self.Handler)
+        self.server.requests = []
+        self.server.version = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:' + str(self.server.server_port) + '/'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_driver(self, **kwargs):
+        my_args = {'type': 'REST', 'base_url': self.base_url, 'user': 'ariane', 'password': 'password'}
+        my_args.update(kwargs)
+        rest_driver = driver.Driver(my_args)
+        rest_driver.start()
+        return rest_driver
+
+    def test_pool_conf(self):
+        rest_driver = self.make_driver(pool_maxsize=32, max_retries=3, keep_alive=False)
+        try:
+            adapter = rest_driver.session.get_adapter(self.base_url)
+            self.assertEqual(adapter._pool_maxsize, 32)
+            self.assertEqual(adapter.max_retries.total, 3)
+            self.assertEqual(rest_driver.session.headers['Connection'], 'close')
+            self.assertEqual(rest_driver.executor_pool_size, 32)
+        finally:
+            rest_driver.stop()
+        self.assertIsNone(rest_driver.session)
+        self.assertIsNone(rest_driver.executor)
+
+    def test_call_many(self):
+        rest_driver = self.make_driver()
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+            start_time = time.time()
+            responses = requester.call_many([{'http_operation': 'GET', 'operation_path': 'get',
+                                              'parameters': {'id': str(i)}} for i in range(0, 10)])
+            duration = time.time() - start_time
+        finally:
+            rest_driver.stop()
+        self.assertEqual([response.response_content for response in responses],
+                         [{'id': str(i)} for i in range(0, 10)])
+        # 10 calls of 0.1 sec over 10 pooled connections
+        self.assertLess(duration, 0.5)
+
+    def test_call_many_error(self):
+        rest_driver = self.make_driver()
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+            self.assertRaises(exceptions.ArianeConfError, requester.call_many,
+                              [{'http_operation': 'GET', 'operation_path': 'get'}, {'http_operation': 'GET'}])
+        finally:
+            rest_driver.stop()
+
+    def post(self, post_body_encoding):
+        rest_driver = self.make_driver(post_body_encoding=post_body_encoding)
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+            payload = json.dumps({'containerID': 1, 'containerChildNodesID': list(range(0, 1000))})
+            response = requester.call({'http_operation': 'POST', 'operation_path': '',
+                                       'parameters': {'payload': payload}})
+        finally:
+            rest_driver.stop()
+        self.assertEqual(response.rc, 0)
+        return payload, response.response_content
+
+    def test_post_form_body(self):
+        payload, echo = self.post(None)
+        self.assertEqual(echo['query'], '')
+        self.assertEqual(echo['content_type'], 'application/x-www-form-urlencoded')
+        self.assertEqual(urllib.parse.parse_qs(echo['body']), {'payload': [payload]})
+
+    def test_post_json_body(self):
+        payload, echo = self.post(driver.Requester.POST_BODY_JSON)
+        self.assertEqual(echo['query'], '')
+        self.assertEqual(echo['content_type'], 'application/json')
+        self.assertEqual(json.loads(echo['body']), {'payload': payload})
+
+    def test_post_params(self):
+        payload, echo = self.post(driver.Requester.POST_BODY_PARAMS)
+        self.assertEqual(urllib.parse.parse_qs(echo['query']), {'payload': [payload]})
+        self.assertEqual(echo['body'], '')
+
+    def test_bad_post_body_encoding(self):
+        rest_driver = self.make_driver(post_body_encoding='xml')
+        try:
+            self.assertRaises(exceptions.ArianeConfError, rest_driver.make_requester, {'repository_path': 'rest/'})
+        finally:
+            rest_driver.stop()
+
+    def test_cache_ttl(self):
+        rest_driver = self.make_driver(cache_max_entries=2, cache_ttl=0.5)
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+            for i in [0, 0, 1, 0, 2, 0, 1]:
+                response = requester.call({'http_operation': 'GET', 'operation_path': 'get',
+                                           'parameters': {'id': str(i)}})
+                self.assertEqual(response.response_content, {'id': str(i)})
+            # LRU : 1 was evicted by 2
+            self.assertEqual(requester.get_cache_stats(), {'entries': 2, 'hits': 3, 'misses': 4, 'revalidated': 0,
+                                                           'bypassed': 0, 'invalidations': 0})
+            requester.call({'http_operation': 'GET', 'operation_path': 'get', 'parameters': {'id': '0'},
+                            'cache_bypass': True})
+            time.sleep(0.5)
+            requester.call({'http_operation': 'GET', 'operation_path': 'get', 'parameters': {'id': '0'}})
+            stats = requester.get_cache_stats()
+            self.assertEqual(stats['bypassed'], 1)
+            self.assertEqual(stats['misses'], 5)
+            requester.call({'http_operation': 'POST', 'operation_path': '', 'parameters': {'payload': '{}'}})
+            self.assertEqual(requester.get_cache_stats()['entries'], 0)
+            self.assertEqual(requester.get_cache_stats()['invalidations'], 1)
+        finally:
+            rest_driver.stop()
+        self.assertEqual(self.server.requests.__len__(), 6)
+
+    def test_cache_revalidation(self):
+        rest_driver = self.make_driver(cache_max_entries=10)
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+            for version in [0, 0, 0, 1, 1]:
+                self.server.version = version
+                response = requester.call({'http_operation': 'GET', 'operation_path': 'get/etag'})
+                self.assertEqual(response.response_content, {'version': version})
+        finally:
+            rest_driver.stop()
+        self.assertEqual(requester.get_cache_stats(), {'entries': 1, 'hits': 0, 'misses': 2, 'revalidated': 3,
+                                                       'bypassed': 0, 'invalidations': 0})
+        self.assertEqual(self.server.requests.__len__(), 5)
+
+    def test_cache_get_writes(self):
+        rest_driver = self.make_driver(cache_max_entries=10, cache_ttl=60)
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+            for operation_path in ['get', 'delete', 'delete', 'get', 'update/subnets/add', 'get']:
+                response = requester.call({'http_operation': 'GET', 'operation_path': operation_path,
+                                           'parameters': {'id': '0'}})
+                self.assertEqual(response.response_content, {'id': '0'})
+        finally:
+            rest_driver.stop()
+        # the GET writes are never served from cache and invalidate the cached reads
+        self.assertEqual(self.server.requests, ['/rest/test/get', '/rest/test/delete', '/rest/test/delete',
+                                                '/rest/test/get', '/rest/test/update/subnets/add', '/rest/test/get'])
+        self.assertEqual(requester.get_cache_stats(), {'entries': 1, 'hits': 0, 'misses': 3, 'revalidated': 0,
+                                                       'bypassed': 0, 'invalidations': 2})
+
+    def test_no_cache(self):
+        rest_driver = self.make_driver()
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+            for i in range(0, 2):
+                requester.call({'http_operation': 'GET', 'operation_path': 'etag'})
+        finally:
+            rest_driver.stop()
+        self.assertEqual(requester.get_cache_stats()['misses'], 0)
+        self.assertEqual(self.server.requests.__len__(), 2)
+
+    def test_retry(self):
+        rest_driver = self.make_driver()
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+            self.assertEqual(requester.call({'http_operation': 'GET', 'operation_path': 'unavailable'}).rc, 503)
+        finally:
+            rest_driver.stop()
+        self.server.requests = []
+        rest_driver = self.make_driver(max_retries=2)
+        try:
+            requester = rest_driver.make_requester({'repository_path': 'rest/test/'})
+            self.assertEqual(requester.call({'http_operation': 'GET', 'operation_path': 'unavailable'}).rc, 0)
+        finally:
+            rest_driver.stop()
+        self.assertEqual(self.server.requests, ['/rest/test/unavailable'] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,6 +15,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import threading
 import unittest
 import time
 from zeromq import driver
@@ -43,6 +44,99 @@ class DriverPubSubTest(unittest.TestCase):
         self.assertEqual(self.msg_count, 2)
         driver_test.stop()
 
+    def test_pub_sub_poller(self):
+        received = []
+        first = threading.Event()
+        last = threading.Event()
+
+        def on_message(msg):
+            received.append(msg)
+            first.set()
+            if msg == "test 99":
+                last.set()
+        sub_conf = {'topic': "test", 'treatment_callback': on_message, 'subscriber_name': "test subscriber"}
+        driver_test = driver.Driver({'type': 'Z0MQ'})
+        pub = driver_test.make_publisher()
+        driver_test.make_subscriber(my_args=sub_conf)
+        # publish until the subscription is propagated to the publisher
+        while not first.is_set():
+            pub.call({'topic': "test", 'msg': "ready"}).get()
+            first.wait(0.01)
+        for i in range(0, 100):
+            pub.call({'topic': "test", 'msg': str(i)})
+        self.assertTrue(last.wait(5))
+        self.assertEqual([msg for msg in received if msg != "test ready"], ["test " + str(i) for i in range(0, 100)])
+        start = time.time()
+        driver_test.stop()
+        # the subscriber thread is woken up by its control socket instead of a polling timeout
+        self.assertLess(time.time() - start, 1)
+
+    def test_multiplexed_subscriptions(self):
+        received = {'a': [], 'ab': [], 'c': []}
+        events = {"ab 2": threading.Event(), "c stop": threading.Event()}
+
+        def on_message(topic):
+            def treat(msg):
+                received[topic].append(msg)
+                if msg in events:
+                    events[msg].set()
+            return treat
+        callbacks = {topic: on_message(topic) for topic in received}
+        driver_test = driver.Driver({'type': 'Z0MQ'})
+        pub = driver_test.make_publisher()
+        subscriber = driver_test.make_subscriber(my_args={'topic': "a", 'treatment_callback': callbacks['a'],
+                                                          'subscriber_name': "test subscriber"})
+        for topic in ['ab', 'c']:
+            self.assertIs(driver_test.make_subscriber(my_args={'topic': topic, 'treatment_callback': callbacks[topic]}),
+                          subscriber)
+        self.assertEqual(sorted(subscriber.get_topics().get()), ['a', 'ab', 'c'])
+        self.assertEqual(driver_test.subscribers_registry.__len__(), 1)
+        # publish until the subscriptions are propagated to the publisher
+        while not received['c']:
+            pub.call({'topic': "c", 'msg': "ready"}).get()
+            time.sleep(0.01)
+        pub.call({'topic': "a", 'msg': "1"})
+        pub.call({'topic': "ab", 'msg': "2"})
+        self.assertTrue(events["ab 2"].wait(5))
+        subscriber.unsubscribe({'topic': "ab", 'treatment_callback': callbacks['ab']}).get()
+        pub.call({'topic': "ab", 'msg': "3"})
+        pub.call({'topic': "c", 'msg': "stop"})
+        self.assertTrue(events["c stop"].wait(5))
+        # the "a" topic matches the "ab" messages as the zmq topic filter does
+        self.assertEqual(received['a'], ["a 1", "ab 2", "ab 3"])
+        self.assertEqual(received['ab'], ["ab 2"])
+        self.assertEqual(received['c'][-1], "c stop")
+        driver_test.stop()
+
+
+class TopicTrieTest(unittest.TestCase):
+
+    def test_match(self):
+        trie = driver.TopicTrie()
+        self.assertTrue(trie.add("test", 1))
+        self.assertTrue(trie.add("test.a", 2))
+        self.assertFalse(trie.add("test", 3))
+        self.assertTrue(trie.add("other", 4))
+        self.assertEqual(trie.match("test msg"), [1, 3])
+        self.assertEqual(trie.match("test.a msg"), [1, 3, 2])
+        self.assertEqual(trie.match("tes msg"), [])
+        self.assertEqual(sorted(trie.topics()), ["other", "test", "test.a"])
+
+    def test_remove(self):
+        trie = driver.TopicTrie()
+        trie.add("test", 1)
+        trie.add("test.a", 2)
+        trie.add("test.a", 3)
+        self.assertFalse(trie.remove("test.b", 2))
+        self.assertFalse(trie.remove("test.a", 4))
+        self.assertFalse(trie.remove("test.a", 2))
+        self.assertTrue(trie.remove("test.a", 3))
+        self.assertEqual(trie.match("test.a msg"), [1])
+        self.assertTrue(trie.remove("test", 1))
+        self.assertEqual(trie.topics(), [])
+        # the branches left without callbacks are pruned
+        self.assertEqual(trie.root['children'], {})
+
 
 class DriverConfTest(unittest.TestCase):
 